@@ -0,0 +1,119 @@
+"""
+Benchmark the VPNUser changelist queries on a scratch SQLite database:
+the old per-row `_username_num` annotation against the indexed
+username_sort_key, plus the expiry filters used by sync_psw_file and
+kill_expired_users.
+
+    python benchmarks/bench_admin_changelist.py --users 100000
+
+Each query is run --repeat times and the best time is reported together with
+SQLite's query plan, so index use is visible.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+SCRATCH = tempfile.mkdtemp(prefix='bench-changelist-')
+settings.DATABASES['default']['NAME'] = os.path.join(SCRATCH, 'db.sqlite3')
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import IntegerField  # noqa: E402
+from django.db.models.functions import Cast, Substr  # noqa: E402
+
+from vpn_manager.models import VPNUser, natural_sort_key  # noqa: E402
+
+PAGE = 100
+
+
+def seed(count):
+    today = date.today()
+    batch = []
+    for i in range(count):
+        username = f'user{i}'
+        batch.append(VPNUser(
+            username=username,
+            username_sort_key=natural_sort_key(username),
+            openvpn_password=f'secret{i}',
+            is_active=i % 10 != 0,
+            expiry_date=today + timedelta(days=(i % 400) - 30),
+            has_access_server_user=i % 2 == 0,
+        ))
+        if len(batch) == 5000:
+            VPNUser.objects.bulk_create(batch)
+            batch = []
+    VPNUser.objects.bulk_create(batch)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def old_changelist():
+    qs = VPNUser.objects.annotate(
+        _username_num=Cast(Substr('username', 5), output_field=IntegerField()))
+    return qs.order_by('_username_num', '-pk')
+
+
+def new_changelist():
+    return VPNUser.objects.order_by('username_sort_key', 'username')
+
+
+def expired():
+    return VPNUser.objects.filter(is_active=True, expiry_date__lt=date.today())
+
+
+def expired_access_server():
+    return expired().filter(has_access_server_user=True).values_list('username', flat=True)
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def plan(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '; '.join(row[-1] for row in cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    seed(args.users)
+    print(f'Seeded {args.users} users in {time.perf_counter() - started:.1f}s ({SCRATCH})')
+
+    cases = [
+        ('changelist page (old annotation)', lambda: old_changelist()[:PAGE]),
+        ('changelist page (sort key)', lambda: new_changelist()[:PAGE]),
+        ('last page (old annotation)', lambda: old_changelist()[args.users - PAGE:args.users]),
+        ('last page (sort key)', lambda: new_changelist()[args.users - PAGE:args.users]),
+        ('expired users', expired),
+        ('expired Access Server users', expired_access_server),
+    ]
+    for label, build in cases:
+        seconds = best(lambda: list(build()), args.repeat)
+        print(f'{label:36} {seconds * 1000:9.2f} ms   {plan(build())}')
+
+
+if __name__ == '__main__':
+    main()
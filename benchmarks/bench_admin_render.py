@@ -0,0 +1,126 @@
+"""
+Render the VPNUser admin changelist against a scratch database and report
+latency and SQL queries per request at 10k and 100k users.
+
+    python benchmarks/bench_admin_render.py --users 10000 100000 --connected 0.2
+
+Live state comes from VPNSession rows (what collect_vpn_sessions writes), so
+a render never calls out to the VPN server: the query count stays the same
+however many users there are, and the "connected now" filter and the sort by
+session count are SQL.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRATCH = tempfile.mkdtemp(prefix='bench-admin-render-')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+os.environ['OPENVPN_PSW_FILE'] = os.path.join(SCRATCH, 'psw-file')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default']['NAME'] = os.path.join(SCRATCH, 'db.sqlite3')
+django.setup()
+settings.ALLOWED_HOSTS = ['testserver']
+settings.DEBUG = False
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.core.signals import request_started  # noqa: E402
+from django.db import connection, reset_queries  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from vpn_manager.models import VPNSession, VPNUser, natural_sort_key  # noqa: E402
+
+PAGE = 100
+
+
+def seed(count, connected):
+    VPNSession.objects.all().delete()
+    VPNUser.objects.all().delete()
+    today = date.today()
+    now = timezone.now()
+    users, sessions = [], []
+    # Every n-th user is connected, so each page has some live rows
+    step = max(1, round(1 / connected)) if connected else count + 1
+    for i in range(count):
+        username = f'user{i}'
+        users.append(VPNUser(
+            username=username, username_sort_key=natural_sort_key(username),
+            openvpn_password=f'secret{i}', expiry_date=today + timedelta(days=30),
+            has_access_server_user=False,
+        ))
+        if i % step == 0:
+            real_address = f'198.51.100.{i % 250 + 1}:{1024 + i % 60000}'
+            sessions.append(VPNSession(
+                session_key=f'{VPNSession.SOURCE_STATUS_LOG}:::{real_address}:{username}',
+                username=username, source=VPNSession.SOURCE_STATUS_LOG, real_address=real_address,
+                virtual_address=f'10.8.{i // 250 % 250}.{i % 250 + 1}',
+                connected_since=now - timedelta(minutes=i % 600), last_seen=now,
+            ))
+    VPNUser.objects.bulk_create(users, batch_size=5000)
+    VPNSession.objects.bulk_create(sessions, batch_size=5000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return len(sessions)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def measure(client, label, url, repeat):
+    client.get(url)  # warm up
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200, response.status_code
+    query_count = len(queries)  # captured_queries is lazy; read it before more requests
+    times = timed(lambda: client.get(url), repeat)
+    print(f'  {label:<22} p50={statistics.median(times) * 1000:8.2f} ms '
+          f'max={max(times) * 1000:8.2f} ms  queries={query_count}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--connected', type=float, default=0.2, help='Fraction of users online')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    # Keep the query log across requests so CaptureQueriesContext can count them
+    request_started.disconnect(reset_queries)
+    admin_user = get_user_model().objects.create_superuser('bench', 'bench@example.com', 'bench')
+    client = Client()
+    client.force_login(admin_user)
+    url = '/admin/vpn_manager/vpnuser/'
+
+    for count in args.users:
+        started = time.perf_counter()
+        connected = seed(count, args.connected)
+        print(f'{count} users, {connected} connected (seeded in {time.perf_counter() - started:.1f}s)')
+
+        measure(client, 'first page', url, args.repeat)
+        measure(client, 'middle page', f'{url}?p={count // PAGE // 2}', args.repeat)
+        measure(client, 'connected now', f'{url}?connected=yes', args.repeat)
+        measure(client, 'by sessions', f'{url}?o=-8', args.repeat)
+        change = f'{url}{VPNUser.objects.order_by("pk").values_list("pk", flat=True).first()}/change/'
+        measure(client, 'change view', change, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Bytes and time per /client-info poll: full map vs 304 vs ?since= delta.
+
+    python benchmarks/bench_client_info_delta.py --users 1000 10000 100000 --churn 0.01
+
+For each size the API serves a synthetic status file of `users` sessions. The
+harness polls it the way a node client does, then changes `churn` of the
+sessions and polls again, comparing the full JSON map, gzip, msgpack (if
+installed), a conditional GET on an unchanged snapshot and the delta.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vpn_manager.fake_mgmt_server import FakeManagementServer  # noqa: E402
+
+workdir = tempfile.mkdtemp()
+STATUS = os.path.join(workdir, 'status.log')
+SACLI = os.path.join(workdir, 'sacli')
+with open(SACLI, 'w') as f:
+    f.write('#!/bin/sh\necho "{}"\n')
+os.chmod(SACLI, 0o755)
+os.environ.update(OPEN_VPN_LOG=STATUS, SACLI_FULL_PATH=SACLI, CLIENT_INFO_SNAPSHOT_TTL='0')
+
+import client_info_api  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def write_status(server):
+    with open(STATUS, 'w') as f:
+        f.write('\n'.join(server.status_lines(2)) + '\n')
+    # Make sure the reader sees a new mtime
+    stat = os.stat(STATUS)
+    os.utime(STATUS, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def poll(client, label, **kwargs):
+    started = time.perf_counter()
+    response = client.get('/client-info', **kwargs)
+    elapsed = time.perf_counter() - started
+    size = int(response.headers.get('content-length') or len(response.content))
+    print(f'  {label:<22} {response.status_code}  {size:>10,} bytes  {elapsed * 1000:8.1f} ms')
+    return response
+
+
+def run(size, churn, rng):
+    server = FakeManagementServer()
+    cids = [server.add_client(f'user{i}') for i in range(size)]
+    write_status(server)
+    client = TestClient(client_info_api.app)
+    print(f'{size} users')
+
+    identity = {'Accept-Encoding': 'identity'}
+    first = poll(client, 'full json', headers=identity)
+    poll(client, 'full json+gzip', headers={'Accept-Encoding': 'gzip'})
+    if client_info_api.msgpack is not None:
+        poll(client, 'full msgpack+gzip', headers={'Accept': 'application/msgpack', 'Accept-Encoding': 'gzip'})
+    version = first.headers['x-client-info-version']
+    poll(client, 'unchanged (304)', headers={'If-None-Match': first.headers['etag'], **identity},
+         params={'since': version})
+
+    changed = max(1, int(size * churn))
+    for cid in rng.sample(cids, changed // 2):
+        server.remove_session(cid=cid)
+    for i in range(changed - changed // 2):
+        server.add_client(f'new{i}')
+    write_status(server)
+    response = poll(client, f'delta ({changed} changes)', headers=identity, params={'since': version})
+    body = response.json()
+    assert not body['full'] and len(body['changed']) + len(body['removed']) == changed, body
+    client.close()
+    server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--churn', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    for size in args.users:
+        run(size, args.churn, rng)
+
+
+if __name__ == '__main__':
+    main()
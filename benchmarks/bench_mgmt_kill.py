@@ -0,0 +1,89 @@
+"""
+Kill latency over the management interface: framed replies vs waiting for END.
+
+    python benchmarks/bench_mgmt_kill.py --kills 200 --legacy-timeout 0.5
+
+`kill` is answered with a single SUCCESS:/ERROR: line and never with END, so
+the old telnet-style read_until(b"END") sat out its whole timeout on every
+kill and reported success either way. The framed client returns after the
+one reply line. Half of the kills target unknown users, to check that
+failures are reported as such.
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vpn_manager.fake_mgmt_server import FakeManagementServer  # noqa: E402
+from vpn_manager.mgmt import ManagementClient  # noqa: E402
+
+
+def legacy_kill(sock, name, timeout):
+    """What kill_user used to do: send, then read until END or the timeout."""
+    sock.sendall(f'kill {name}\n'.encode())
+    sock.settimeout(timeout)
+    data = b''
+    try:
+        while b'END\n' not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    return True  # the reply was never inspected
+
+
+def report(label, timings, oks, expected):
+    wrong = sum(ok != want for ok, want in zip(oks, expected))
+    print(f'{label:<8} median {statistics.median(timings) * 1000:8.2f} ms  '
+          f'max {max(timings) * 1000:8.2f} ms  total {sum(timings):7.2f} s  wrong results {wrong}/{len(oks)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kills', type=int, default=200)
+    parser.add_argument('--legacy-kills', type=int, default=10,
+                        help='Legacy kills to time (each one waits out the timeout)')
+    parser.add_argument('--legacy-timeout', type=float, default=0.5,
+                        help='read_until timeout for the legacy path (MGMT_TIMEOUT is 5s in production)')
+    args = parser.parse_args()
+
+    server = FakeManagementServer()
+    for i in range(args.kills + args.legacy_kills):
+        server.add_client(f'user{i}')
+    server.start()
+
+    # Even kills target existing users, odd ones users that are not connected
+    names = [f'user{i}' if i % 2 == 0 else f'nobody{i}' for i in range(args.kills)]
+    expected = [i % 2 == 0 for i in range(args.kills)]
+
+    client = ManagementClient('127.0.0.1', server.port)
+    client.connect()
+    timings, oks = [], []
+    for name in names:
+        started = time.perf_counter()
+        oks.append(client.kill(name))
+        timings.append(time.perf_counter() - started)
+    client.close()
+    report('framed', timings, oks, expected)
+
+    sock = socket.create_connection(('127.0.0.1', server.port))
+    sock.recv(4096)  # banner
+    legacy = [f'user{args.kills + i}' if i % 2 == 0 else f'nobody{i}' for i in range(args.legacy_kills)]
+    timings, oks = [], []
+    for name in legacy:
+        started = time.perf_counter()
+        oks.append(legacy_kill(sock, name, args.legacy_timeout))
+        timings.append(time.perf_counter() - started)
+    sock.close()
+    report('legacy', timings, oks, [i % 2 == 0 for i in range(args.legacy_kills)])
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark psw-file updates: the old load-everything/rewrite-everything
+signal path against vpn_manager.psw_store, for 1/100/10k edits against a
+50k-line file.
+
+    python benchmarks/bench_psw_store.py --lines 50000 --edits 1 100 10000
+
+"per-edit" applies every edit as its own atomic write (a save outside any
+transaction), "coalesced" stages all edits and writes once at commit (a bulk
+admin action or import inside one transaction). The old path is measured on
+at most --old-sample edits and extrapolated, since 10k full rewrites of a
+50k-line file take minutes.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from vpn_manager.psw_store import PswFileStore  # noqa: E402
+
+
+def old_load(path):
+    users = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if ':' in line:
+                    user, pwd, max_conns = line.strip().split(':', 2)
+                    users[user] = {'password': pwd, 'max_connections': max_conns}
+    return users
+
+
+def old_write(path, users):
+    with open(path, 'w') as f:
+        for user, data in users.items():
+            f.write(f"{user}:{data['password']}:{data['max_connections']}\n")
+
+
+def seed(path, lines):
+    with open(path, 'w') as f:
+        for i in range(lines):
+            f.write(f'user{i}:secret{i}:1\n')
+
+
+def edits_for(count):
+    # Alternate password changes of existing users and brand new users
+    return [
+        (f'user{i * 7}', f'changed{i}', 2) if i % 2 else (f'new{i}', f'pw{i}', 1)
+        for i in range(count)
+    ]
+
+
+def bench_old(path, edits, sample):
+    measured = edits[:sample]
+    start = time.perf_counter()
+    for username, password, max_conns in measured:
+        users = old_load(path)
+        users[username] = {'password': password, 'max_connections': max_conns}
+        old_write(path, users)
+    elapsed = time.perf_counter() - start
+    return elapsed * len(edits) / len(measured), len(measured) < len(edits)
+
+
+def bench_per_edit(path, edits):
+    store = PswFileStore(path)
+    store.users()  # initial parse, paid once per process
+    start = time.perf_counter()
+    for username, password, max_conns in edits:
+        store.apply({username: (password, max_conns)})
+    return time.perf_counter() - start, store.writes
+
+
+def bench_coalesced(path, edits):
+    store = PswFileStore(path)
+    store.users()
+    start = time.perf_counter()
+    store.apply({username: (password, max_conns) for username, password, max_conns in edits})
+    return time.perf_counter() - start, store.writes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--edits', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--old-sample', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'psw-file')
+        print(f"{'edits':>7} {'old s':>10} {'per-edit s':>11} {'writes':>7} {'coalesced s':>12} {'writes':>7}")
+        for count in args.edits:
+            edits = edits_for(count)
+            seed(path, args.lines)
+            old, extrapolated = bench_old(path, edits, args.old_sample)
+            seed(path, args.lines)
+            per_edit, per_edit_writes = bench_per_edit(path, edits)
+            seed(path, args.lines)
+            coalesced, coalesced_writes = bench_coalesced(path, edits)
+            old_label = f"{old:.3f}{'*' if extrapolated else ''}"
+            print(f'{count:>7} {old_label:>10} {per_edit:>11.3f} {per_edit_writes:>7} '
+                  f'{coalesced:>12.3f} {coalesced_writes:>7}')
+        print('* extrapolated from --old-sample edits')
+
+
+if __name__ == '__main__':
+    main()
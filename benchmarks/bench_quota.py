@@ -0,0 +1,107 @@
+"""
+Quota enforcement cost per poll: write-behind vs one UPDATE per user and poll.
+
+    python benchmarks/bench_quota.py --users 10000 --polls 60 --poll-interval 5
+
+Runs against a throw-away SQLite database with `users` users that all have a
+monthly quota and one session each, every session moving traffic on every
+poll. The QuotaEnforcer only touches the DB when its flush interval has
+passed (or somebody crosses the quota); the naive variant writes each user's
+usage on every poll. A few users are set close to their quota to check that
+they are denied on the poll that crosses it.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.db.models import F  # noqa: E402
+from django.db.models.signals import pre_save  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from vpn_manager.models import VPNUser  # noqa: E402
+from vpn_manager.quota import QuotaEnforcer, current_period  # noqa: E402
+from vpn_manager.signals import update_psw_file_on_save  # noqa: E402
+
+QUOTA = 100 * 1024 ** 3
+
+
+def create_users(count, near):
+    VPNUser.objects.bulk_create(
+        [VPNUser(username=f'user{i}', openvpn_password='x', expiry_date=date(2100, 1, 1),
+                 has_access_server_user=False, monthly_quota=QUOTA,
+                 quota_used=QUOTA - 10 ** 6 if i < near else 0, quota_period=current_period())
+         for i in range(count)],
+        batch_size=1000,
+    )
+
+
+def run(label, step, polls, users, rng, now, interval):
+    """Feed `polls` polls of deltas to step(deltas, now); report time and writes."""
+    timings, writes = [], [0]
+
+    def count_writes(execute, sql, params, many, context):
+        if sql.lstrip().startswith(('UPDATE', 'WITH')):
+            writes[0] += 1
+        return execute(sql, params, many, context)
+
+    for poll in range(polls):
+        deltas = {f'user{i}': [rng.randrange(10 ** 6), rng.randrange(10 ** 5)] for i in range(users)}
+        now += timedelta(seconds=interval)
+        with connection.execute_wrapper(count_writes):
+            started = time.perf_counter()
+            step(deltas, now)
+            timings.append(time.perf_counter() - started)
+    writes = writes[0]
+    timings.sort()
+    print(f'{label:<12} per poll: median {timings[len(timings) // 2] * 1000:8.1f} ms  '
+          f'max {timings[-1] * 1000:8.1f} ms  total {sum(timings):6.2f} s  '
+          f'UPDATE statements {writes:,} ({writes / polls:,.1f}/poll)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--polls', type=int, default=60)
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Simulated seconds between polls')
+    parser.add_argument('--flush-interval', type=float, default=60.0)
+    parser.add_argument('--near-quota', type=int, default=5, help='Users that cross their quota on the first poll')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    call_command('migrate', verbosity=0)
+    # Only the DB side is measured: no psw file writes or outbox rows
+    pre_save.disconnect(update_psw_file_on_save, sender=VPNUser)
+    create_users(args.users, args.near_quota)
+    now = timezone.now()
+
+    enforcer = QuotaEnforcer(flush_interval=args.flush_interval, resync_interval=10 ** 9)
+    denied = []
+    run('write-behind', lambda deltas, now: denied.extend(enforcer.process(deltas, now)[0]),
+        args.polls, args.users, random.Random(args.seed), now, args.poll_interval)
+    enforcer.flush(now)
+    print(f'  denied {len(denied)} user(s) crossing their quota: {sorted(denied)[:10]}; {enforcer.stats}')
+
+    def naive(deltas, now):
+        with transaction.atomic():
+            for username, (received, sent) in deltas.items():
+                VPNUser.objects.filter(username=username).update(quota_used=F('quota_used') + received + sent)
+
+    run('naive', naive, max(1, args.polls // 10), args.users, random.Random(args.seed), now, args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
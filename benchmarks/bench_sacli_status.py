@@ -0,0 +1,107 @@
+"""
+Benchmark the old `sacli VPNStatus | jq` shell pipeline against the
+in-process streaming reader (vpn_manager.sacli_status).
+
+    python benchmarks/bench_sacli_status.py --clients 1000 10000 --repeat 5
+
+The recorded fixture in benchmarks/fixtures/vpnstatus.json is scaled up to the
+requested number of clients and served by a fake `sacli` shell script, so both
+paths pay for the same process spawn.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vpn_manager.sacli_status import read_vpn_status  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'vpnstatus.json')
+
+
+def build_fixture(directory, clients):
+    with open(FIXTURE) as f:
+        status = json.load(f)
+    daemons = sorted(status)
+    for index, daemon in enumerate(daemons):
+        template = status[daemon]['client_list'][0]
+        rows, routes = [], []
+        for n in range(index, clients, len(daemons)):
+            row = list(template)
+            row[0] = f'user{n}_AUTOLOGIN'
+            row[1] = f'203.0.{n // 250 % 250}.{n % 250}:{20000 + n % 40000}'
+            row[2] = f'172.{16 + index}.{n // 250 % 250}.{n % 250 + 2}'
+            row[8] = f'user{n}'
+            row[9] = str(n)
+            rows.append(row)
+            routes.append([row[2], row[0], row[1], row[6], row[7]])
+        status[daemon]['client_list'] = rows
+        status[daemon]['routing_table'] = routes
+    path = os.path.join(directory, f'vpnstatus-{clients}.json')
+    with open(path, 'w') as f:
+        json.dump(status, f, indent=2)
+    sacli = os.path.join(directory, f'sacli-{clients}')
+    with open(sacli, 'w') as f:
+        f.write(f'#!/bin/sh\nexec cat "{path}"\n')
+    os.chmod(sacli, 0o755)
+    return sacli
+
+
+def old_pipeline(sacli):
+    # Mirrors the previous implementation (which only saw openvpn_0)
+    result = subprocess.run(
+        f"{sacli} VPNStatus | jq '.openvpn_0.client_list'",
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True, check=True,
+    )
+    info = {}
+    for client in json.loads(result.stdout):
+        info[client[0].replace('_AUTOLOGIN', '')] = {
+            'real_address': client[1], 'virtual_address': client[2],
+        }
+    return len(info)
+
+
+def new_reader(sacli):
+    return len(read_vpn_status(sacli))
+
+
+def measure(fn, sacli, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn(sacli)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(sacli)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, statistics.median(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'clients':>8} {'path':<10} {'seen':>7} {'median ms':>10} {'py peak KiB':>12}")
+        for clients in args.clients:
+            sacli = build_fixture(directory, clients)
+            for name, fn in (('sh+jq', old_pipeline), ('streaming', new_reader)):
+                try:
+                    count, median, peak = measure(fn, sacli, args.repeat)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f'{clients:>8} {name:<10} skipped: {e}')
+                    continue
+                print(f'{clients:>8} {name:<10} {count:>7} {median * 1000:>10.1f} {peak / 1024:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
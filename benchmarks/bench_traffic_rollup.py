@@ -0,0 +1,109 @@
+"""
+Traffic accounting at scale: sample flushes, rollups and the top-users report.
+
+    python benchmarks/bench_traffic_rollup.py --users 50000 --days 7
+
+Runs against a throw-away SQLite database. It fills `days` of daily and
+hourly rollups for `users` users, then times one poll of every user through
+the TrafficMeter, flushing an hour of samples, the rollup run that follows,
+and the report queries the admin makes (which read only the rollups).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+from django.core.management import call_command  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from vpn_manager import accounting  # noqa: E402
+from vpn_manager.models import TrafficRollup, TrafficSample, VPNSession  # noqa: E402
+
+
+def timed(label, fn, summary=None):
+    started = time.perf_counter()
+    result = fn()
+    print(f'{label:<32} {(time.perf_counter() - started) * 1000:10.1f} ms  '
+          f'{summary(result) if summary else result}')
+    return result
+
+
+def fill_history(users, days, rng, now):
+    """Daily rollups for `days` days and hourly ones for the last two."""
+    today = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = []
+
+    def rollup(username, period, start):
+        rows.append(TrafficRollup(username=username, period=period, start=start,
+                                  bytes_received=rng.randrange(10 ** 9), bytes_sent=rng.randrange(10 ** 8)))
+        if len(rows) >= 10000:
+            TrafficRollup.objects.bulk_create(rows)
+            rows.clear()
+
+    for day in range(1, days + 1):
+        for i in range(users):
+            rollup(f'user{i}', TrafficRollup.PERIOD_DAY, today - timedelta(days=day))
+    for hour in range(1, 49):
+        start = today - timedelta(hours=hour)
+        for i in range(0, users, 4):  # a quarter of the users are active in any hour
+            rollup(f'user{i}', TrafficRollup.PERIOD_HOUR, start)
+    TrafficRollup.objects.bulk_create(rows)
+    return TrafficRollup.objects.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--polls', type=int, default=12, help='Sample flushes in the hour being rolled up')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    call_command('migrate', verbosity=0)
+    now = timezone.now().replace(minute=59, second=0, microsecond=0)
+
+    rows = timed('fill rollup history', lambda: fill_history(args.users, args.days, rng, now))
+    print(f'{rows:,} rollup rows for {args.users:,} users over {args.days} days')
+
+    counters = accounting.SessionCounters()
+    counters._counters, counters._expired_at = {}, now
+    meter = accounting.TrafficMeter(interval=0)
+    sessions = [VPNSession(node='', username=f'user{i}', real_address=f'10.{i // 65536}.{i // 256 % 256}.{i % 256}:1',
+                           connected_since=now - timedelta(hours=1), bytes_received=0, bytes_sent=0)
+                for i in range(args.users)]
+    start = now.replace(minute=0)
+    for poll in range(args.polls):
+        ts = start + timedelta(minutes=poll * 60 // args.polls)
+        for session in sessions:
+            session.bytes_received += rng.randrange(10 ** 6)
+            session.bytes_sent += rng.randrange(10 ** 5)
+        if poll == 0:
+            deltas = timed('deltas of one poll', lambda: counters.deltas(sessions, ts), len)
+            meter.add(deltas, ts)
+            timed('flush one sample per user', lambda: meter.flush(ts))
+        else:
+            meter.add(counters.deltas(sessions, ts), ts)
+            meter.flush(ts)
+    print(f'{TrafficSample.objects.count():,} samples in the current hour')
+
+    timed('rollup (current hour and day)', accounting.rollup)
+    timed('rollup again (idempotent)', accounting.rollup)
+    for days in (1, 7, 30):
+        timed(f'top 100 users, {days} day(s)', lambda: len(accounting.top_users(days, limit=100, now=now)))
+    timed('prune', lambda: accounting.prune(now))
+
+
+if __name__ == '__main__':
+    main()
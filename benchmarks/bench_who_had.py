@@ -0,0 +1,122 @@
+"""
+who_had() latency as the connection history grows.
+
+    python benchmarks/bench_who_had.py --rows 200000 1000000 --lookups 1000
+
+Runs against a throw-away SQLite database. The history is a year of
+sessions from `--real-ips` public addresses over a pool of `--virtual-ips`
+virtual addresses, so every address shows up many times. For each size it
+times random lookups of real and virtual addresses with who_had(), which
+scans (address, start) only over the last MAX_SPAN before the time asked,
+against the same query without that lower bound, which scans the
+address's whole history up to that time. who_had() should not slow down as
+the table grows; the unbounded query only falls behind once single
+addresses have long histories (small --virtual-ips, many --rows).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from vpn_manager.history import MAX_SPAN, who_had  # noqa: E402
+from vpn_manager.models import ConnectionInterval  # noqa: E402
+
+YEAR = timedelta(days=365)
+
+
+def fill(count, rng, args, now):
+    """Append `count` random sessions (at most MAX_SPAN long) to the history."""
+    table = ConnectionInterval._meta.db_table
+    adapt = connection.ops.adapt_datetimefield_value
+    sql = (f'INSERT INTO {table} (username, node, real_ip, real_port, virtual_ip, start, "end") '
+           f'VALUES (%s, %s, %s, %s, %s, %s, %s)')
+    rows = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for _ in range(count):
+            start = now - YEAR + timedelta(seconds=rng.randrange(int(YEAR.total_seconds())))
+            length = timedelta(seconds=min(rng.expovariate(1 / 3600), MAX_SPAN.total_seconds()))
+            real = rng.randrange(args.real_ips)
+            rows.append((f'user{real % args.users}', '', f'198.18.{real // 256 % 256}.{real % 256}',
+                         rng.randrange(1024, 65536), f'10.8.{rng.randrange(args.virtual_ips) // 256}.'
+                         f'{rng.randrange(256)}', adapt(start), adapt(start + length)))
+            if len(rows) >= 10000:
+                cursor.executemany(sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(sql, rows)
+
+
+def unbounded(address, at):
+    """who_had() without the MAX_SPAN lower bound on start."""
+    return list(ConnectionInterval.objects.filter(real_ip=address, start__lte=at, end__gte=at)) + \
+        list(ConnectionInterval.objects.filter(virtual_ip=address, start__lte=at, end__gte=at))
+
+
+def measure(label, fn, queries):
+    timings, found = [], 0
+    for address, at in queries:
+        started = time.perf_counter()
+        found += len(fn(address, at))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f'  {label:<22} median {statistics.median(timings) * 1000:7.2f} ms  '
+          f'p99 {timings[int(len(timings) * 0.99)] * 1000:7.2f} ms  max {timings[-1] * 1000:7.2f} ms  '
+          f'{found} interval(s) found')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[200000, 1000000])
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--real-ips', type=int, default=20000)
+    parser.add_argument('--virtual-ips', type=int, default=1024, help='Multiple of 256')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    call_command('migrate', verbosity=0)
+    now = timezone.now()
+
+    with connection.cursor() as cursor:
+        sql, params = ConnectionInterval.objects.filter(
+            real_ip='198.18.0.1', start__lte=now, start__gte=now - MAX_SPAN, end__gte=now).query.sql_with_params()
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        print('plan:', '; '.join(row[-1] for row in cursor.fetchall()))
+
+    total = 0
+    for size in sorted(args.rows):
+        started = time.perf_counter()
+        fill(size - total, rng, args, now)
+        total = size
+        print(f'{total:,} intervals (filled in {time.perf_counter() - started:.1f}s)')
+        lookups = []
+        for _ in range(args.lookups):
+            at = now - timedelta(seconds=rng.randrange(int(YEAR.total_seconds())))
+            if rng.random() < 0.5:
+                real = rng.randrange(args.real_ips)
+                lookups.append((f'198.18.{real // 256 % 256}.{real % 256}', at))
+            else:
+                lookups.append((f'10.8.{rng.randrange(args.virtual_ips) // 256}.{rng.randrange(256)}', at))
+        measure('who_had', who_had, lookups)
+        measure('without MAX_SPAN bound', unbounded, lookups)
+
+
+if __name__ == '__main__':
+    main()
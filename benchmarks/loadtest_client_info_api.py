@@ -0,0 +1,98 @@
+"""
+Concurrent load test for client_info_api's /client-info endpoint.
+
+    # terminal 1 (point SACLI_FULL_PATH at a real or fake sacli)
+    SACLI_FULL_PATH=/usr/sbin/sacli uvicorn client_info_api:app --port 8080
+    # terminal 2
+    python benchmarks/loadtest_client_info_api.py --url http://127.0.0.1:8080 \
+        --concurrency 50 --requests 1000
+
+Run it once against the previous (sync) API and once against the current one
+to compare p50/p99 latency. `--fake-sacli N` writes a fake sacli script that
+serves the recorded fixture scaled to N clients (with a startup delay similar
+to the real tool) and prints its path to use as SACLI_FULL_PATH.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def run(url, concurrency, total, path):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--path', default='/client-info')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--fake-sacli', type=int, metavar='CLIENTS',
+                        help='Write a fake sacli serving CLIENTS clients and exit')
+    args = parser.parse_args()
+
+    if args.fake_sacli:
+        from bench_sacli_status import build_fixture
+        directory = tempfile.mkdtemp(prefix='fake-sacli-')
+        sacli = build_fixture(directory, args.fake_sacli)
+        with open(sacli) as f:
+            script = f.read()
+        with open(sacli, 'w') as f:
+            f.write(script.replace('exec cat', 'sleep 0.3; exec cat'))
+        print(sacli)
+        return
+
+    latencies, errors, elapsed = asyncio.run(run(args.url, args.concurrency, args.requests, args.path))
+    if not latencies:
+        print(f'All {errors} requests failed')
+        return
+    print(f'requests={len(latencies)} errors={errors} concurrency={args.concurrency} '
+          f'elapsed={elapsed:.2f}s rps={len(latencies) / elapsed:.1f}')
+    print(f'p50={percentile(latencies, 50) * 1000:.1f}ms '
+          f'p99={percentile(latencies, 99) * 1000:.1f}ms '
+          f'mean={statistics.mean(latencies) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Simulate max_connections enforcement on synthetic status data.
+
+    python benchmarks/sim_max_connections.py --sessions 1000 10000 100000
+
+For each size a population of users is connected a random number of times
+(most once, a tail several times) with random start times and limits. The
+harness writes a status-version 2 file, parses it the way the collector does,
+plans the kills and checks that every user ends at or under their limit with
+their newest sessions kept. With --live the planned kills are also sent in
+one pipelined pass to a fake management interface, and its remaining client
+list is checked the same way.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vpnproject.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from vpn_manager.enforce import EPOCH, group_by_user, plan_kills  # noqa: E402
+from vpn_manager.fake_mgmt_server import FakeManagementServer  # noqa: E402
+from vpn_manager.mgmt import ManagementClient  # noqa: E402
+from vpn_manager.models import VPNSession  # noqa: E402
+from vpn_manager.status_log import StatusLogReader  # noqa: E402
+
+
+def populate(server, sessions, rng):
+    """Add `sessions` clients to the fake server; returns {username: limit}."""
+    limits = {}
+    now = int(time.time())
+    user = 0
+    added = 0
+    while added < sessions:
+        username = f'user{user}'
+        user += 1
+        # 80% connect once, the rest 2..6 times
+        count = 1 if rng.random() < 0.8 else rng.randint(2, 6)
+        limits[username] = rng.choice((0, 1, 1, 1, 2, 3))
+        for _ in range(min(count, sessions - added)):
+            server.add_client(username, connected_since=now - rng.randint(0, 86400))
+            added += 1
+    return limits
+
+
+def check(by_user, victims, limits):
+    """Every user at or under the limit, and no killed session newer than a kept one."""
+    killed = {id(session) for _, session in victims}
+    for username, sessions in by_user.items():
+        kept = [s for _, s in sessions if id(s) not in killed]
+        gone = [s for _, s in sessions if id(s) in killed]
+        limit = limits.get(username)
+        assert not limit or len(kept) <= limit, (username, len(kept), limit)
+        if kept and gone:
+            assert max(s.connected_since or EPOCH for s in gone) <= min(s.connected_since or EPOCH for s in kept)
+
+
+def run(size, live, seed):
+    rng = random.Random(seed)
+    server = FakeManagementServer()
+    limits = populate(server, size, rng)
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+        f.write('\n'.join(server.status_lines(2)) + '\n')
+        path = f.name
+
+    started = time.perf_counter()
+    sessions = StatusLogReader(path).snapshot().sessions
+    parsed = time.perf_counter()
+    by_user = group_by_user({VPNSession.SOURCE_STATUS_LOG: sessions})
+    victims = plan_kills(by_user, limits)
+    planned = time.perf_counter()
+    check(by_user, victims, limits)
+    print(f'{size:>7} sessions {len(by_user):>7} users: {len(victims):>6} to kill, '
+          f'parse={1000 * (parsed - started):7.1f} ms plan={1000 * (planned - parsed):7.1f} ms '
+          f'({1e6 * (planned - parsed) / max(size, 1):.2f} us/session)')
+
+    if live:
+        server.start()
+        client = ManagementClient('127.0.0.1', server.port, timeout=30)
+        started = time.perf_counter()
+        oks = client.kill_sessions(session for _, session in victims)
+        elapsed = time.perf_counter() - started
+        client.close()
+        remaining = Counter(c['common_name'] for c in server.clients.values())
+        over = [u for u, n in remaining.items() if limits.get(u) and n > limits[u]]
+        print(f'{"":>7} live: killed {sum(oks)}/{len(oks)} in one pass, {elapsed * 1000:.1f} ms, '
+              f'users still over limit: {len(over)}')
+        server.stop()
+    else:
+        server.server_close()
+    os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--live', action='store_true',
+                        help='Also kill through a fake management interface')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    for size in args.sessions:
+        run(size, args.live, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Drive the asyncio management listener against the scripted fake server.
+
+    python benchmarks/sim_mgmt_listener.py --clients 1000 --events 20000
+
+Phases, each checked against the fake server's own client list:
+
+  initial   the table is built from `status 2` on connect
+  churn     a script of ESTABLISHED/DISCONNECT notifications is replayed
+            (with a small queue, so the reader is throttled by backpressure)
+  bytecount >BYTECOUNT_CLI bursts are coalesced into the latest counters
+  reconnect the connection is dropped, clients change while disconnected,
+            and the resync on reconnect brings the table back in line
+  kill      sessions are killed through the listener in one pipelined pass
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vpn_manager.fake_mgmt_server import FakeManagementServer  # noqa: E402
+from vpn_manager.mgmt_listener import ManagementListener  # noqa: E402
+
+
+def expected(server):
+    with server._lock:
+        return {cid: (c['common_name'], c['real_address'], c['virtual_address'])
+                for cid, c in server.clients.items()}
+
+
+def actual(listener):
+    return {cid: (s.username, s.real_address, s.virtual_address) for cid, s in listener.sessions.items()}
+
+
+async def settle(listener, server, timeout=30.0):
+    """Wait until the listener's table matches the server; returns seconds waited."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if listener.connected.is_set() and actual(listener) == expected(server):
+            return time.perf_counter() - started
+        await asyncio.sleep(0.01)
+    want, have = expected(server), actual(listener)
+    raise AssertionError(f'table out of sync: {len(want)} expected, {len(have)} in table, '
+                         f'{len(set(want) ^ set(have))} differ')
+
+
+def report(phase, elapsed, detail=''):
+    print(f'{phase:<10} {elapsed * 1000:9.1f} ms  {detail}')
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    server = FakeManagementServer()
+    for i in range(args.clients):
+        server.add_client(f'user{i % (args.clients // 2 or 1)}')
+    server.start()
+    listener = ManagementListener('127.0.0.1', server.port, bytecount=args.bytecount,
+                                  queue_size=args.queue_size, reconnect_delay=0.05)
+    task = asyncio.create_task(listener.run())
+
+    # initial: status 2 replay
+    started = time.perf_counter()
+    await asyncio.wait_for(listener.connected.wait(), 30)
+    elapsed = time.perf_counter() - started + await settle(listener, server)
+    report('initial', elapsed, f'{len(listener.sessions)} sessions')
+
+    # churn: a scripted burst of connects and disconnects
+    def step():
+        live = list(server.clients)
+        if live and rng.random() < 0.45:
+            server.disconnect_client(rng.choice(live))
+        else:
+            server.establish_client(f'user{rng.randrange(args.clients)}')
+
+    started = time.perf_counter()
+    thread = server.play([(0, step)] * args.events)
+    await asyncio.to_thread(thread.join)
+    elapsed = time.perf_counter() - started + await settle(listener, server)
+    report('churn', elapsed, f'{args.events} events, {args.events / elapsed:,.0f} events/s, '
+                             f'{len(listener.sessions)} sessions')
+
+    # bytecount: counters move, the listener keeps only the latest per client.
+    # Every burst carries new counters, so matching the last one means all were read.
+    started = time.perf_counter()
+    for _ in range(args.bytecount_bursts):
+        for cid in list(server.clients):
+            server.add_traffic(cid, rng.randint(1, 10 ** 6), rng.randint(1, 10 ** 6))
+        server.notify(*server.bytecount_lines())
+    want = {cid: (c['bytes_received'], c['bytes_sent']) for cid, c in server.clients.items()}
+    while {cid: (s.bytes_received, s.bytes_sent) for cid, s in listener.sessions.items()} != want:
+        if time.perf_counter() - started > 30:
+            raise AssertionError('byte counts never caught up')
+        await asyncio.sleep(0.01)
+    report('bytecount', time.perf_counter() - started,
+           f'{args.bytecount_bursts} bursts of {len(want)}, {listener.stats["coalesced"]} coalesced')
+
+    # reconnect: changes made while nobody listens are replayed from status 2
+    resyncs = listener.stats['resyncs']
+    server.drop_connections()
+    for cid in rng.sample(list(server.clients), min(len(server.clients), 100)):
+        server.remove_session(cid=cid)
+    for i in range(100):
+        server.add_client(f'late{i}')
+    started = time.perf_counter()
+    while listener.stats['resyncs'] == resyncs:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started + await settle(listener, server)
+    report('reconnect', elapsed, f'{listener.stats["reconnects"]} reconnect(s), {len(listener.sessions)} sessions')
+
+    # kill: one pipelined pass over the listener's connection
+    victims = rng.sample(listener.snapshot(), min(len(listener.sessions), args.kills))
+    started = time.perf_counter()
+    oks = await listener.kill_sessions(victims)
+    elapsed = time.perf_counter() - started + await settle(listener, server)
+    assert all(oks), f'{oks.count(False)} kill(s) failed'
+    report('kill', elapsed, f'{sum(oks)}/{len(victims)} killed, {len(listener.sessions)} sessions left')
+
+    print(f'stats: {listener.stats}')
+    listener.stop()
+    await asyncio.gather(task, return_exceptions=True)
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--kills', type=int, default=500)
+    parser.add_argument('--bytecount', type=int, default=0,
+                        help='Ask the fake server for periodic byte counts too')
+    parser.add_argument('--bytecount-bursts', type=int, default=20)
+    parser.add_argument('--queue-size', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
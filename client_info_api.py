@@ -1,88 +1,410 @@
 # client_info_api.py
-"""FastAPI app exposing get_client_info and kill_user using sacli."""
-from fastapi import FastAPI, HTTPException, Body
-from pydantic import BaseModel, Field
-import subprocess
-import json
+"""FastAPI app exposing get_client_info and kill_user using sacli.
+
+Status reads run on the event loop: sacli VPNStatus is started with
+asyncio.create_subprocess_exec, and concurrent /client-info and /sessions
+requests share one in-flight sacli call plus a short-lived snapshot.
+Disconnects go through the same SacliExecutor as the Django app (bounded
+workers, retries, one user's commands in order), bounded by a semaphore.
+
+/client-info is versioned: every changed snapshot gets a new version, sent
+as the ETag. A matching If-None-Match gets 304, ?since=<version> returns
+only the entries changed or removed since then, ?users=a,b limits the answer
+to those usernames, and responses are gzipped (or msgpack-encoded when the
+client accepts application/msgpack and msgpack is installed). When sacli
+fails, its last sessions are served again, so a failed read is not published
+as every Access Server user disconnecting.
+
+With OPENVPN_MGMT_LISTEN=1 the API holds the OpenVPN management interface
+itself: plain sessions come from the listener's always-current table instead
+of the status file, and session kills go over the same connection.
+
+The API runs on VPN nodes without Django or its settings, so it may only
+import the vpn_manager modules that do not import Django: batch, mgmt,
+mgmt_listener, sacli, sacli_status, sessions and status_log.
+"""
+import asyncio
+import hashlib
+import os
 import re
+import secrets
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+try:
+    import msgpack
+except ImportError:  # optional: JSON only
+    msgpack = None
+
+from vpn_manager.batch import BatchExecutor
+from vpn_manager.mgmt import get_management_client
+from vpn_manager.mgmt_listener import ManagementListener
+from vpn_manager.sacli import SacliExecutor, disconnect_user as disconnect_command
+from vpn_manager.sacli_status import read_vpn_status_async
+from vpn_manager.status_log import StatusLogReader
+
+SACLI = os.environ.get('SACLI_FULL_PATH', '/usr/sbin/sacli')
+# Optional plain OpenVPN status file served alongside the sacli clients
+OPEN_VPN_LOG = os.environ.get('OPEN_VPN_LOG')
+status_log = StatusLogReader(OPEN_VPN_LOG) if OPEN_VPN_LOG else None
+# Keep a live session table from the management interface (replaces the status file)
+MGMT_LISTEN = os.environ.get('OPENVPN_MGMT_LISTEN', '').lower() in ('1', 'true', 'yes', 'on')
+listener = ManagementListener() if MGMT_LISTEN else None
+
+# How long a client-info snapshot is reused before sacli is called again
+SNAPSHOT_TTL = float(os.environ.get('CLIENT_INFO_SNAPSHOT_TTL', 2))  # seconds
+# Maximum number of sacli DisconnectUser processes running at once
+DISCONNECT_CONCURRENCY = int(os.environ.get('DISCONNECT_CONCURRENCY', 4))
+DISCONNECT_TIMEOUT = 20  # seconds
+# Number of client-info versions whose changes are kept for ?since= requests
+CLIENT_INFO_HISTORY = int(os.environ.get('CLIENT_INFO_HISTORY', 256))
 
-SACLI = '/usr/sbin/sacli'
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    """Run the management listener, if enabled, for as long as the app serves."""
+    if listener is not None:
+        app.state.listener_task = asyncio.create_task(listener.run())
+    yield
+    if listener is not None:
+        listener.stop()
 
-def get_client_info():
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+class SingleFlight:
     """
-    Retrieves client info from both OpenVPN log file and from users with 
-    `has_access_server_user = True` using the sacli command, 
-    and returns a dictionary of {username: {real_address, virtual_address}}.
+    Coalesce concurrent callers into a single in-flight call of `fn` and
+    keep its result for `ttl` seconds.
     """
-    info = {}
-    # 2. Retrieve connected users with `has_access_server_user = True` using sacli command
+
+    def __init__(self, fn, ttl):
+        self.fn = fn
+        self.ttl = ttl
+        self._task = None
+        self._value = None
+        self._fetched_at = 0.0
+
+    async def get(self):
+        if self._value is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._value
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        # shield(): one cancelled request must not cancel the shared call
+        return await asyncio.shield(self._task)
+
+    async def _run(self):
+        try:
+            value = await self.fn()
+            self._value = value
+            self._fetched_at = time.monotonic()
+            return value
+        finally:
+            self._task = None
+
+    def invalidate(self):
+        self._value = None
+
+
+class StatusView:
+    """Every live session plus the legacy per-user view derived from it."""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.client_info = {session.username: session.as_info() for session in sessions}
+        self.session_dicts = [session.as_dict() for session in sessions]
+
+
+class ClientInfoHistory:
+    """
+    Versions of the client-info map. A snapshot that differs from the previous
+    one gets the next version, and its delta (changed entries, removed
+    usernames) is kept so ?since= callers only receive what changed.
+    """
+
+    def __init__(self, size=CLIENT_INFO_HISTORY):
+        # Differs after a restart, so a version from before is never mistaken for a current one
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.current = {}
+        self._deltas = deque(maxlen=size)  # (version, changed, removed)
+
+    @property
+    def tag(self):
+        return f'{self.epoch}-{self.version}'
+
+    def update(self, client_info):
+        if client_info == self.current:
+            return
+        changed = {u: info for u, info in client_info.items() if self.current.get(u) != info}
+        removed = [u for u in self.current if u not in client_info]
+        self.version += 1
+        self._deltas.append((self.version, changed, removed))
+        self.current = client_info
+
+    def since(self, tag):
+        """(changed, removed) since version `tag`, or None if it is unknown or too old."""
+        epoch, _, version = tag.partition('-')
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        version = int(version)
+        if version == self.version:
+            return {}, []
+        if not self._deltas or self._deltas[0][0] > version + 1:
+            return None  # the deltas in between were dropped
+        changed, removed = {}, set()
+        for delta_version, delta_changed, delta_removed in self._deltas:
+            if delta_version <= version:
+                continue
+            for username in delta_removed:
+                changed.pop(username, None)
+                removed.add(username)
+            for username, info in delta_changed.items():
+                changed[username] = info
+                removed.discard(username)
+        return changed, sorted(removed)
+
+
+client_info_history = ClientInfoHistory()
+# Sessions of the last successful `sacli VPNStatus`, served again while it fails
+sacli_sessions = None
+
+
+async def read_sacli_sessions():
+    """
+    Sessions of every openvpn_N daemon via `sacli VPNStatus`. If sacli fails
+    the sessions it last reported are returned, so the snapshot and version
+    only change with the other sources; with no earlier read the error is
+    raised. A node without sacli has no Access Server sessions.
+    """
+    global sacli_sessions
     try:
-        # Execute the sacli command and parse the output
-        result = subprocess.run(
-            f"{SACLI} VPNStatus | /usr/bin/jq '.openvpn_0.client_list'",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            shell=True,  # Run the command in a shell to handle the pipe
-            check=True
-            )
-        client_list = json.loads(result.stdout)
-        
-        for client in client_list:
-            # client is usually a list: [username, real_addr, virt_addr, ...]
-            username = str(client[0]).replace("_AUTOLOGIN", "")
-            real_addr = client[1] if len(client) > 1 else None
-            virt_addr = client[2] if len(client) > 2 else None
-            info[username] = {
-                'real_address': real_addr,
-                'virtual_address': virt_addr,
-            }
+        sacli_sessions = await read_vpn_status_async(SACLI)
+    except FileNotFoundError:
+        return []
     except Exception as e:
-        print(f"Error fetching client info from sacli: {e}")
+        if sacli_sessions is None:
+            raise
+        print(f"Error fetching client info from sacli, keeping its last sessions: {e}")
+    return sacli_sessions
+
+
+async def get_status():
+    """
+    Collect sessions from the OpenVPN status file (if configured) and from
+    every Access Server daemon using `sacli VPNStatus`. A user connected
+    several times keeps all of their sessions.
+    """
+    sessions = []
+    if listener is not None:
+        sessions.extend(listener.snapshot())
+    elif status_log is not None:
+        snapshot = await asyncio.to_thread(status_log.snapshot)
+        sessions.extend(snapshot.sessions)
+    sessions.extend(await read_sacli_sessions())
+    view = StatusView(sessions)
+    client_info_history.update(view.client_info)
+    return view
+
+
+async def get_client_info():
+    """Dictionary of {username: {real_address, virtual_address}}."""
+    return (await client_info_snapshot.get()).client_info
 
-    return info
 
+client_info_snapshot = SingleFlight(get_status, SNAPSHOT_TTL)
+# Every disconnect (single or batch) runs through this bounded executor
+disconnect_executor = BatchExecutor(DISCONNECT_CONCURRENCY)
+sacli_executor = SacliExecutor(
+    SACLI,
+    max_workers=DISCONNECT_CONCURRENCY,
+    retries=int(os.environ.get('SACLI_RETRIES', 2)),
+    backoff=float(os.environ.get('SACLI_RETRY_BACKOFF', 0.5)),
+    timeout=DISCONNECT_TIMEOUT,
+)
+USERNAME_RE = re.compile(r"[A-Za-z0-9_.-]+")
 
-def kill_user(username: str):
+
+async def _disconnect(username: str):
+    result = await asyncio.wrap_future(sacli_executor.submit_command(username, disconnect_command(username)))
+    if not result.ok:
+        return False, result.stderr.strip() or f"sacli exited with status {result.returncode}"
+    return True, None
+
+
+async def kill_user(username: str):
     """
     Disconnect a user via sacli. Returns (ok, error_message).
     """
-    try:
-        completed = subprocess.run(
-            [SACLI, "-u", username, "DisconnectUser"],
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=20,
-        )
-        return True, None
-    except subprocess.CalledProcessError as e:
-        # sacli returned non-zero
-        err = e.stderr.strip() if e.stderr else str(e)
-        return False, err
-    except Exception as e:
-        return False, str(e)
+    ok, err = await disconnect_executor.run(_disconnect, username)
+    if ok:
+        client_info_snapshot.invalidate()
+    return ok, err
+
+
+async def kill_users(usernames):
+    """
+    Disconnect several users via sacli with bounded parallelism.
+    Returns {username: (ok, error_message)}.
+    """
+    outcomes = await disconnect_executor.amap(_disconnect, usernames)
+    results = {
+        username: outcome if isinstance(outcome, tuple) else (False, str(outcome))
+        for username, outcome in outcomes.items()
+    }
+    if any(ok for ok, _ in results.values()):
+        client_info_snapshot.invalidate()
+    return results
+
+
+def entity_tag(version, wanted):
+    """The ETag of a /client-info answer: its version, and the ?users= filter if any."""
+    if wanted is None:
+        return f'"{version}"'
+    digest = hashlib.sha256(','.join(sorted(wanted)).encode('utf-8')).hexdigest()[:16]
+    return f'"{version}.{digest}"'
+
+
+def encode(request, body, headers):
+    """JSON, or msgpack when the client asks for it and it is installed."""
+    if msgpack is not None and 'application/msgpack' in request.headers.get('accept', ''):
+        return Response(msgpack.packb(body), media_type='application/msgpack', headers=headers)
+    return JSONResponse(body, headers=headers)
 
 
 @app.get("/client-info")
-def client_info():
+async def client_info(request: Request, since: str | None = None, users: str | None = None):
+    """
+    {username: {real_address, virtual_address}}. With ?since=<version> the
+    answer is {version, full, changed, removed} instead: the entries changed
+    and the usernames removed since that version (everything, with full=true,
+    if the version is unknown). ?users=a,b only reports those usernames.
+
+    A matching If-None-Match gets 304 only when the answer would be the same:
+    the ETag covers the ?users= filter, and with ?since= the 304 also needs
+    `since` to be the current version (otherwise the delta is sent).
+    """
     try:
-        return get_client_info()
+        await get_client_info()
     except Exception as exc:  # Repackage unexpected issues as 500 errors
         raise HTTPException(status_code=500, detail=str(exc)) from exc
+    history = client_info_history
+    wanted = {u for u in users.split(',') if u} if users is not None else None
+    etag = entity_tag(history.tag, wanted)
+    headers = {'ETag': etag, 'X-Client-Info-Version': history.tag}
+    if request.headers.get('if-none-match') == etag and since in (None, history.tag):
+        return Response(status_code=304, headers=headers)
+
+    if since is None:
+        body = history.current
+        if wanted is not None:
+            body = {u: body[u] for u in wanted if u in body}
+        return encode(request, body, headers)
+
+    delta = history.since(since)
+    changed, removed = (history.current, []) if delta is None else delta
+    if wanted is not None:
+        changed = {u: info for u, info in changed.items() if u in wanted}
+        removed = [u for u in removed if u in wanted]
+    return encode(request, {
+        'version': history.tag, 'full': delta is None, 'changed': changed, 'removed': removed,
+    }, headers)
 
 
 # --- Disconnect API ---
 
 # Option A: path param (simple curl)
 @app.get("/client/{username}/disconnect")
-def disconnect_user(username: str):
+async def disconnect_user(username: str):
     # Basic username hygiene (alnum, _, ., -) – adjust to your auth rules
-    if not re.fullmatch(r"[A-Za-z0-9_.-]+", username):
+    if not USERNAME_RE.fullmatch(username):
         raise HTTPException(status_code=400, detail="Invalid username format.")
-    ok, err = kill_user(username)
+    ok, err = await kill_user(username)
     if ok:
         return {"ok": True, "username": username, "message": "Disconnected."}
     raise HTTPException(status_code=500, detail=err or "Failed to disconnect user.")
+
+
+# Option B: batch of usernames in a JSON body
+class DisconnectBatch(BaseModel):
+    usernames: list[str] = Field(..., max_length=5000)
+
+
+@app.post("/clients/disconnect")
+async def disconnect_users(batch: DisconnectBatch):
+    invalid = [u for u in batch.usernames if not USERNAME_RE.fullmatch(u)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid username format: {', '.join(invalid[:20])}")
+    results = await kill_users(batch.usernames)
+    return {
+        "ok": all(ok for ok, _ in results.values()),
+        "results": {
+            username: {"ok": ok, "error": err}
+            for username, (ok, err) in results.items()
+        },
+    }
+
+
+# --- Sessions API (max_connections enforcement) ---
+
+@app.get("/sessions")
+async def sessions():
+    """Every live session, including several per user."""
+    try:
+        return (await client_info_snapshot.get()).session_dicts
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+
+
+class SessionRef(BaseModel):
+    username: str
+    real_address: str = ''
+    client_id: int | None = None
+    daemon: str | None = None
+
+
+class SessionKillBatch(BaseModel):
+    sessions: list[SessionRef] = Field(..., max_length=5000)
+
+
+def _kill_status_log_sessions(refs):
+    try:
+        return get_management_client().kill_sessions(refs), None
+    except Exception as e:
+        return [False] * len(refs), str(e)
+
+
+@app.post("/sessions/kill")
+async def kill_sessions(batch: SessionKillBatch):
+    """
+    Disconnect individual sessions. Plain OpenVPN sessions (no daemon) are
+    killed through the management interface in one pipelined pass; sacli can
+    only disconnect a user as a whole, so Access Server sessions are refused.
+    """
+    plain = [ref for ref in batch.sessions if not ref.daemon]
+    if not plain:
+        oks, err = [], None
+    elif listener is not None:
+        oks, err = await listener.kill_sessions(plain), None
+    else:
+        oks, err = await asyncio.to_thread(_kill_status_log_sessions, plain)
+    killed = iter(oks)
+    results = []
+    for ref in batch.sessions:
+        if ref.daemon:
+            ok, error = False, "Access Server sessions can only be disconnected per user"
+        else:
+            ok = next(killed)
+            error = None if ok else err or "session not found"
+        results.append({"username": ref.username, "real_address": ref.real_address, "ok": ok, "error": error})
+    if any(result["ok"] for result in results):
+        client_info_snapshot.invalidate()
+    return {"ok": all(result["ok"] for result in results), "results": results}
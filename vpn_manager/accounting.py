@@ -0,0 +1,274 @@
+"""
+Per-user traffic accounting.
+
+The session collector (and the management listener) hand every poll's
+sessions to SessionCounters, which turns the cumulative per-session byte
+counters into per-user deltas for the TrafficMeter and the quota enforcer.
+A session seen before contributes what its counters grew by. A new session
+contributes its counters as they are, and so does a session whose counters
+went backwards or whose connected_since changed (the client reconnected and
+the counters restarted). Deltas are summed per user in memory and written as
+one TrafficSample row per user every TRAFFIC_SAMPLE_INTERVAL seconds.
+
+rollup() folds samples into hourly TrafficRollup rows and hourly rows into
+daily ones. The current hour and day are re-rolled on every run, so the
+rollups are complete up to the last flush. prune() applies the retention
+settings. Reports and admin columns read only the rollups.
+"""
+from datetime import timedelta
+
+from decouple import config
+from django.db import connection
+from django.db.models import CharField, DateTimeField, F, Max, Min, Sum, Value
+from django.utils import timezone
+
+from .models import TrafficRollup, TrafficSample, VPNSession
+
+TRAFFIC_ACCOUNTING = config('TRAFFIC_ACCOUNTING', default=True, cast=bool)
+# Seconds of traffic summed into one TrafficSample row per user
+TRAFFIC_SAMPLE_INTERVAL = config('TRAFFIC_SAMPLE_INTERVAL', default=300, cast=float)
+TRAFFIC_SAMPLE_RETENTION_DAYS = config('TRAFFIC_SAMPLE_RETENTION_DAYS', default=3, cast=int)
+TRAFFIC_HOURLY_RETENTION_DAYS = config('TRAFFIC_HOURLY_RETENTION_DAYS', default=90, cast=int)
+TRAFFIC_DAILY_RETENTION_DAYS = config('TRAFFIC_DAILY_RETENTION_DAYS', default=730, cast=int)
+# Counters of sessions not reported for this long are forgotten
+COUNTER_TTL = timedelta(hours=1)
+BATCH_SIZE = 1000
+# Backends that support INSERT ... SELECT ... ON CONFLICT; others upsert through the ORM
+UPSERT_SELECT_VENDORS = ('sqlite', 'postgresql')
+
+
+def session_identity(session):
+    return (session.node or '', session.username, session.real_address)
+
+
+class SessionCounters:
+    """
+    Last byte counters seen per session, to turn each poll's cumulative
+    counters into per-user deltas. Shared by the traffic accounting and the
+    quota enforcer (vpn_manager.quota) so both count the same bytes.
+    """
+
+    def __init__(self):
+        # identity -> (connected_since, bytes_received, bytes_sent, last seen)
+        self._counters = None
+        self._expired_at = None
+
+    def _load(self, now):
+        # Pick up where the last process left off instead of counting every
+        # session's totals again after a restart
+        self._counters = {
+            (node, username, real_address): (connected_since, received, sent, now)
+            for node, username, real_address, connected_since, received, sent in
+            VPNSession.objects.values_list(
+                'node', 'username', 'real_address', 'connected_since', 'bytes_received', 'bytes_sent',
+            ).iterator(chunk_size=5000)
+        }
+        self._expired_at = now
+
+    def deltas(self, sessions, now):
+        """{username: [bytes_received, bytes_sent]} moved since the previous poll."""
+        if self._counters is None:
+            self._load(now)
+        deltas = {}
+        for session in sessions:
+            identity = session_identity(session)
+            received, sent = session.bytes_received, session.bytes_sent
+            previous = self._counters.get(identity)
+            if previous is not None and previous[0] == session.connected_since \
+                    and received >= previous[1] and sent >= previous[2]:
+                delta_received, delta_sent = received - previous[1], sent - previous[2]
+            else:
+                # New session, or the counters restarted on a reconnect
+                delta_received, delta_sent = received, sent
+            self._counters[identity] = (session.connected_since, received, sent, now)
+            if delta_received or delta_sent:
+                totals = deltas.setdefault(session.username, [0, 0])
+                totals[0] += delta_received
+                totals[1] += delta_sent
+        if now - self._expired_at >= COUNTER_TTL:
+            # Keep the counters of sessions whose source failed for a while, drop the rest
+            cutoff = now - COUNTER_TTL
+            self._counters = {k: v for k, v in self._counters.items() if v[3] >= cutoff}
+            self._expired_at = now
+        return deltas
+
+
+class TrafficMeter:
+    def __init__(self, interval=TRAFFIC_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # username -> [bytes_received, bytes_sent]
+        self._window_start = None
+
+    def add(self, deltas, now):
+        """Sum one poll's SessionCounters.deltas() into the current sample window."""
+        if self._window_start is None:
+            self._window_start = now
+        for username, (received, sent) in deltas.items():
+            totals = self._pending.setdefault(username, [0, 0])
+            totals[0] += received
+            totals[1] += sent
+
+    def due(self, now):
+        return self._window_start is not None and (now - self._window_start).total_seconds() >= self.interval
+
+    def flush(self, now):
+        """Write one TrafficSample per user with traffic since the last flush."""
+        pending, self._pending = self._pending, {}
+        self._window_start = now
+        TrafficSample.objects.bulk_create(
+            [TrafficSample(username=username, ts=now, bytes_received=received, bytes_sent=sent)
+             for username, (received, sent) in pending.items()],
+            batch_size=BATCH_SIZE,
+        )
+        return len(pending)
+
+
+session_counters = SessionCounters()
+traffic_meter = TrafficMeter()
+
+
+def _upsert(rows):
+    TrafficRollup.objects.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['period', 'start', 'username'],
+        update_fields=['bytes_received', 'bytes_sent'],
+    )
+
+
+def _upsert_select(grouped, period, start):
+    """
+    INSERT ... SELECT ... ON CONFLICT: the database sums and upserts a whole
+    bucket itself instead of every row passing through the ORM.
+    """
+    grouped = grouped.annotate(
+        rollup_period=Value(period, output_field=CharField()),
+        rollup_start=Value(start, output_field=DateTimeField()),
+        received=Sum('bytes_received'),
+        sent=Sum('bytes_sent'),
+    ).values_list('username', 'rollup_period', 'rollup_start', 'received', 'sent')
+    sql, params = grouped.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TrafficRollup._meta.db_table} '
+            f'(username, period, start, bytes_received, bytes_sent) {sql} '
+            f'ON CONFLICT (period, start, username) DO UPDATE SET '
+            f'bytes_received = excluded.bytes_received, bytes_sent = excluded.bytes_sent',
+            params,
+        )
+        return cursor.rowcount
+
+
+def _roll(queryset, field, period, start, end, step):
+    """
+    Upsert per-user sums of `queryset` as `period` rollups, one bucket of
+    length `step` at a time from `start` until `end`. Buckets are plain
+    range filters on the indexed time column, no per-row date truncation.
+    Returns the number of rows written.
+    """
+    written = 0
+    while start < end:
+        bucket_end = start + step
+        if period == TrafficRollup.PERIOD_DAY:
+            # A local day is not always 24 hours (DST)
+            bucket_end = start_of_day(bucket_end)
+        grouped = queryset.filter(**{f'{field}__gte': start, f'{field}__lt': bucket_end}).values(
+            'username').order_by()
+        if connection.vendor in UPSERT_SELECT_VENDORS:
+            written += _upsert_select(grouped, period, start)
+            start = bucket_end
+            continue
+        rows = []
+        grouped = grouped.annotate(received=Sum('bytes_received'), sent=Sum('bytes_sent'))
+        for row in grouped.iterator(chunk_size=5000):
+            rows.append(TrafficRollup(username=row['username'], period=period, start=start,
+                                      bytes_received=row['received'], bytes_sent=row['sent']))
+            if len(rows) >= BATCH_SIZE:
+                _upsert(rows)
+                written += len(rows)
+                rows = []
+        if rows:
+            _upsert(rows)
+            written += len(rows)
+        start = bucket_end
+    return written
+
+
+def start_of_day(value):
+    return timezone.localtime(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup(now=None):
+    """
+    Roll samples up into hours and hours into days, from the last rolled
+    bucket (inclusive, it may have been partial) to now. Returns the number
+    of hourly and daily rows written.
+    """
+    now = now or timezone.now()
+    last_hour = TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_HOUR).aggregate(Max('start'))['start__max']
+    if last_hour is None:
+        last_hour = TrafficSample.objects.aggregate(Min('ts'))['ts__min']
+    hours = 0
+    if last_hour is not None:
+        hours = _roll(TrafficSample.objects.all(), 'ts', TrafficRollup.PERIOD_HOUR,
+                      timezone.localtime(last_hour).replace(minute=0, second=0, microsecond=0), now, timedelta(hours=1))
+
+    last_day = TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_DAY).aggregate(Max('start'))['start__max']
+    if last_day is None:
+        last_day = TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_HOUR).aggregate(Min('start'))['start__min']
+    days = 0
+    if last_day is not None:
+        days = _roll(TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_HOUR), 'start', TrafficRollup.PERIOD_DAY,
+                     start_of_day(last_day), now, timedelta(hours=36))
+    return hours, days
+
+
+def prune(now=None):
+    """Delete data past its retention; never samples or hours that are not rolled up yet."""
+    now = now or timezone.now()
+    rolled_hour = TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_HOUR).aggregate(Max('start'))['start__max']
+    rolled_day = TrafficRollup.objects.filter(period=TrafficRollup.PERIOD_DAY).aggregate(Max('start'))['start__max']
+    deleted = {'samples': 0, 'hourly': 0, 'daily': 0}
+    if rolled_hour is not None:
+        cutoff = min(now - timedelta(days=TRAFFIC_SAMPLE_RETENTION_DAYS), rolled_hour)
+        deleted['samples'], _ = TrafficSample.objects.filter(ts__lt=cutoff).delete()
+    if rolled_day is not None:
+        cutoff = min(now - timedelta(days=TRAFFIC_HOURLY_RETENTION_DAYS), rolled_day)
+        deleted['hourly'], _ = TrafficRollup.objects.filter(
+            period=TrafficRollup.PERIOD_HOUR, start__lt=cutoff).delete()
+    deleted['daily'], _ = TrafficRollup.objects.filter(
+        period=TrafficRollup.PERIOD_DAY, start__lt=now - timedelta(days=TRAFFIC_DAILY_RETENTION_DAYS)).delete()
+    return deleted
+
+
+def usage_since(days, now=None):
+    """
+    Rollups covering the last `days` days: hourly ones for a day or two,
+    daily ones (whole days, today included) beyond that.
+    """
+    now = now or timezone.now()
+    if days <= 2:
+        return TrafficRollup.objects.filter(
+            period=TrafficRollup.PERIOD_HOUR, start__gte=(now - timedelta(days=days)).replace(
+                minute=0, second=0, microsecond=0))
+    today = start_of_day(now)
+    return TrafficRollup.objects.filter(
+        period=TrafficRollup.PERIOD_DAY, start__gte=today - timedelta(days=days - 1))
+
+
+def top_users(days, limit=50, now=None):
+    """[{username, received, sent, total}] of the users with the most traffic, highest first."""
+    return list(usage_since(days, now).values('username').annotate(
+        received=Sum('bytes_received'),
+        sent=Sum('bytes_sent'),
+        total=Sum(F('bytes_received') + F('bytes_sent')),
+    ).order_by('-total', 'username')[:limit])
+
+
+def format_bytes(value):
+    value = float(value or 0)
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if value < 1024 or unit == 'TB':
+            return f'{value:.0f} {unit}' if unit == 'B' else f'{value:.1f} {unit}'
+        value /= 1024
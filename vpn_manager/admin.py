@@ -1,23 +1,52 @@
+import ipaddress
 import os
-import telnetlib
+from datetime import timedelta
 from django.contrib import admin, messages
-from django.db import models, connection
-from django.db.models import F, Value, IntegerField
-from django.db.models.functions import Cast, Substr
+from django.db import models
+from django.core.paginator import Paginator
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.admin.widgets import AdminDateWidget
 from django.urls import path
 from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from decouple import config
 
-from .models import VPNUser
-from .utils import get_client_info, kill_user, get_client_info_via_api, kill_user_via_api
+from .accounting import format_bytes, start_of_day, top_users
+from .history import split_address, who_had
+from .models import ConnectionInterval, TrafficRollup, VPNSession, VPNTask, VPNUser
+from .quota import current_period
+from .utils import disconnect_users, session_routes
+
+
+TRAFFIC_REPORT_DAYS = (1, 7, 30, 90)
+TRAFFIC_REPORT_LIMIT = 100
+# An exact COUNT(*) over the connection history would be a full scan
+CONNECTION_HISTORY_COUNT_CAP = 10000
+
+
+class ConnectedFilter(admin.SimpleListFilter):
+    title = 'connected now'
+    parameter_name = 'connected'
+
+    def lookups(self, request, model_admin):
+        connected = VPNSession.objects.values('username').distinct().count()
+        return (
+            ('yes', f'Yes ({connected})'),
+            ('no', 'No'),
+        )
+
+    def queryset(self, request, queryset):
+        live = Exists(VPNSession.objects.filter(username=OuterRef('username')))
+        if self.value() == 'yes':
+            return queryset.filter(live)
+        if self.value() == 'no':
+            return queryset.filter(~live)
+        return queryset
 
-# Management interface configuration
-MGMT_HOST = config('OPENVPN_MGMT_HOST', default='127.0.0.1')
-MGMT_PORT = int(config('OPENVPN_MGMT_PORT', default=7505))
-MGMT_TIMEOUT = int(config('OPENVPN_MGMT_TIMEOUT', default=5))  # seconds
-USE_API_CLIENT = config('OPENVPN_USE_API_CLIENT', default=False, cast=bool)
 
 @admin.register(VPNUser)
 class VPNUserAdmin(admin.ModelAdmin):
@@ -29,11 +58,17 @@ class VPNUserAdmin(admin.ModelAdmin):
         'has_access_server_user',
         'max_connections',  # Added max_connections here
         'is_connected',
+        'sessions',
         'real_address',
         'virtual_address',
+        'traffic_7d',
+        'quota',
         'kill_button',
     )
-    list_filter = ('is_active',)
+    list_filter = ('is_active', 'quota_exceeded', ConnectedFilter)
+    # Natural sort ('user9' before 'user10') served by the username_sort_key index
+    ordering = ('username_sort_key', 'username')
+    actions = ('disconnect_selected',)
     search_fields = ('username',)
     formfield_overrides = {
         models.DateField: {'widget': AdminDateWidget},
@@ -50,93 +85,267 @@ class VPNUserAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        # Fetch live client info
-        self._client_info_local = get_client_info()
-        self._client_info_via_api = get_client_info_via_api() if USE_API_CLIENT else {}
-
-        self._client_info = { **self._client_info_local, **self._client_info_via_api }
-        # Annotate with the numeric part of username for natural sorting
-        vendor = connection.vendor
-        if vendor == 'postgresql':
-            from django.db.models import Func
-            class RegexpReplace(Func):
-                function = 'regexp_replace'
-                arity = 4
-
-            qs = qs.annotate(
-                _username_num=Cast(
-                    RegexpReplace(
-                        F('username'),
-                        Value(r'\D+'),
-                        Value(''),
-                        Value('g'),
-                    ),
-                    output_field=IntegerField(),
-                )
-            )
-        else:
-            # Assuming usernames have a fixed alphabetic prefix of length 4 (e.g. 'test')
-            # Adjust the 5 below if your prefix length differs +1 (start index for digits)
-            qs = qs.annotate(
-                _username_num=Cast(
-                    Substr('username', 5),
-                    output_field=IntegerField(),
-                )
-            )
-
-        # Default ordering by the annotated integer if no user-specified sort
-        if 'o' not in request.GET:
-            qs = qs.order_by('_username_num')
-        return qs
+        # Live state comes from the VPNSession table (kept current by
+        # collect_vpn_sessions), so sorting/filtering are SQL and page renders
+        # never call out to the VPN server.
+        sessions = VPNSession.objects.filter(username=OuterRef('username'))
+        first_session = sessions.order_by('connected_since', 'pk')
+        return qs.annotate(
+            session_count=Coalesce(
+                Subquery(sessions.values('username').annotate(n=Count('pk')).values('n')[:1]),
+                0,
+            ),
+            live_real_address=Subquery(first_session.values('real_address')[:1]),
+            live_virtual_address=Subquery(first_session.values('virtual_address')[:1]),
+            # Daily rollups only (today included), never the raw samples
+            traffic_7d=Subquery(
+                TrafficRollup.objects.filter(
+                    username=OuterRef('username'),
+                    period=TrafficRollup.PERIOD_DAY,
+                    start__gte=start_of_day(timezone.now()) - timedelta(days=6),
+                ).values('username').annotate(
+                    total=Sum(F('bytes_received') + F('bytes_sent')),
+                ).values('total')[:1]
+            ),
+        )
 
     def username_natural(self, obj):
         return obj.username
-    username_natural.admin_order_field = '_username_num'
+    username_natural.admin_order_field = 'username_sort_key'
     username_natural.short_description = 'Username'
 
     def is_connected(self, obj):
-        return obj.username in self._client_info
+        return obj.session_count > 0
     is_connected.boolean = True
     is_connected.short_description = 'Connected?'
+    is_connected.admin_order_field = 'session_count'
+
+    def sessions(self, obj):
+        return obj.session_count
+    sessions.short_description = 'Sessions'
+    sessions.admin_order_field = 'session_count'
 
     def real_address(self, obj):
-        return self._client_info.get(obj.username, {}).get('real_address', '')
+        return obj.live_real_address or ''
     real_address.short_description = 'Real Address'
+    real_address.admin_order_field = 'live_real_address'
 
     def virtual_address(self, obj):
-        return self._client_info.get(obj.username, {}).get('virtual_address', '')
+        return obj.live_virtual_address or ''
     virtual_address.short_description = 'Virtual Address'
+    virtual_address.admin_order_field = 'live_virtual_address'
+
+    def traffic_7d(self, obj):
+        return format_bytes(obj.traffic_7d) if obj.traffic_7d else '-'
+    traffic_7d.short_description = 'Traffic (7 days)'
+
+    def quota(self, obj):
+        if not obj.monthly_quota:
+            return '-'
+        # Usage of an earlier month is stale until the enforcer or reset_quotas touches the row
+        used = obj.quota_used if obj.quota_period == current_period() else 0
+        return f'{format_bytes(used)} / {format_bytes(obj.monthly_quota)}'
+    quota.short_description = 'Quota (this month)'
+    quota.admin_order_field = 'quota_used'
 
     def max_connections(self, obj):
         return obj.max_connections
     max_connections.short_description = 'Max Connections'
 
     def kill_button(self, obj):
-        if obj.username in self._client_info:
+        if obj.session_count:
             url = f"kill/{obj.pk}/"
             return format_html('<a class="button" href="{}">Disconnect</a>', url)
         return '-'
     kill_button.short_description = 'Disconnect'
 
+    @admin.action(description='Disconnect selected')
+    def disconnect_selected(self, request, queryset):
+        live = VPNSession.objects.filter(username__in=queryset.values('username'))
+        local_usernames, remote_usernames = session_routes(live.values_list('username', 'source', 'node'))
+        routes = disconnect_users(queryset.only('username', 'has_access_server_user'),
+                                  local_usernames, remote_usernames)
+        self.forget_disconnected(live, routes)
+        results = {username: all(oks.values()) for username, oks in routes.items()}
+
+        disconnected = sorted(username for username, ok in results.items() if ok)
+        failed = sorted(username for username, ok in results.items() if not ok)
+        not_connected = queryset.count() - len(results)
+        if disconnected:
+            self.message_user(request, f"Disconnected {len(disconnected)} user(s)", messages.SUCCESS)
+        if failed:
+            self.message_user(
+                request,
+                f"Error disconnecting {len(failed)} user(s): {', '.join(failed[:50])}",
+                messages.ERROR,
+            )
+        if not_connected:
+            self.message_user(request, f"{not_connected} selected user(s) were not connected", messages.INFO)
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path('kill/<int:pk>/', self.admin_site.admin_view(self.kill_user), name='vpnuser-kill'),
+            path('traffic/', self.admin_site.admin_view(self.traffic_report), name='vpnuser-traffic'),
         ]
         return custom_urls + urls
 
+    @staticmethod
+    def forget_disconnected(live, routes):
+        """
+        Delete the `live` sessions of the routes disconnect_users() reported
+        as killed; they stay hidden until the collector sees them again.
+        """
+        killed = {}
+        for username, oks in routes.items():
+            for route, ok in oks.items():
+                if ok:
+                    killed.setdefault(route, []).append(username)
+        for route, usernames in killed.items():
+            sessions = live.filter(username__in=usernames)
+            if route is None:
+                sessions.exclude(source=VPNSession.SOURCE_API).delete()
+            else:
+                sessions.filter(source=VPNSession.SOURCE_API, node=route).delete()
+
     def kill_user(self, request, pk, *args, **kwargs):
         obj = self.get_object(request, pk)
+        live = VPNSession.objects.filter(username=obj.username)
         try:
-            if obj.username in self._client_info_local:
-                success = kill_user(obj.username, obj.has_access_server_user)
-            elif USE_API_CLIENT and obj.username in self._client_info_via_api:
-                success = kill_user_via_api(obj.username)
-            else:
-                success = False
+            # Disconnect locally and on every node the user is connected to
+            routes = disconnect_users([obj], *session_routes(live.values_list('username', 'source', 'node')))
+            self.forget_disconnected(live, routes)
+            oks = routes.get(obj.username, {})
+            success = bool(oks) and all(oks.values())
             level = messages.SUCCESS if success else messages.ERROR
             msg = f"{'Disconnected' if success else 'Error disconnecting'} {obj.username}"
         except Exception as e:
             level, msg = messages.ERROR, f"Error disconnecting {obj.username}: {e}"
         self.message_user(request, msg, level)
         return redirect(request.META.get('HTTP_REFERER', 'admin:index'))
+
+
+    def traffic_report(self, request):
+        """Top talkers over the last N days, read from the traffic rollups."""
+        try:
+            days = int(request.GET.get('days', 7))
+        except ValueError:
+            days = 7
+        days = days if days in TRAFFIC_REPORT_DAYS else 7
+        rows = top_users(days, limit=TRAFFIC_REPORT_LIMIT)
+        for row in rows:
+            row.update(received_h=format_bytes(row['received']), sent_h=format_bytes(row['sent']),
+                       total_h=format_bytes(row['total']))
+        context = dict(
+            self.admin_site.each_context(request),
+            title=f'Traffic, last {days} day(s)',
+            opts=self.model._meta,
+            rows=rows,
+            days=days,
+            day_choices=TRAFFIC_REPORT_DAYS,
+        )
+        return TemplateResponse(request, 'admin/vpn_manager/traffic_report.html', context)
+
+
+@admin.register(VPNTask)
+class VPNTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'op', 'username', 'status', 'attempts', 'created_at', 'available_at', 'processed_at')
+    list_filter = ('status', 'op')
+    search_fields = ('username', 'idempotency_key')
+    exclude = ('payload',)  # may contain passwords
+    readonly_fields = [f.name for f in VPNTask._meta.fields if f.name != 'payload']
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(VPNSession)
+class VPNSessionAdmin(admin.ModelAdmin):
+    list_display = ('username', 'source', 'node', 'daemon', 'real_address', 'virtual_address',
+                    'bytes_received', 'bytes_sent', 'connected_since', 'last_seen')
+    list_filter = ('source', 'node', 'daemon')
+    search_fields = ('username', 'real_address', 'virtual_address')
+    ordering = ('username', 'connected_since')
+    readonly_fields = [f.name for f in VPNSession._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class CappedPaginator(Paginator):
+    """Counts at most CONNECTION_HISTORY_COUNT_CAP rows instead of the whole history."""
+
+    @cached_property
+    def count(self):
+        return self.object_list.order_by()[:CONNECTION_HISTORY_COUNT_CAP].count()
+
+
+@admin.register(ConnectionInterval)
+class ConnectionIntervalAdmin(admin.ModelAdmin):
+    list_display = ('username', 'node', 'real_address', 'virtual_ip', 'start', 'end')
+    # Searches are answered from the indexes, see get_search_results
+    search_fields = ('=username',)
+    search_help_text = ('An address (1.2.3.4, 1.2.3.4:1194 or a virtual IP), optionally followed by '
+                        '"@ 2026-10-01 12:00" to see who held it at that time, or an exact username')
+    ordering = ('-start',)
+    paginator = CappedPaginator
+    show_full_result_count = False
+    readonly_fields = [f.name for f in ConnectionInterval._meta.fields]
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        address, _, when = term.partition('@')
+        ip, port = split_address(address)
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            return queryset.filter(username=term), False
+        if not when.strip():
+            real = Q(real_ip=ip, real_port__in=[port, 0]) if port else Q(real_ip=ip)
+            return queryset.filter(real | Q(virtual_ip=ip)), False
+        at = parse_datetime(when.strip())
+        if at is None:
+            self.message_user(request, f'Cannot read the time {when.strip()!r}', messages.ERROR)
+            return queryset.none(), False
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        return queryset.filter(pk__in=[interval.pk for interval in who_had(address, at)]), False
+
+    def real_address(self, obj):
+        return obj.real_address
+    real_address.admin_order_field = 'real_ip'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TrafficRollup)
+class TrafficRollupAdmin(admin.ModelAdmin):
+    list_display = ('username', 'period', 'start', 'received', 'sent')
+    list_filter = ('period',)
+    search_fields = ('username',)
+    date_hierarchy = 'start'
+    ordering = ('-start', 'username')
+    readonly_fields = [f.name for f in TrafficRollup._meta.fields]
+
+    def received(self, obj):
+        return format_bytes(obj.bytes_received)
+    received.admin_order_field = 'bytes_received'
+
+    def sent(self, obj):
+        return format_bytes(obj.bytes_sent)
+    sent.admin_order_field = 'bytes_sent'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
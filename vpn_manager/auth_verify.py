@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+OpenVPN auth-user-pass-verify script backed by the compiled psw database
+(OPENVPN_PSW_DB, maintained by vpn_manager.psw_store).
+
+In the OpenVPN server config:
+
+    script-security 2
+    setenv OPENVPN_PSW_DB /etc/openvpn/psw-file.db
+    setenv OPEN_VPN_LOG /var/log/openvpn/status.log
+    auth-user-pass-verify /opt/vpnproject/vpn_manager/auth_verify.py via-file
+
+Both `via-file` (credentials file passed as the first argument) and `via-env`
+(`username`/`password` environment variables) are supported. The user is
+looked up with a single primary-key query and refused when it already has
+`max_connections` sessions in the status file. Exit status 0 accepts the
+client, anything else rejects it.
+"""
+import hmac
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vpn_manager.status_log import count_sessions  # noqa: E402
+
+PSW_DB = os.environ.get('OPENVPN_PSW_DB', '/etc/openvpn/psw-file.db')
+OPEN_VPN_LOG = os.environ.get('OPEN_VPN_LOG', '/var/log/openvpn/status.log')
+
+
+def read_credentials(argv):
+    if len(argv) > 1:
+        with open(argv[1], encoding='utf-8', errors='ignore') as f:
+            lines = f.read().splitlines()
+        return (lines + ['', ''])[:2]
+    return os.environ.get('username', ''), os.environ.get('password', '')
+
+
+def lookup(username, db_path=PSW_DB):
+    """Return (password, max_connections) or None."""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=5)
+    try:
+        return conn.execute(
+            'SELECT password, max_connections FROM users WHERE username = ?', (username,),
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def verify(username, password, db_path=PSW_DB, status_path=OPEN_VPN_LOG):
+    """Return (ok, reason)."""
+    if not username:
+        return False, 'empty username'
+    try:
+        row = lookup(username, db_path)
+    except sqlite3.Error as e:
+        return False, f'credential database unavailable: {e}'
+    if row is None:
+        return False, 'unknown user'
+    stored_password, max_connections = row
+    if not hmac.compare_digest(stored_password.encode('utf-8'), password.encode('utf-8')):
+        return False, 'bad password'
+    # max_connections <= 0 means unlimited
+    if max_connections > 0 and count_sessions(status_path, username) >= max_connections:
+        return False, f'max_connections ({max_connections}) reached'
+    return True, 'ok'
+
+
+def main(argv):
+    try:
+        username, password = read_credentials(argv)
+    except OSError as e:
+        print(f'auth_verify: cannot read credentials: {e}', file=sys.stderr)
+        return 1
+    ok, reason = verify(username, password)
+    if not ok:
+        print(f'auth_verify: rejecting {username!r}: {reason}', file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,55 @@
+"""
+Bounded-parallelism executor shared by every bulk operation (mass
+disconnects from the admin, the batch API endpoint and the management
+interface multi-kill).
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BATCH_CONCURRENCY = int(os.environ.get('OPENVPN_BATCH_CONCURRENCY', 8))
+
+
+class BatchExecutor:
+    """
+    Run one callable per item with at most `max_workers` running at once.
+    Results come back as {item: result}; an exception raised for an item is
+    returned as that item's result instead of aborting the whole batch.
+    """
+
+    def __init__(self, max_workers=BATCH_CONCURRENCY):
+        self.max_workers = max(1, max_workers)
+        self._semaphore = None
+
+    def map(self, fn, items):
+        items = list(dict.fromkeys(items))
+        if not items:
+            return {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            futures = {item: pool.submit(fn, item) for item in items}
+            for item, future in futures.items():
+                try:
+                    results[item] = future.result()
+                except Exception as e:
+                    results[item] = e
+        return results
+
+    @property
+    def semaphore(self):
+        # Created lazily so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    async def run(self, coro_fn, *args):
+        """Await coro_fn(*args) once a slot is free."""
+        async with self.semaphore:
+            return await coro_fn(*args)
+
+    async def amap(self, coro_fn, items):
+        items = list(dict.fromkeys(items))
+        outcomes = await asyncio.gather(
+            *(self.run(coro_fn, item) for item in items), return_exceptions=True,
+        )
+        return dict(zip(items, outcomes))
@@ -0,0 +1,169 @@
+"""
+Collect live sessions into the VPNSession table.
+
+Each poll reads the configured sources (status log, management interface,
+`sacli VPNStatus`, client info API), drops duplicates of the same session
+reported by more than one source, upserts what is connected now and deletes
+what has gone away. A source that fails keeps its previous rows instead of
+making every user look disconnected; the same goes for a single VPN node of
+the `api` source (see vpn_manager.nodes), which is queried in parallel with
+the others.
+
+Every poll's counters also feed the traffic accounting (vpn_manager.accounting)
+and the monthly quotas (vpn_manager.quota), and the sessions themselves the
+connection history (vpn_manager.history).
+"""
+from decouple import Csv, config
+from django.db import transaction
+from django.utils import timezone
+
+from .accounting import TRAFFIC_ACCOUNTING, session_counters, traffic_meter
+from .history import CONNECTION_HISTORY, connection_history
+from .mgmt import get_management_client
+from .models import VPNSession
+from .quota import QUOTA_ENFORCEMENT, quota_enforcer
+from .sacli_status import read_vpn_status
+from .utils import SACLI, get_sessions_via_api, status_log
+
+# Sources in priority order: the first one to report a session wins
+VPN_SESSION_SOURCES = config(
+    'VPN_SESSION_SOURCES',
+    default='status_log,sacli' + (',api' if config('OPENVPN_USE_API_CLIENT', default=False, cast=bool) else ''),
+    cast=Csv(),
+)
+PRIORITY = (VPNSession.SOURCE_MGMT, VPNSession.SOURCE_STATUS_LOG, VPNSession.SOURCE_SACLI, VPNSession.SOURCE_API)
+UPDATE_FIELDS = [
+    'username', 'source', 'node', 'daemon', 'client_id', 'real_address', 'virtual_address',
+    'virtual_ipv6_address', 'bytes_received', 'bytes_sent', 'connected_since', 'last_seen',
+]
+
+READERS = {
+    VPNSession.SOURCE_STATUS_LOG: lambda: status_log.snapshot().sessions,
+    VPNSession.SOURCE_MGMT: lambda: get_management_client().sessions(),
+    VPNSession.SOURCE_SACLI: lambda: list(read_vpn_status(SACLI)),
+    VPNSession.SOURCE_API: get_sessions_via_api,
+}
+
+
+def read_sources(sources=None, failed_nodes=None):
+    """
+    Return {source: [ClientSession]} for every source that could be read.
+    API nodes that did not answer are added to `failed_nodes`.
+    """
+    results = {}
+    for source in sources or VPN_SESSION_SOURCES:
+        try:
+            if source == VPNSession.SOURCE_API:
+                results[source] = get_sessions_via_api(failed_nodes)
+            else:
+                results[source] = READERS[source]()
+        except Exception as e:
+            print(f"Error reading sessions from {source}: {e}")
+    return results
+
+
+def session_key(source, session):
+    ident = session.client_id if session.client_id is not None else session.real_address
+    return f'{source}:{session.node or ""}:{session.daemon or ""}:{ident}:{session.username}'
+
+
+def distinct_sessions(results):
+    """
+    Yield (source, ClientSession) once per distinct (username, real address),
+    taking each session from the highest-priority source that reported it.
+    """
+    seen = set()
+    for source in sorted(results, key=lambda s: PRIORITY.index(s) if s in PRIORITY else len(PRIORITY)):
+        for session in results[source]:
+            if not session.username:
+                continue
+            # The status log and the management interface describe the same daemon
+            identity = (session.node, session.username, session.real_address)
+            if session.real_address and identity in seen:
+                continue
+            seen.add(identity)
+            yield source, session
+
+
+def build_rows(results, now):
+    """VPNSession objects for every distinct session."""
+    rows = {}
+    for source, session in distinct_sessions(results):
+        key = session_key(source, session)
+        rows[key] = VPNSession(
+            session_key=key,
+            username=session.username,
+            source=source,
+            node=session.node or '',
+            daemon=session.daemon or '',
+            client_id=session.client_id,
+            real_address=session.real_address,
+            virtual_address=session.virtual_address,
+            virtual_ipv6_address=session.virtual_ipv6_address,
+            bytes_received=session.bytes_received,
+            bytes_sent=session.bytes_sent,
+            connected_since=session.connected_since,
+            last_seen=now,
+        )
+    return list(rows.values())
+
+
+def store(results, now=None, failed_nodes=(), disconnect=None):
+    """
+    Upsert the sessions in `results` ({source: [ClientSession]}) and delete
+    the rows of those sources that were not seen now, except those of API
+    nodes in `failed_nodes`. Users over their quota are disconnected with
+    disconnect(users, rows) (QuotaEnforcer.disconnect by default). Returns
+    (stored, removed).
+    """
+    now = now or timezone.now()
+    rows = build_rows(results, now)
+    deltas = session_counters.deltas(rows, now) if TRAFFIC_ACCOUNTING or QUOTA_ENFORCEMENT else {}
+    if TRAFFIC_ACCOUNTING:
+        traffic_meter.add(deltas, now)
+    if CONNECTION_HISTORY:
+        connection_history.observe(rows, results, failed_nodes, now)
+    with transaction.atomic():
+        if TRAFFIC_ACCOUNTING and traffic_meter.due(now):
+            traffic_meter.flush(now)
+        if CONNECTION_HISTORY and connection_history.due(now):
+            connection_history.flush(now)
+        if rows:
+            VPNSession.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['session_key'],
+                update_fields=UPDATE_FIELDS,
+            )
+        # Only sources that answered can tell us a session has ended
+        stale = VPNSession.objects.filter(source__in=list(results), last_seen__lt=now)
+        if failed_nodes:
+            stale = stale.exclude(source=VPNSession.SOURCE_API, node__in=list(failed_nodes))
+        removed, _ = stale.delete()
+    if QUOTA_ENFORCEMENT:
+        denied, over_quota = quota_enforcer.process(deltas, now)
+        for username in denied:
+            print(f"Quota exceeded: denied {username}")
+        if over_quota:
+            wanted = {user.username for user in over_quota}
+            results = (disconnect or quota_enforcer.disconnect)(
+                over_quota, [row for row in rows if row.username in wanted])
+            failed = [username for username, ok in results.items() if not ok]
+            if failed:
+                print(f"Error disconnecting users over quota: {', '.join(failed[:50])}")
+    return len(rows), removed
+
+
+def collect(sources=None):
+    """One poll: upsert current sessions, delete finished ones. Returns counts."""
+    failed_nodes = set()
+    results = read_sources(sources, failed_nodes)
+    stored, removed = store(results, failed_nodes=failed_nodes)
+    return {
+        'sessions': stored,
+        'removed': removed,
+        'sources': {source: len(sessions) for source, sessions in results.items()},
+        'failed': [source for source in sources or VPN_SESSION_SOURCES if source not in results],
+        'failed_nodes': sorted(failed_nodes),
+    }
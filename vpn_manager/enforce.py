@@ -0,0 +1,110 @@
+"""
+max_connections enforcement.
+
+Every pass builds a per-user multiset of live sessions from all collector
+sources (status log, management interface, every sacli openvpn_N daemon and
+the remote client info API) and disconnects each over-limit user's oldest
+sessions. Work is linear in the number of sessions: one grouping pass, a
+max_connections lookup for the users with more than one session only, and
+one batched kill per route (a single pipelined management session for local
+OpenVPN, one API call for the remote node).
+
+sacli can only disconnect a user as a whole, which would also drop the
+sessions within the limit, so over-limit Access Server sessions (local, or
+remote ones with a daemon) are reported instead of killed.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from .collector import distinct_sessions, read_sources, session_key
+from .mgmt import get_management_client
+from .models import VPNSession, VPNUser
+from .utils import kill_sessions_via_api
+
+# Sessions without a start time are treated as the oldest
+EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+LOCAL_SOURCES = (VPNSession.SOURCE_STATUS_LOG, VPNSession.SOURCE_MGMT)
+LOOKUP_CHUNK = 500
+
+
+def group_by_user(results):
+    """{username: [(source, ClientSession), ...]} from read_sources() output."""
+    by_user = defaultdict(list)
+    for source, session in distinct_sessions(results):
+        by_user[session.username].append((source, session))
+    return by_user
+
+
+def load_limits(usernames):
+    """{username: max_connections} for the given usernames that exist."""
+    usernames = list(usernames)
+    limits = {}
+    for start in range(0, len(usernames), LOOKUP_CHUNK):
+        limits.update(VPNUser.objects.filter(
+            username__in=usernames[start:start + LOOKUP_CHUNK],
+        ).values_list('username', 'max_connections'))
+    return limits
+
+
+def plan_kills(by_user, limits):
+    """
+    The sessions to disconnect: for every user over their limit, all but the
+    newest `max_connections`. Unknown users and a limit of 0 are left alone.
+    """
+    victims = []
+    for username, sessions in by_user.items():
+        limit = limits.get(username)
+        if not limit or len(sessions) <= limit:
+            continue
+        sessions = sorted(sessions, key=lambda item: item[1].connected_since or EPOCH)
+        victims.extend(sessions[:len(sessions) - limit])
+    return victims
+
+
+def kill(victims):
+    """Disconnect the planned sessions, one batch per route. Returns (killed, failed, skipped)."""
+    local = [session for source, session in victims if source in LOCAL_SOURCES]
+    # The API refuses Access Server sessions (those with a daemon) just like sacli would
+    remote = [session for source, session in victims if source == VPNSession.SOURCE_API and not session.daemon]
+    skipped = [session for source, session in victims
+               if source not in LOCAL_SOURCES and (source != VPNSession.SOURCE_API or session.daemon)]
+
+    killed, failed = [], []
+    if local:
+        try:
+            oks = get_management_client().kill_sessions(local)
+        except Exception as e:
+            print(f"Error killing sessions via management interface: {e}")
+            oks = [False] * len(local)
+        for session, ok in zip(local, oks):
+            (killed if ok else failed).append(session)
+    if remote:
+        for session, ok in zip(remote, kill_sessions_via_api(remote)):
+            (killed if ok else failed).append(session)
+    return killed, failed, skipped
+
+
+def enforce(sources=None, dry_run=False):
+    """One enforcement pass; returns counts and the affected sessions."""
+    results = read_sources(sources)
+    by_user = group_by_user(results)
+    candidates = [username for username, sessions in by_user.items() if len(sessions) > 1]
+    victims = plan_kills(by_user, load_limits(candidates))
+
+    killed, failed, skipped = [], [], []
+    if victims and not dry_run:
+        killed, failed, skipped = kill(victims)
+        # Drop the killed sessions from the admin's view right away
+        sources_by_session = {id(session): source for source, session in victims}
+        VPNSession.objects.filter(session_key__in=[
+            session_key(sources_by_session[id(session)], session) for session in killed
+        ]).delete()
+    return {
+        'sessions': sum(len(sessions) for sessions in by_user.values()),
+        'users': len(by_user),
+        'over_limit': len({session.username for _, session in victims}),
+        'victims': victims,
+        'killed': killed,
+        'failed': failed,
+        'skipped': skipped,
+    }
@@ -0,0 +1,152 @@
+"""
+Event-driven expiry enforcement.
+
+ExpiryScheduler keeps a min-heap of the moments active users expire (the
+midnight after their expiry_date, matching `expiry_date < today` in
+sync_psw_file) and only does work when the earliest one passes. Heap entries
+are checked against the DB when they fire, so an expiry date that was moved
+meanwhile just re-queues the user. A long-period resync rebuilds the heap to
+pick up users added or edited since.
+
+Expired users are deactivated through save(), so the usual signals remove
+them from the psw file and queue the Access Server deny/disconnect in the
+outbox; plain OpenVPN sessions are also killed right away over the
+management interface.
+
+With --management-client-auth the scheduler also answers >CLIENT:CONNECT
+and REAUTH: expired or inactive users get client-deny, everybody else
+client-auth-nt. Without it, an expired user reported by >CLIENT:ESTABLISHED
+is killed by client ID.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .mgmt import ClientEventParser
+from .models import VPNUser
+
+
+def deadline_for(expiry_date):
+    """Aware datetime at which a user with this expiry_date stops being valid."""
+    return timezone.make_aware(datetime.combine(expiry_date + timedelta(days=1), time.min))
+
+
+class ExpiryScheduler:
+    def __init__(self, client=None, client_auth=False):
+        self.client = client
+        self.client_auth = client_auth
+        self._heap = []        # (deadline, username)
+        self._deadlines = {}   # username -> deadline of its live heap entry
+        self._parser = ClientEventParser()
+        self.events = []       # ClientEvents waiting for handle_events()
+        self.stats = {'expired': 0, 'killed': 0, 'denied': 0, 'allowed': 0, 'resyncs': 0}
+        if client is not None:
+            client.notification_handler = self.on_notification
+
+    # Deadlines -------------------------------------------------------------
+
+    def schedule(self, username, expiry_date):
+        deadline = deadline_for(expiry_date)
+        if self._deadlines.get(username) == deadline:
+            return
+        self._deadlines[username] = deadline
+        heapq.heappush(self._heap, (deadline, username))
+
+    def resync(self):
+        """Rebuild the heap from every active user (one indexed query)."""
+        self._heap = []
+        self._deadlines = {}
+        for username, expiry_date in VPNUser.objects.filter(is_active=True).values_list(
+                'username', 'expiry_date').iterator(chunk_size=5000):
+            deadline = deadline_for(expiry_date)
+            self._deadlines[username] = deadline
+            self._heap.append((deadline, username))
+        heapq.heapify(self._heap)
+        self.stats['resyncs'] += 1
+        return len(self._heap)
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def fire_due(self, now=None):
+        """Expire every user whose deadline has passed; returns their usernames."""
+        now = now or timezone.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, username = heapq.heappop(self._heap)
+            if self._deadlines.get(username) != deadline:
+                continue  # superseded by a later schedule()
+            del self._deadlines[username]
+            due.append(username)
+        if not due:
+            return []
+
+        expired = []
+        with transaction.atomic():
+            for user in VPNUser.objects.filter(username__in=due, is_active=True):
+                if deadline_for(user.expiry_date) > now:
+                    self.schedule(user.username, user.expiry_date)  # extended meanwhile
+                    continue
+                user.is_active = False
+                user.save(update_fields=['is_active'])
+                expired.append(user)
+        self.stats['expired'] += len(expired)
+
+        plain = [user.username for user in expired if not user.has_access_server_user]
+        if plain and self.client is not None:
+            try:
+                self.stats['killed'] += sum(self.client.kill_many(plain).values())
+            except Exception as e:
+                # The outbox disconnect queued by the signal retries this
+                print(f"Error killing expired users via management interface: {e}")
+        return [user.username for user in expired]
+
+    # Management interface ----------------------------------------------------
+
+    def on_notification(self, line):
+        # Only parse here: this runs inside the client's read loop
+        event = self._parser.feed(line)
+        if event is not None:
+            self.events.append(event)
+
+    def is_allowed(self, username, now=None):
+        now = now or timezone.now()
+        user = VPNUser.objects.filter(username=username).values(
+            'is_active', 'quota_exceeded', 'expiry_date').first()
+        if user is None:
+            return True  # not managed here; password checks happen elsewhere
+        if user['is_active'] and not user['quota_exceeded'] and deadline_for(user['expiry_date']) > now:
+            self.schedule(username, user['expiry_date'])
+            return True
+        return False
+
+    def handle_events(self):
+        """
+        Answer every queued event, including those that arrive while waiting
+        for the replies (they are read from the socket then, so listen()
+        would not see them again). Returns the number handled.
+        """
+        handled = 0
+        while self.events:
+            events, self.events = self.events, []
+            handled += len(events)
+            for event in events:
+                self._handle(event)
+        return handled
+
+    def _handle(self, event):
+        username = event.env.get('common_name') or event.env.get('username', '')
+        if event.kind in ('CONNECT', 'REAUTH') and self.client_auth:
+            if self.is_allowed(username):
+                response = self.client.command(f'client-auth-nt {event.cid} {event.kid}')
+                self.stats['allowed'] += 1
+            else:
+                response = self.client.command(f'client-deny {event.cid} {event.kid} "account expired"')
+                self.stats['denied'] += 1
+            if not response.ok:
+                print(f"Error answering {event.kind} of {username}: {response.message}")
+        elif event.kind == 'ESTABLISHED' and not self.is_allowed(username):
+            if self.client.command(f'client-kill {event.cid}').ok:
+                self.stats['killed'] += 1
@@ -0,0 +1,319 @@
+"""
+Minimal fake of the OpenVPN management interface for local development.
+
+    python -m vpn_manager.fake_mgmt_server --port 7505 --clients 50
+
+It answers 'status [n]', 'kill <cn|ip:port>', 'client-kill <cid>',
+'client-auth-nt'/'client-deny', 'bytecount <n>', 'version', 'quit' and 'exit'
+the way a real OpenVPN daemon does, so the management client can be exercised
+without a VPN server.
+
+Real-time notifications can be scripted: establish_client() and
+disconnect_client() announce sessions with >CLIENT:ESTABLISHED/DISCONNECT,
+kills announce >CLIENT:DISCONNECT, 'bytecount' emits >BYTECOUNT_CLI lines,
+play() runs a timed sequence of such steps and drop_connections() simulates
+a management interface restart.
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+BANNER = '>INFO:OpenVPN Management Interface Version 5 -- type \'help\' for more info'
+
+CLIENT_LIST_HEADER = (
+    'Common Name', 'Real Address', 'Virtual Address', 'Virtual IPv6 Address',
+    'Bytes Received', 'Bytes Sent', 'Connected Since', 'Connected Since (time_t)',
+    'Username', 'Client ID', 'Peer ID', 'Data Channel Cipher',
+)
+
+
+class FakeManagementServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.clients = {}
+        self.commands = []
+        self._next_cid = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._handlers = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_client(self, common_name, real_address=None, virtual_address=None,
+                   bytes_received=0, bytes_sent=0, connected_since=None):
+        with self._lock:
+            cid = self._next_cid
+            self._next_cid += 1
+            self.clients[cid] = {
+                'common_name': common_name,
+                'real_address': real_address or f'198.51.100.{cid % 250 + 1}:{40000 + cid}',
+                'virtual_address': virtual_address or f'10.8.{cid // 250}.{cid % 250 + 2}',
+                'bytes_received': bytes_received,
+                'bytes_sent': bytes_sent,
+                'connected_since': int(connected_since or time.time()),
+            }
+            return cid
+
+    def _pop_cid(self, cid):
+        with self._lock:
+            client = self.clients.pop(cid, None)
+        return {cid: client} if client is not None else {}
+
+    def _pop(self, predicate):
+        with self._lock:
+            removed = {cid: c for cid, c in self.clients.items() if predicate(cid, c)}
+            for cid in removed:
+                del self.clients[cid]
+        return removed
+
+    def remove_client(self, common_name):
+        return len(self._pop(lambda cid, c: c['common_name'] == common_name))
+
+    def remove_session(self, cid=None, real_address=None):
+        """Drop one session by client ID or all sessions from a real address."""
+        if cid is not None:
+            return len(self._pop_cid(cid))
+        return len(self._pop(lambda _, c: c['real_address'] == real_address))
+
+    def notify(self, *lines):
+        """Send real-time notification lines to every connected management client."""
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler.send(*lines)
+            except OSError:
+                pass  # connection going away
+
+    def connect_client(self, common_name, real_address=None, username=None):
+        """Announce a connecting client the way --management-client-auth does; returns its cid."""
+        with self._lock:
+            cid = self._next_cid
+            self._next_cid += 1
+        address = real_address or f'198.51.100.{cid % 250 + 1}:{40000 + cid}'
+        ip, _, port = address.partition(':')
+        self.notify(f'>CLIENT:CONNECT,{cid},0', f'>CLIENT:ENV,common_name={common_name}',
+                    f'>CLIENT:ENV,username={username or common_name}',
+                    f'>CLIENT:ENV,untrusted_ip={ip}', f'>CLIENT:ENV,untrusted_port={port}',
+                    '>CLIENT:ENV,END')
+        return cid
+
+    def establish_client(self, common_name, real_address=None, virtual_address=None, connected_since=None):
+        """Add a client and announce it with >CLIENT:ESTABLISHED; returns its cid."""
+        cid = self.add_client(common_name, real_address, virtual_address, connected_since=connected_since)
+        c = self.clients[cid]
+        ip, _, port = c['real_address'].partition(':')
+        self.notify(f'>CLIENT:ESTABLISHED,{cid}', f'>CLIENT:ENV,common_name={common_name}',
+                    f'>CLIENT:ENV,trusted_ip={ip}', f'>CLIENT:ENV,trusted_port={port}',
+                    f'>CLIENT:ENV,ifconfig_pool_remote_ip={c["virtual_address"]}',
+                    f'>CLIENT:ENV,time_unix={c["connected_since"]}', '>CLIENT:ENV,END')
+        return cid
+
+    def disconnect_client(self, cid):
+        """Remove a client and announce it with >CLIENT:DISCONNECT."""
+        self._announce_disconnect(self._pop_cid(cid))
+
+    def _announce_disconnect(self, removed):
+        for cid, c in removed.items():
+            self.notify(f'>CLIENT:DISCONNECT,{cid}', f'>CLIENT:ENV,common_name={c["common_name"]}',
+                        f'>CLIENT:ENV,bytes_received={c["bytes_received"]}',
+                        f'>CLIENT:ENV,bytes_sent={c["bytes_sent"]}', '>CLIENT:ENV,END')
+
+    def add_traffic(self, cid, received, sent):
+        with self._lock:
+            if cid in self.clients:
+                self.clients[cid]['bytes_received'] += received
+                self.clients[cid]['bytes_sent'] += sent
+
+    def bytecount_lines(self):
+        with self._lock:
+            return [f'>BYTECOUNT_CLI:{cid},{c["bytes_received"]},{c["bytes_sent"]}'
+                    for cid, c in self.clients.items()]
+
+    def play(self, steps):
+        """
+        Run a script in the background: steps is an iterable of
+        (delay_seconds, callable) executed in order. Returns the thread.
+        """
+        def run():
+            for delay, action in steps:
+                time.sleep(delay)
+                action()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def drop_connections(self):
+        """Close every management connection (the client should reconnect)."""
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def status_lines(self, version=1):
+        with self._lock:
+            clients = sorted(self.clients.items())
+        now = int(time.time())
+        if version == 1:
+            lines = ['OpenVPN CLIENT LIST', f'Updated,{time.ctime(now)}',
+                     'Common Name,Real Address,Bytes Received,Bytes Sent,Connected Since']
+            for _, c in clients:
+                lines.append(','.join(str(v) for v in (
+                    c['common_name'], c['real_address'], c['bytes_received'],
+                    c['bytes_sent'], time.ctime(c['connected_since']))))
+            lines += ['ROUTING TABLE', 'Virtual Address,Common Name,Real Address,Last Ref']
+            for _, c in clients:
+                lines.append(','.join((c['virtual_address'], c['common_name'],
+                                       c['real_address'], time.ctime(now))))
+            lines += ['GLOBAL STATS', 'Max bcast/mcast queue length,0']
+            return lines
+
+        sep = '\t' if version == 3 else ','
+        lines = [sep.join(('TITLE', 'OpenVPN 2.6.0 x86_64-pc-linux-gnu')),
+                 sep.join(('TIME', time.ctime(now), str(now))),
+                 sep.join(('HEADER', 'CLIENT_LIST') + CLIENT_LIST_HEADER)]
+        for cid, c in clients:
+            lines.append(sep.join(str(v) for v in (
+                'CLIENT_LIST', c['common_name'], c['real_address'], c['virtual_address'], '',
+                c['bytes_received'], c['bytes_sent'], time.ctime(c['connected_since']),
+                c['connected_since'], c['common_name'], cid, cid, 'AES-256-GCM')))
+        lines.append(sep.join(('HEADER', 'ROUTING_TABLE', 'Virtual Address', 'Common Name',
+                               'Real Address', 'Last Ref', 'Last Ref (time_t)')))
+        for _, c in clients:
+            lines.append(sep.join(str(v) for v in (
+                'ROUTING_TABLE', c['virtual_address'], c['common_name'],
+                c['real_address'], time.ctime(now), now)))
+        lines.append(sep.join(('GLOBAL_STATS', 'Max bcast/mcast queue length', '0')))
+        return lines
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Replies and notifications are separate small writes; don't let Nagle hold them back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = threading.Lock()
+        with self.server._lock:
+            self.server._handlers.append(self)
+
+    def finish(self):
+        self._bytecount_interval = 0
+        with self.server._lock:
+            self.server._handlers.remove(self)
+        super().finish()
+
+    def start_bytecount(self, interval):
+        """Emit >BYTECOUNT_CLI for every client each `interval` seconds (0 stops)."""
+        self._bytecount_interval = interval
+        if interval <= 0 or getattr(self, '_bytecount_thread', None) is not None:
+            return
+
+        def tick():
+            while self._bytecount_interval > 0:
+                time.sleep(self._bytecount_interval)
+                try:
+                    self.send(*self.server.bytecount_lines())
+                except OSError:
+                    return
+            self._bytecount_thread = None
+
+        self._bytecount_thread = threading.Thread(target=tick, daemon=True)
+        self._bytecount_thread.start()
+
+    def send(self, *lines):
+        data = ''.join(f"{line}\r\n" for line in lines).encode('utf-8')
+        with self._write_lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        self.send(BANNER)
+        for raw in self.rfile:
+            cmd = raw.decode('utf-8', errors='ignore').strip()
+            if not cmd:
+                continue
+            server.commands.append(cmd)
+            name, _, arg = cmd.partition(' ')
+            if name in ('quit', 'exit'):
+                return
+            if name == 'status':
+                version = int(arg) if arg in ('1', '2', '3') else 1
+                for line in server.status_lines(version):
+                    self.send(line)
+                self.send('END')
+            elif name == 'kill' and ':' in arg:
+                removed = server._pop(lambda _, c: c['real_address'] == arg)
+                if removed:
+                    self.send(f'SUCCESS: {len(removed)} client(s) at address {arg} killed')
+                else:
+                    self.send(f'ERROR: client at address {arg} not found')
+                server._announce_disconnect(removed)
+            elif name == 'client-kill':
+                cid = arg.split(' ', 1)[0]
+                removed = server._pop_cid(int(cid)) if cid.isdigit() else {}
+                if removed:
+                    self.send('SUCCESS: client-kill command succeeded')
+                else:
+                    self.send('ERROR: client-kill command failed')
+                server._announce_disconnect(removed)
+            elif name == 'kill':
+                removed = server._pop(lambda _, c: c['common_name'] == arg) if arg else {}
+                if removed:
+                    self.send(f'SUCCESS: common name \'{arg}\' found, {len(removed)} client(s) killed')
+                else:
+                    self.send(f'ERROR: common name \'{arg}\' not found')
+                server._announce_disconnect(removed)
+            elif name == 'bytecount':
+                self.start_bytecount(float(arg or 0))
+                self.send('SUCCESS: bytecount interval changed')
+            elif name in ('client-auth', 'client-auth-nt', 'client-deny'):
+                self.send(f'SUCCESS: {name} command succeeded')
+            elif name == 'version':
+                self.send('OpenVPN Version: OpenVPN 2.6.0 (fake)')
+                self.send('Management Version: 5')
+                self.send('END')
+            else:
+                self.send(f'ERROR: unknown command [{cmd}], enter \'help\' for more options')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7505)
+    parser.add_argument('--clients', type=int, default=10,
+                        help='Number of fake connected clients (named user1..userN)')
+    args = parser.parse_args()
+
+    server = FakeManagementServer(args.host, args.port)
+    for i in range(1, args.clients + 1):
+        server.add_client(f'user{i}')
+    print(f'Fake management interface listening on {args.host}:{server.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
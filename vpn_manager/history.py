@@ -0,0 +1,237 @@
+"""
+Connection history: which user held which real and virtual address when.
+
+The session collector hands every poll's sessions to ConnectionHistory,
+which keeps the open interval of each session in memory and upserts them
+every CONNECTION_HISTORY_FLUSH_INTERVAL seconds (one statement per 1000
+sessions) with `end` set to the last time the session was seen. A session
+that goes away from a source that answered is closed at its last sighting;
+one whose source failed is kept open for an hour. An interval starts at the
+session's connected_since when known. Intervals longer than
+CONNECTION_HISTORY_MAX_SPAN are closed and continued in a new row.
+
+Because no row spans more than MAX_SPAN, who_had() finds every interval
+holding an address at a time with one range scan of the (address, start,
+end) index over [at - MAX_SPAN, at]. Its cost depends on how busy that
+address was in that window, not on the size of the table.
+
+compact() merges the closed intervals of the same user, node and addresses
+that follow each other within CONNECTION_HISTORY_MERGE_GAP (quick
+reconnects) as long as the result stays within MAX_SPAN. prune() applies
+CONNECTION_HISTORY_RETENTION_DAYS.
+"""
+import ipaddress
+from datetime import timedelta
+
+from decouple import config
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ConnectionInterval, VPNSession
+
+CONNECTION_HISTORY = config('CONNECTION_HISTORY', default=True, cast=bool)
+FLUSH_INTERVAL = config('CONNECTION_HISTORY_FLUSH_INTERVAL', default=60, cast=float)
+MAX_SPAN = timedelta(hours=config('CONNECTION_HISTORY_MAX_SPAN_HOURS', default=24, cast=int))
+MERGE_GAP = timedelta(seconds=config('CONNECTION_HISTORY_MERGE_GAP', default=300, cast=int))
+# Only intervals closed at least this long ago are compacted
+COMPACT_AFTER = timedelta(days=config('CONNECTION_HISTORY_COMPACT_AFTER_DAYS', default=1, cast=int))
+RETENTION_DAYS = config('CONNECTION_HISTORY_RETENTION_DAYS', default=365, cast=int)
+# A session is only seen at polls: it may have started a poll before its
+# first sighting and lasted a poll after its last one. Should be at least
+# the collector's poll interval.
+LOOKUP_SLACK = timedelta(seconds=config('CONNECTION_HISTORY_LOOKUP_SLACK', default=60, cast=int))
+# Sessions of a failed source are closed after this long
+OPEN_TTL = timedelta(hours=1)
+BATCH_SIZE = 1000
+UNIQUE_FIELDS = ['username', 'start', 'node', 'real_ip', 'real_port']
+
+
+def split_address(value):
+    """
+    (ip, port) from '1.2.3.4:1194', 'udp4:1.2.3.4:1194', '[2001:db8::1]:1194'
+    or a bare address; port is 0 when there is none. IPv4-mapped IPv6
+    addresses become IPv4. Anything that is not an IP comes back as is.
+    """
+    value = (value or '').strip()
+    proto, sep, rest = value.partition(':')
+    if sep and proto.split('-')[0].rstrip('46') in ('udp', 'tcp'):
+        value = rest  # protocol prefix of newer OpenVPN versions
+    port = ''
+    if value.startswith('['):
+        value, _, port = value[1:].partition(']')
+        port = port.lstrip(':')
+    elif value.count(':') == 1:
+        value, _, port = value.partition(':')
+    try:
+        ip = ipaddress.ip_address(value)
+    except ValueError:
+        return value, 0
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return str(ip), int(port) if port.isdigit() else 0
+
+
+def _identity(username, node, ip, port):
+    return (node or '', username, ip, port)
+
+
+class ConnectionHistory:
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._open = None    # identity -> [ConnectionInterval, source]
+        self._closed = {}    # unique key -> ConnectionInterval ended since the last flush
+        self._flushed_at = None
+
+    def _load(self, now):
+        # Continue the intervals a previous process left open, so a restart
+        # does not start a second row for every live session
+        self._open = {}
+        for interval in ConnectionInterval.objects.filter(end__gte=now - OPEN_TTL).order_by('start').iterator(
+                chunk_size=5000):
+            identity = _identity(interval.username, interval.node, interval.real_ip, interval.real_port)
+            self._open[identity] = [interval, None]
+
+    def _close(self, identity, end):
+        interval, _ = self._open.pop(identity)
+        interval.end = max(end, interval.start)
+        self._closed[_key(interval)] = interval
+
+    def observe(self, sessions, sources, failed_nodes, now):
+        """
+        Account one poll: `sessions` are its VPNSession rows, `sources` the
+        sources that answered, `failed_nodes` the API nodes that did not.
+        """
+        if self._open is None:
+            self._load(now)
+        if self._flushed_at is None:
+            self._flushed_at = now
+        seen = set()
+        for session in sessions:
+            ip, port = split_address(session.real_address)
+            identity = _identity(session.username, session.node, ip, port)
+            if identity in seen:
+                continue  # the same client reported by another source
+            seen.add(identity)
+            virtual_ip = split_address(session.virtual_address)[0]
+            entry = self._open.get(identity)
+            if entry is not None and session.connected_since is not None \
+                    and session.connected_since > entry[0].start:
+                # Reconnected from the same address and port
+                self._close(identity, entry[0].end)
+                entry = None
+            if entry is not None and now - entry[0].start >= MAX_SPAN:
+                self._close(identity, now)
+                entry = [ConnectionInterval(username=session.username, node=session.node or '', real_ip=ip,
+                                            real_port=port, start=now), session.source]
+                self._open[identity] = entry
+            if entry is None:
+                start = session.connected_since
+                if start is None or start > now or now - start >= MAX_SPAN:
+                    start = now  # unknown, or too long ago for one row
+                entry = [ConnectionInterval(username=session.username, node=session.node or '', real_ip=ip,
+                                            real_port=port, start=start), session.source]
+                self._open[identity] = entry
+            entry[0].end = now
+            entry[0].virtual_ip = virtual_ip or entry[0].virtual_ip
+            entry[1] = session.source
+
+        sources, failed_nodes = set(sources), set(failed_nodes)
+        for identity, (interval, source) in list(self._open.items()):
+            if identity in seen:
+                continue
+            answered = source is None or (
+                source in sources and not (source == VPNSession.SOURCE_API and interval.node in failed_nodes))
+            if answered or now - interval.end >= OPEN_TTL:
+                self._close(identity, interval.end)
+
+    def due(self, now):
+        return self._flushed_at is not None and (now - self._flushed_at).total_seconds() >= self.interval
+
+    def flush(self, now):
+        """Upsert the intervals closed since the last flush and every open one."""
+        rows = dict(self._closed)
+        self._closed = {}
+        self._flushed_at = now
+        if self._open:
+            rows.update((_key(interval), interval) for interval, _ in self._open.values())
+        ConnectionInterval.objects.bulk_create(
+            list(rows.values()),
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=UNIQUE_FIELDS,
+            update_fields=['end', 'virtual_ip'],
+        )
+        return len(rows)
+
+
+def _key(interval):
+    return tuple(getattr(interval, name) for name in UNIQUE_FIELDS)
+
+
+connection_history = ConnectionHistory()
+
+
+def who_had(address, at, node=None, slack=LOOKUP_SLACK):
+    """
+    The ConnectionIntervals holding `address` (a real address, with or
+    without port, or a virtual address) at `at`, oldest first. Every node
+    has its own virtual addresses; pass `node` to look at one only.
+    """
+    ip, port = split_address(address)
+    window = {'start__lte': at + slack, 'start__gte': at - MAX_SPAN - slack, 'end__gte': at - slack}
+    if node is not None:
+        window['node'] = node
+    real = ConnectionInterval.objects.filter(real_ip=ip, **window)
+    if port:
+        real = real.filter(real_port__in=[port, 0])  # 0: merged from several ports
+    virtual = ConnectionInterval.objects.filter(virtual_ip=ip, **window)
+    found = {interval.pk: interval for interval in list(real) + list(virtual)}
+    return sorted(found.values(), key=lambda interval: (interval.start, interval.pk))
+
+
+def compact(now=None, days=2):
+    """
+    Merge consecutive intervals of the same user, node and addresses that
+    were closed more than COMPACT_AFTER ago and started within the `days`
+    before that. The real port is kept when all merged rows share it.
+    Safe to run again over the same days. Returns (merged rows, deleted rows).
+    """
+    now = now or timezone.now()
+    until = now - COMPACT_AFTER
+    candidates = ConnectionInterval.objects.filter(
+        start__gte=until - timedelta(days=days), start__lt=until, end__lt=until,
+    ).order_by('username', 'node', 'real_ip', 'virtual_ip', 'start')
+
+    updated, deleted = [], []
+    current = None
+    for interval in candidates.iterator(chunk_size=5000):
+        if current is not None \
+                and (interval.username, interval.node, interval.real_ip, interval.virtual_ip) == \
+                (current.username, current.node, current.real_ip, current.virtual_ip) \
+                and interval.start - current.end <= MERGE_GAP \
+                and max(interval.end, current.end) - current.start <= MAX_SPAN:
+            current.end = max(current.end, interval.end)
+            if interval.real_port != current.real_port:
+                current.real_port = 0
+            current.merged = True
+            deleted.append(interval.pk)
+            continue
+        if current is not None and getattr(current, 'merged', False):
+            updated.append(current)
+        current = interval
+    if current is not None and getattr(current, 'merged', False):
+        updated.append(current)
+
+    with transaction.atomic():
+        # Delete first: a merged row dropping its port must not collide with them
+        for start in range(0, len(deleted), BATCH_SIZE):
+            ConnectionInterval.objects.filter(pk__in=deleted[start:start + BATCH_SIZE]).delete()
+        ConnectionInterval.objects.bulk_update(updated, ['end', 'real_port'], batch_size=100)
+    return len(updated), len(deleted)
+
+
+def prune(now=None):
+    """Delete intervals that started before the retention period; returns the count."""
+    now = now or timezone.now()
+    deleted, _ = ConnectionInterval.objects.filter(start__lt=now - timedelta(days=RETENTION_DAYS)).delete()
+    return deleted
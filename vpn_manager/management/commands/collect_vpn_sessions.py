@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from vpn_manager import collector
+
+
+class Command(BaseCommand):
+    help = 'Poll the VPN servers and keep the VPNSession table up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds between polls')
+        parser.add_argument('--sources', default=','.join(collector.VPN_SESSION_SOURCES),
+                            help='Comma separated list of status_log, mgmt, sacli, api')
+        parser.add_argument('--once', action='store_true',
+                            help='Poll once and exit')
+
+    def handle(self, *args, **options):
+        sources = [source.strip() for source in options['sources'].split(',') if source.strip()]
+        while True:
+            started = time.perf_counter()
+            result = collector.collect(sources)
+            per_source = ' '.join(f'{source}={count}' for source, count in result['sources'].items())
+            self.stdout.write(
+                f"{result['sessions']} session(s) [{per_source}], removed {result['removed']} "
+                f"in {time.perf_counter() - started:.2f}s")
+            if result['failed']:
+                self.stderr.write(self.style.ERROR(f"Failed sources: {', '.join(result['failed'])}"))
+            if result['failed_nodes']:
+                self.stderr.write(self.style.WARNING(
+                    f"Unreachable nodes (sessions kept): {', '.join(result['failed_nodes'])}"))
+            if options['once']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.perf_counter() - started)))
@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from vpn_manager import history
+
+
+class Command(BaseCommand):
+    help = 'Merge back-to-back connection intervals and prune old ones (run daily from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2,
+                            help='Days of closed intervals to compact (more to catch up)')
+        parser.add_argument('--no-prune', action='store_true',
+                            help='Only compact, keep everything')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        merged, deleted = history.compact(days=options['days'])
+        self.stdout.write(f"Merged {deleted} interval(s) into {merged} in {time.perf_counter() - started:.2f}s")
+        if not options['no_prune']:
+            self.stdout.write(f"Pruned {history.prune()} interval(s)")
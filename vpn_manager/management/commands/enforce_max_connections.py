@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from vpn_manager import collector, enforce
+
+
+class Command(BaseCommand):
+    help = "Disconnect the oldest sessions of users connected more than max_connections times"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help='Seconds between passes')
+        parser.add_argument('--sources', default=','.join(collector.VPN_SESSION_SOURCES),
+                            help='Comma separated list of status_log, mgmt, sacli, api')
+        parser.add_argument('--once', action='store_true',
+                            help='Run a single pass and exit')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the sessions that would be disconnected')
+
+    def handle(self, *args, **options):
+        sources = [source.strip() for source in options['sources'].split(',') if source.strip()]
+        dry_run = options['dry_run']
+        while True:
+            started = time.perf_counter()
+            result = enforce.enforce(sources, dry_run=dry_run)
+            elapsed = time.perf_counter() - started
+
+            if dry_run:
+                for source, session in result['victims']:
+                    self.stdout.write(
+                        f"Would disconnect {session.username} {session.real_address} "
+                        f"({source}, since {session.connected_since})")
+            self.stdout.write(
+                f"{result['sessions']} session(s) of {result['users']} user(s), "
+                f"{result['over_limit']} over limit: killed={len(result['killed'])} "
+                f"failed={len(result['failed'])} skipped={len(result['skipped'])} in {elapsed:.2f}s")
+            if result['failed']:
+                self.stderr.write(self.style.ERROR(
+                    "Failed: " + ', '.join(f"{s.username}@{s.real_address}" for s in result['failed'][:50])))
+            if result['skipped']:
+                self.stderr.write(
+                    "Access Server sessions over the limit (sacli cannot kill single sessions): "
+                    + ', '.join(sorted({s.username for s in result['skipped']})[:50]))
+            if options['once']:
+                return
+            time.sleep(max(0.0, options['interval'] - elapsed))
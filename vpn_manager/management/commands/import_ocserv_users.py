@@ -1,12 +1,41 @@
 import os
 import sqlite3
+import time
 from datetime import datetime
 import json  # Import json module
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
-from vpn_manager.models import VPNUser
+from vpn_manager.models import VPNTask, VPNUser, natural_sort_key
+from vpn_manager.outbox import change_key, enqueue_many
+from vpn_manager.psw_store import sync_from_db
+
+DATE_FMT = '%Y-%m-%d'
+# Fields written by the import (has_access_server_user is left alone on existing users)
+UPDATE_FIELDS = ['openvpn_password', 'is_active', 'expiry_date', 'max_connections']
+
+
+def load_group_limits(conn):
+    """Map ocserv group id -> max-same-clients (groups are few, so load them all)."""
+    limits = {}
+    for group_id, configs in conn.execute('SELECT id, configs FROM app_ocservgroup'):
+        try:
+            # Parse the 'configs' field as JSON
+            config = json.loads(configs) if configs else {}
+            limits[group_id] = int(config['max-same-clients'])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            pass  # If value is not valid, fallback to default value
+    return limits
+
+
+def parse_expiry(value, today):
+    # Parse expiry date into date
+    try:
+        return datetime.strptime(value, DATE_FMT).date() if value else today
+    except ValueError:
+        return today
+
 
 class Command(BaseCommand):
     help = (
@@ -19,102 +48,121 @@ class Command(BaseCommand):
             help='Path to the legacy SQLite database file',
             required=True,
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Rows read, looked up and upserted per round trip (default: 500)',
+        )
 
     def handle(self, *args, **options):
         db_path = options['db_path']
-        date_fmt = '%Y-%m-%d'
+        chunk_size = max(1, options['chunk_size'])
+        today = timezone.localdate()
 
         if not os.path.exists(db_path):
             self.stderr.write(self.style.ERROR(f"DB not found: {db_path}"))
             return
 
-        # Step 1: Read legacy rows
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute('SELECT username, password, active, expire_date, group_id FROM app_ocservuser')
-
-        rows = list(cur)  # load all rows; SQLite fetch is fast in C
-        conn.close()
-
-        # Step 2: Fetch group configurations for max_connections
-        group_configs = {}
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute('SELECT id, configs FROM app_ocservgroup')
-        for group in cur.fetchall():
-            group_id = group[0]  # access by index
-            try:
-                # Parse the 'configs' field as JSON
-                group_configs[group_id] = json.loads(group[1]) if group[1] else {}
-            except json.JSONDecodeError:
-                group_configs[group_id] = {}
-        conn.close()
-
-        # Step 3: Map existing users
-        existing = {
-            u.username: u
-            for u in VPNUser.objects.in_bulk(field_name='username').values()
-        }
-
-        to_create = []
-        to_update = []
-
-        # Step 4: Build objects
-        for row in rows:
-            uname = row['username']
-            pw = row['password'] or ''
-            active = bool(row['active'])
-            exp_str = row['expire_date']
-            group_id = row['group_id']
-
-            # Parse expiry date into date
-            try:
-                exp_date = datetime.strptime(exp_str, date_fmt).date() if exp_str else timezone.localdate()
-            except ValueError:
-                exp_date = timezone.localdate()
-
-            # Retrieve the max_connections value from the group configs
-            max_connections = 1  # default value
-            if group_id in group_configs:
-                group_config = group_configs[group_id]
-                if 'max-same-clients' in group_config:
-                    try:
-                        max_connections = int(group_config['max-same-clients'])
-                    except ValueError:
-                        pass  # If value is not valid, fallback to default value
-
-            if uname in existing:
-                usr = existing[uname]
-                usr.openvpn_password = pw
-                usr.is_active = active
-                usr.expiry_date = exp_date
-                usr.max_connections = max_connections
-                to_update.append(usr)
-            else:
-                to_create.append(
-                    VPNUser(
-                        username=uname,
-                        openvpn_password=pw,
-                        is_active=active,
-                        expiry_date=exp_date,
-                        max_connections=max_connections,
+        started = time.perf_counter()
+        seen = created = updated = unchanged = 0
+        sacli_tasks = 0
+        new_user_default = VPNUser._meta.get_field('has_access_server_user').default
+
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        try:
+            # Step 1: Group configurations for max_connections
+            group_limits = load_group_limits(conn)
+
+            # Step 2: Stream legacy rows chunk by chunk
+            cur = conn.execute('SELECT username, password, active, expire_date, group_id FROM app_ocservuser')
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                seen += len(rows)
+                # A username listed twice in one chunk would hit ON CONFLICT twice; last one wins
+                rows = list({row[0]: row for row in rows}.values())
+
+                # Step 3: Look up only this chunk's existing users
+                existing = {
+                    values[0]: values
+                    for values in VPNUser.objects.filter(
+                        username__in=[row[0] for row in rows]
+                    ).values_list('username', *UPDATE_FIELDS, 'has_access_server_user', 'revision')
+                }
+
+                # Step 4: Build the rows that actually change
+                to_upsert = []
+                entries = []
+                for uname, password, active, expire_date, group_id in rows:
+                    values = (
+                        password or '',
+                        bool(active),
+                        parse_expiry(expire_date, today),
+                        group_limits.get(group_id, 1),
                     )
-                )
-
-        # Step 5: Bulk write inside a transaction
-        with transaction.atomic():
-            if to_update:
-                VPNUser.objects.bulk_update(
-                    to_update,
-                    ['openvpn_password', 'is_active', 'expiry_date', 'max_connections'],
-                    batch_size=500
-                )
-            if to_create:
-                VPNUser.objects.bulk_create(
-                    to_create,
-                    batch_size=500
-                )
-
-        total = len(to_update) + len(to_create)
-        self.stdout.write(self.style.SUCCESS(f"Imported/updated {total} VPNUser(s) (created={len(to_create)}, updated={len(to_update)})"))
+                    old = existing.get(uname)
+                    if old is not None and old[1:5] == values:
+                        unchanged += 1
+                        continue
+                    if old is None:
+                        created += 1
+                        has_access_server_user, revision = new_user_default, 1
+                    else:
+                        updated += 1
+                        has_access_server_user, revision = old[5], old[6] + 1
+                    # bulk_create skips save(), so the sort key and revision are set here
+                    to_upsert.append(VPNUser(username=uname, **dict(zip(UPDATE_FIELDS, values)),
+                                             has_access_server_user=has_access_server_user,
+                                             username_sort_key=natural_sort_key(uname), revision=revision))
+
+                    # Same Access Server work the pre_save signal would have queued
+                    if not has_access_server_user:
+                        continue
+                    password, active = values[0], values[1]
+                    if active and (old is None or not old[2] or old[1] != password):
+                        entries.append((VPNTask.OP_PROVISION, uname, {'password': password}, revision, values))
+                    elif not active and old is not None and old[2]:
+                        entries.append((VPNTask.OP_DENY, uname, None, revision, values))
+
+                # Step 5: One upsert (and outbox insert) per chunk
+                with transaction.atomic():
+                    if to_upsert:
+                        VPNUser.objects.bulk_create(
+                            to_upsert,
+                            update_conflicts=True,
+                            unique_fields=['username'],
+                            update_fields=UPDATE_FIELDS + ['revision'],
+                        )
+                    if entries:
+                        # The idempotency keys need the pks, which the upsert does not return
+                        pks = dict(VPNUser.objects.filter(
+                            username__in=[entry[1] for entry in entries]).values_list('username', 'pk'))
+                        enqueue_many([
+                            (op, uname, payload, change_key(op, pks[uname], revision, *values))
+                            for op, uname, payload, revision, values in entries
+                        ])
+                sacli_tasks += len(entries)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"  {seen} rows ({seen / elapsed:.0f} rows/s): "
+                    f"created={created} updated={updated} unchanged={unchanged}")
+        finally:
+            conn.close()
+        import_done = time.perf_counter()
+
+        # Step 6: One consolidated psw file sync for the plain OpenVPN users
+        changes, desired = sync_from_db()
+        sync_done = time.perf_counter()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported/updated {created + updated} VPNUser(s) "
+            f"(created={created}, updated={updated}, unchanged={unchanged}) from {seen} rows"))
+        self.stdout.write(
+            f"PSW file: {len(changes)} line(s) changed for {desired} active users; "
+            f"queued {sacli_tasks} Access Server task(s) for run_vpn_worker")
+        self.stdout.write(
+            f"Timing: import={import_done - started:.3f}s "
+            f"({seen / max(import_done - started, 1e-9):.0f} rows/s) psw={sync_done - import_done:.3f}s")
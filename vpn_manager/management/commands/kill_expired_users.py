@@ -4,7 +4,7 @@ from django.utils import timezone
 from vpn_manager.models import VPNUser
 from django.conf import settings
 from datetime import date
-from vpn_manager.utils import get_client_info, kill_user
+from vpn_manager.utils import get_client_info, kill_user, kill_users
 PSW_FILE = settings.OPENVPN_PSW_FILE
 
 
@@ -20,8 +20,15 @@ class Command(BaseCommand):
             is_active=True, expiry_date__gte=date.today())
         current_users = get_client_info()
         counter = 0
+        mgmt_usernames = []
         for user in expired_users:
             if user.username in current_users:
-                kill_user(user.username, user.has_access_server_user)
-                counter+=1
+                if user.has_access_server_user:
+                    kill_user(user.username, user.has_access_server_user)
+                    counter+=1
+                else:
+                    mgmt_usernames.append(user.username)
+        # Disconnect the plain OpenVPN users over a single management session
+        if mgmt_usernames:
+            counter += sum(1 for ok in kill_users(mgmt_usernames).values() if ok)
         self.stdout.write(self.style.SUCCESS(f"Killed {counter} users"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from vpn_manager.quota import reset_quotas
+
+
+class Command(BaseCommand):
+    help = 'Start the monthly quota period: zero the usage and lift quota denials (cron, on the 1st)'
+
+    def handle(self, *args, **options):
+        reset, lifted = reset_quotas()
+        self.stdout.write(self.style.SUCCESS(
+            f"Reset the usage of {reset} user(s), lifted {len(lifted)} quota denial(s)"))
+        if lifted:
+            self.stdout.write("Lifted: " + ', '.join(lifted[:50]))
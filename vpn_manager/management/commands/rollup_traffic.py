@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from vpn_manager import accounting
+
+
+class Command(BaseCommand):
+    help = 'Roll traffic samples up into hourly/daily totals and prune old data (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_true',
+                            help='Only roll up, keep everything')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        hours, days = accounting.rollup()
+        self.stdout.write(f"Rolled up {hours} hourly and {days} daily row(s) "
+                          f"in {time.perf_counter() - started:.2f}s")
+        if not options['no_prune']:
+            deleted = accounting.prune()
+            self.stdout.write(
+                f"Pruned {deleted['samples']} sample(s), {deleted['hourly']} hourly and "
+                f"{deleted['daily']} daily row(s)")
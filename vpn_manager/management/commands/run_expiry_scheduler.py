@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from vpn_manager.expiry import ExpiryScheduler
+from vpn_manager.mgmt import get_management_client
+
+
+class Command(BaseCommand):
+    help = 'Deactivate and disconnect users the moment they expire (replaces polling kill_expired_users)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resync', type=float, default=3600,
+                            help='Seconds between full reloads of the expiry heap')
+        parser.add_argument('--max-sleep', type=float, default=60,
+                            help='Upper bound on a single wait')
+        parser.add_argument('--client-auth', action='store_true',
+                            help='Answer >CLIENT:CONNECT/REAUTH (OpenVPN runs with --management-client-auth)')
+        parser.add_argument('--no-mgmt', action='store_true',
+                            help='Only run the timers; do not hold the management interface')
+
+    def handle(self, *args, **options):
+        client = None if options['no_mgmt'] else get_management_client()
+        scheduler = ExpiryScheduler(client, client_auth=options['client_auth'])
+        next_resync = 0.0
+
+        while True:
+            if time.monotonic() >= next_resync:
+                count = scheduler.resync()
+                next_resync = time.monotonic() + options['resync']
+                self.stdout.write(f"Loaded {count} active user(s); next expiry {scheduler.next_deadline()}")
+
+            expired = scheduler.fire_due()
+            if expired:
+                self.stdout.write(f"Expired {len(expired)} user(s): {', '.join(expired[:50])}")
+
+            # Sleep until the next deadline/resync, or until the VPN server talks to us
+            wait = min(options['max_sleep'], next_resync - time.monotonic())
+            deadline = scheduler.next_deadline()
+            if deadline is not None:
+                wait = min(wait, (deadline - timezone.now()).total_seconds())
+            wait = max(wait, 0.0)
+            if client is None:
+                time.sleep(wait)
+                continue
+            try:
+                # Events queued while fire_due() talked to the interface were
+                # already read from the socket: answer them before waiting
+                if scheduler.events or client.listen(wait):
+                    scheduler.handle_events()
+            except Exception as e:
+                self.stderr.write(f"Management interface error: {e}")
+                client.close()
+                time.sleep(min(wait, 5.0))
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from vpn_manager import collector
+from vpn_manager.enforce import group_by_user, load_limits, plan_kills
+from vpn_manager.mgmt_listener import ManagementListener
+from vpn_manager.models import VPNSession
+
+
+class Command(BaseCommand):
+    help = 'Hold the management interface and mirror its live session table into VPNSession'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bytecount', type=int, default=5,
+                            help='Seconds between >BYTECOUNT_CLI updates (0 disables them)')
+        parser.add_argument('--flush', type=float, default=1.0,
+                            help='Seconds to batch connects/disconnects before writing them')
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Write the table at least this often (carries byte counts)')
+        parser.add_argument('--enforce', action='store_true',
+                            help='Also disconnect the oldest sessions of users over max_connections')
+
+    def handle(self, *args, **options):
+        listener = ManagementListener(bytecount=options['bytecount'])
+        try:
+            asyncio.run(self.main(listener, options))
+        except KeyboardInterrupt:
+            listener.stop()
+
+    async def main(self, listener, options):
+        dirty = asyncio.Event()
+        joined = set()  # users with a new session since the last flush
+
+        def on_change(kind, session):
+            if kind == 'add':
+                joined.add(session.username)
+            elif kind == 'reset':
+                joined.update(s.username for s in listener.sessions.values())
+            dirty.set()
+
+        listener.on_change = on_change
+        loop = asyncio.get_running_loop()
+
+        def disconnect(users, rows):
+            # Users over quota; runs in store()'s thread. The management
+            # interface takes one client, so kill over the listener's connection.
+            wanted = {user.username for user in users}
+            sessions = [session for session in listener.snapshot() if session.username in wanted]
+            oks = asyncio.run_coroutine_threadsafe(listener.kill_sessions(sessions), loop).result()
+            results = dict.fromkeys(wanted, True)
+            for session, ok in zip(sessions, oks):
+                results[session.username] = results[session.username] and ok
+            return results
+
+        run_task = asyncio.create_task(listener.run())
+        store = sync_to_async(collector.store)
+        last_flush = 0.0
+
+        while not run_task.done():
+            try:
+                await asyncio.wait_for(dirty.wait(), options['interval'])
+                await asyncio.sleep(options['flush'])  # let a burst of events settle
+            except asyncio.TimeoutError:
+                pass
+            if not listener.connected.is_set():
+                continue  # the table is stale until the next resync
+
+            dirty.clear()
+            usernames = set(joined)
+            joined.clear()
+            started = time.perf_counter()
+            stored, removed = await store({VPNSession.SOURCE_MGMT: listener.snapshot()}, disconnect=disconnect)
+            if options['enforce'] and usernames:
+                await self.enforce(listener, usernames)
+            if removed or time.monotonic() - last_flush >= options['interval']:
+                self.stdout.write(f"{stored} session(s), {removed} removed in "
+                                  f"{time.perf_counter() - started:.2f}s; {listener.stats}")
+                last_flush = time.monotonic()
+        await run_task
+
+    async def enforce(self, listener, usernames):
+        """Apply max_connections to the users who just connected."""
+        by_user = group_by_user({VPNSession.SOURCE_MGMT: [
+            session for session in listener.snapshot() if session.username in usernames
+        ]})
+        candidates = [username for username, sessions in by_user.items() if len(sessions) > 1]
+        if not candidates:
+            return
+        victims = plan_kills(by_user, await sync_to_async(load_limits)(candidates))
+        if not victims:
+            return
+        # The DISCONNECT notifications remove the killed sessions from the table
+        oks = await listener.kill_sessions([session for _, session in victims])
+        for (_, session), ok in zip(victims, oks):
+            status = 'Disconnected' if ok else 'Failed to disconnect'
+            self.stdout.write(f"{status} {session.username} {session.real_address} (over max_connections)")
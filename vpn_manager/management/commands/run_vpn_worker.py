@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from vpn_manager import outbox
+
+# Seconds between deletions of old done tasks
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = 'Apply queued VPNUser side effects (sacli provisioning, deny, disconnect)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-attempts', type=int, default=8)
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the due tasks once and exit')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print queue depth and lag and exit')
+        parser.add_argument('--no-prune', action='store_true',
+                            help='Keep done tasks instead of deleting them after VPN_TASK_RETENTION_DAYS')
+
+    def write_metrics(self):
+        m = outbox.metrics()
+        self.stdout.write(
+            f"queue: pending={m['pending']} due={m['due']} running={m['running']} "
+            f"failed={m['failed']} lag={m['lag_seconds']:.1f}s")
+
+    def prune(self):
+        pruned = outbox.prune()
+        if pruned:
+            self.stdout.write(f"Pruned {pruned} done task(s)")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_metrics()
+            return
+
+        pruned_at = None
+        while True:
+            if not options['no_prune'] and (pruned_at is None or time.monotonic() - pruned_at >= PRUNE_INTERVAL):
+                self.prune()
+                pruned_at = time.monotonic()
+            tasks = outbox.claim(options['batch_size'])
+            if not tasks:
+                if options['once']:
+                    self.write_metrics()
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            started = time.perf_counter()
+            results = outbox.apply_tasks(tasks)
+            done = outbox.finish(tasks, results, options['max_attempts'])
+            now = timezone.now()
+            lag = max((now - task.created_at).total_seconds() for task in tasks)
+            self.stdout.write(
+                f"Applied {done}/{len(tasks)} task(s) in {time.perf_counter() - started:.2f}s "
+                f"(max lag {lag:.1f}s)")
+            if done < len(tasks):
+                self.write_metrics()
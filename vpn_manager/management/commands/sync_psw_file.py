@@ -1,56 +1,91 @@
 import os
+import time
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from vpn_manager.models import VPNUser
+from vpn_manager.models import VPNTask, VPNUser
 from django.conf import settings
 from datetime import date
+from vpn_manager.outbox import change_key, enqueue_many
+from vpn_manager.psw_store import sync_from_db
 PSW_FILE = settings.OPENVPN_PSW_FILE
-
-
-
-
-def _write_users(users):
-    """
-    Write the users dictionary to the PSW file, one per line in 'username:password:max_connections' format.
-    """
-    os.makedirs(os.path.dirname(PSW_FILE), exist_ok=True)
-    with open(PSW_FILE, 'w') as f:
-        for user, data in users.items():
-            f.write(f"{user}:{data['password']}:{data['max_connections']}\n")
+# Users deactivated per UPDATE
+CHUNK_SIZE = 500
 
 
 class Command(BaseCommand):
     help = 'Synchronize VPNUser entries to the OpenVPN PSW file'
 
-    def handle(self, *args, **options):
-        # Filter active, non-expired VPNUsers
-        active_users = VPNUser.objects.filter(
-            is_active=True, expiry_date__gte=date.today(), has_access_server_user=False)
-        users = {
-            u.username: {
-                'password': u.openvpn_password,
-                'max_connections': u.max_connections
-            }
-            for u in active_users
-        }
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would change without touching the file or the DB',
+        )
 
-        _write_users(users)
-        self.stdout.write(self.style.SUCCESS(
-            f"Synced {len(users)} users to {PSW_FILE}"))
-        
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        today = date.today()
+        started = time.perf_counter()
 
-        # Mark expired users as inactive
-        expired_users = VPNUser.objects.filter(has_access_server_user=False).exclude(
-            is_active=True, expiry_date__gte=date.today())
-        expired_users.update(is_active=False)
+        # 1. Diff active, non-expired plain OpenVPN users against the PSW file
+        changes, desired = sync_from_db(dry_run=dry_run)
+        added = sum(1 for entry in changes.values() if entry is not None)
+        removed = len(changes) - added
+        write_done = time.perf_counter()
 
-        
-        expired_users = VPNUser.objects.filter(has_access_server_user=True).exclude(
-            is_active=True, expiry_date__gte=date.today())
-        for user in expired_users:
-            user.is_active=False
-            user.save()
+        if not changes:
+            self.stdout.write(f"PSW file already in sync ({desired} users), nothing written")
+        elif dry_run:
+            self.stdout.write(f"Would add/update {added} and remove {removed} line(s) in {PSW_FILE}")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Synced {desired} users to {PSW_FILE} (added/updated={added}, removed={removed})"))
 
+        # 2. Deactivate expired users and queue their deny/disconnect in the
+        #    outbox, in the same transaction, so run_vpn_worker retries failures
+        expired = VPNUser.objects.filter(is_active=True, expiry_date__lt=today)
+        if dry_run:
+            access_server = expired.filter(has_access_server_user=True).count()
+            self.stdout.write(
+                f"Would deactivate {expired.count() - access_server} plain and "
+                f"{access_server} Access Server user(s)")
+        else:
+            deactivated = deactivate(expired)
+            access_server = sum(1 for _, _, has_access_server_user in deactivated if has_access_server_user)
+            self.stdout.write(
+                f"Deactivated {len(deactivated)} user(s), queued deny for {access_server} Access Server "
+                f"and disconnect for {len(deactivated) - access_server} plain user(s)")
+        update_done = time.perf_counter()
 
+        self.stdout.write(
+            f"Timing: diff+write={write_done - started:.3f}s "
+            f"update={update_done - write_done:.3f}s total={update_done - started:.3f}s")
 
 
+def deactivate(expired):
+    """
+    Set is_active=False on the `expired` users, one UPDATE per chunk, and
+    queue what the pre_save signal would have: a deny (and disconnect) for
+    Access Server users, a disconnect for plain ones. The bulk UPDATE skips
+    save(), so the revision is bumped here. Returns the (pk, username,
+    has_access_server_user) of the users deactivated.
+    """
+    deactivated = []
+    with transaction.atomic():
+        rows = list(expired.select_for_update().values_list('pk', 'username', 'has_access_server_user', 'revision'))
+        for start in range(0, len(rows), CHUNK_SIZE):
+            chunk = rows[start:start + CHUNK_SIZE]
+            VPNUser.objects.filter(pk__in=[row[0] for row in chunk]).update(
+                is_active=False, revision=F('revision') + 1)
+            entries = []
+            for pk, username, has_access_server_user, revision in chunk:
+                if has_access_server_user:
+                    op, payload = VPNTask.OP_DENY, None
+                else:
+                    op, payload = VPNTask.OP_DISCONNECT, {'has_access_server_user': False}
+                entries.append((op, username, payload, change_key(op, pk, revision + 1, 'expired')))
+                deactivated.append((pk, username, has_access_server_user))
+            enqueue_many(entries)
+    return deactivated
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from vpn_manager.history import who_had
+
+
+class Command(BaseCommand):
+    help = 'Show who held a real or virtual address at a given time (abuse reports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('address', help='1.2.3.4, 1.2.3.4:1194, [2001:db8::1]:1194 or a virtual IP')
+        parser.add_argument('at', help='Time, e.g. "2026-10-01 12:00" (server time zone unless given)')
+        parser.add_argument('--node', help='Only this VPN node')
+
+    def handle(self, *args, **options):
+        at = parse_datetime(options['at'])
+        if at is None:
+            raise CommandError(f"Cannot read the time {options['at']!r}")
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        intervals = who_had(options['address'], at, node=options['node'])
+        for interval in intervals:
+            self.stdout.write(
+                f"{interval.username}\t{interval.node or '-'}\t{interval.real_address}\t"
+                f"{interval.virtual_ip or '-'}\t{interval.start.isoformat()}\t{interval.end.isoformat()}")
+        if not intervals:
+            self.stderr.write(f"Nobody held {options['address']} at {at.isoformat()}")
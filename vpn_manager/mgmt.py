@@ -0,0 +1,338 @@
+"""Client for the OpenVPN management interface.
+
+The management interface only serves one client at a time, so every caller in
+a process shares a single client guarded by a lock, and a connection is only
+kept while it is in use: one opened for execute() is closed as soon as the
+replies are read, so the admin, the collector or the outbox worker never lock
+other processes out. A long-lived client (the expiry scheduler) calls
+connect() to hold the interface until close(). Commands can be pipelined:
+they are written in one go and the replies are read back in order.
+
+Replies are framed per command (see reply_frames): most commands answer with
+a single SUCCESS:/ERROR: line, while status, help, version and the log/echo/
+state history answer with a block of lines closed by END (or a lone ERROR:
+line). Real-time '>' notifications may arrive in the middle of a reply and
+are passed to the notification handler. Every command returns a Response.
+"""
+import select
+import socket
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from decouple import config
+
+from vpn_manager.status_log import parse_v2
+
+# Management interface connection settings (configure via env vars)
+MGMT_HOST = config('OPENVPN_MGMT_HOST', default='127.0.0.1')
+MGMT_PORT = int(config('OPENVPN_MGMT_PORT', default=7505))
+MGMT_TIMEOUT = int(config('OPENVPN_MGMT_TIMEOUT', default=5))  # seconds
+
+
+# Commands answered with a block of lines closed by END
+BLOCK_COMMANDS = frozenset(('status', 'help', 'version'))
+# 'on'/'off' is acknowledged with one line, history ('N', 'all') comes as a
+# block, and 'on all' sends both
+HISTORY_COMMANDS = frozenset(('log', 'echo', 'state'))
+
+
+class ManagementError(Exception):
+    """Raised when the management interface answers a command with ERROR."""
+
+
+def reply_frames(command):
+    """The parts of the reply to `command`, in order: 'line' and/or 'block'."""
+    name, _, arg = command.strip().partition(' ')
+    name = name.lower()
+    if name in BLOCK_COMMANDS:
+        return ('block',)
+    if name in HISTORY_COMMANDS:
+        args = arg.lower().split()
+        if args and args[0] in ('on', 'off'):
+            return ('line', 'block') if args[1:] == ['all'] else ('line',)
+        return ('block',)
+    return ('line',)
+
+
+class Response(NamedTuple):
+    command: str
+    ok: bool
+    lines: list  # the SUCCESS:/ERROR: line and/or the block's lines, without END
+
+    @property
+    def message(self):
+        """The first line without its SUCCESS:/ERROR: prefix."""
+        if not self.lines:
+            return ''
+        status, sep, text = self.lines[0].partition(':')
+        return text.strip() if sep and status in ('SUCCESS', 'ERROR') else self.lines[0]
+
+
+class ResponseFramer:
+    """
+    Collect the reply to one command from the lines that follow it (real-time
+    notifications excluded). feed() returns the Response once complete.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self._frames = list(reply_frames(command))
+        self._lines = []
+        self._ok = True
+        self._in_block = False
+
+    def feed(self, line):
+        if self._frames[0] == 'line' or (not self._in_block and line.startswith('ERROR:')):
+            self._lines.append(line)
+            if line.startswith('ERROR:'):
+                self._ok = False
+                self._frames = []  # nothing follows an error
+            else:
+                self._frames.pop(0)
+        elif line == 'END':
+            self._frames.pop(0)
+            self._in_block = False
+        else:
+            self._in_block = True
+            self._lines.append(line)
+        if self._frames:
+            return None
+        return Response(self.command, self._ok, self._lines)
+
+
+class ManagementClient:
+    def __init__(self, host=MGMT_HOST, port=MGMT_PORT, timeout=MGMT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # Called with every real-time notification line (starting with '>')
+        self.notification_handler = None
+        self._sock = None
+        self._held = False  # connect() was called: stay connected after commands
+        self._buffer = bytearray()
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        """Connect and keep the connection (and the interface) until close()."""
+        with self._lock:
+            self._open()
+            self._held = True
+
+    def _open(self):
+        with self._lock:
+            if self._sock is not None:
+                return
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._buffer.clear()
+            try:
+                # Read and discard the ">INFO:OpenVPN Management Interface ..." banner
+                self._readline()
+            except Exception:
+                self.close()
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+            self._sock = None
+            self._held = False
+            self._buffer.clear()
+
+    def _readline(self):
+        # Own line buffer (not sock.makefile) so listen() can select() on the
+        # socket without losing lines that were already received.
+        while True:
+            end = self._buffer.find(b'\n')
+            if end != -1:
+                line = bytes(self._buffer[:end])
+                del self._buffer[:end + 1]
+                return line.decode('utf-8', errors='ignore').rstrip('\r')
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Management interface closed the connection')
+            self._buffer += chunk
+
+    def _dispatch(self, line):
+        if self.notification_handler is not None:
+            self.notification_handler(line)
+
+    def _read_response(self, command):
+        """Read the reply to `command`, dispatching notifications interleaved with it."""
+        framer = ResponseFramer(command)
+        while True:
+            line = self._readline()
+            if line.startswith('>'):
+                self._dispatch(line)
+                continue
+            response = framer.feed(line)
+            if response is not None:
+                return response
+
+    def listen(self, timeout):
+        """
+        Wait up to `timeout` seconds for real-time notifications and pass them
+        to notification_handler. Returns the number dispatched; returns early
+        once a burst of notifications has been drained.
+        """
+        with self._lock:
+            self.connect()
+            deadline = time.monotonic() + timeout
+            dispatched = 0
+            while True:
+                if b'\n' not in self._buffer:
+                    wait = 0 if dispatched else deadline - time.monotonic()
+                    if wait < 0 or not select.select([self._sock], [], [], wait)[0]:
+                        return dispatched
+                line = self._readline()
+                if line.startswith('>'):
+                    self._dispatch(line)
+                    dispatched += 1
+
+    def execute(self, commands):
+        """
+        Send several commands in one write and return their Responses in order.
+        The connection is re-established (once) if it turns out to be stale,
+        and closed afterwards unless connect() holds it.
+        """
+        commands = list(commands)
+        payload = ''.join(f"{cmd}\n" for cmd in commands).encode('utf-8')
+        with self._lock:
+            held = self._held
+            try:
+                for attempt in (1, 2):
+                    try:
+                        self._open()
+                        self._sock.sendall(payload)
+                        return [self._read_response(cmd) for cmd in commands]
+                    except (OSError, ConnectionError):
+                        self.close()
+                        if attempt == 2:
+                            raise
+            finally:
+                if held:
+                    self._held = self._sock is not None
+                else:
+                    self.close()
+
+    def command(self, cmd):
+        return self.execute([cmd])[0]
+
+    def status(self):
+        """Return the raw lines of 'status 2' (comma separated, CLIENT_LIST prefixed)."""
+        response = self.command('status 2')
+        if not response.ok:
+            raise ManagementError(response.lines[0])
+        return response.lines
+
+    def sessions(self):
+        """Parsed 'status 2' client list as ClientSession tuples."""
+        return parse_v2('\n'.join(self.status()))
+
+    def connected_usernames(self):
+        users = set()
+        for line in self.status():
+            if line.startswith('CLIENT_LIST,'):
+                parts = line.split(',')
+                if len(parts) > 1:
+                    users.add(parts[1])
+        return users
+
+    def kill(self, common_name):
+        return self.kill_many([common_name])[common_name]
+
+    def kill_many(self, common_names):
+        """Disconnect every common name over one session; returns {cn: ok}."""
+        common_names = list(dict.fromkeys(common_names))
+        if not common_names:
+            return {}
+        replies = self.execute([f"kill {cn}" for cn in common_names])
+        return {cn: reply.ok for cn, reply in zip(common_names, replies)}
+
+    def kill_sessions(self, sessions):
+        """
+        Disconnect individual sessions over one session: by client ID
+        ('client-kill') when the status output has one, else by real address.
+        Returns a list of booleans in the order of `sessions`.
+        """
+        sessions = list(sessions)
+        if not sessions:
+            return []
+        commands = [
+            f"client-kill {s.client_id}" if s.client_id is not None else f"kill {s.real_address}"
+            for s in sessions
+        ]
+        return [reply.ok for reply in self.execute(commands)]
+
+
+class ClientEvent(NamedTuple):
+    """A '>CLIENT:' notification; env is filled for CONNECT/REAUTH/ESTABLISHED."""
+    kind: str  # CONNECT, REAUTH, ESTABLISHED, DISCONNECT, ADDRESS, CR_RESPONSE
+    cid: int
+    kid: Optional[int]
+    env: dict
+    args: tuple = ()
+
+
+class ClientEventParser:
+    """
+    Assemble '>CLIENT:' notifications, which span several lines
+    (>CLIENT:CONNECT,{CID},{KID} then >CLIENT:ENV,name=value ... >CLIENT:ENV,END).
+    feed() returns a ClientEvent when one is complete, else None.
+    """
+
+    def __init__(self):
+        self._pending = None
+
+    def feed(self, line):
+        if not line.startswith('>CLIENT:'):
+            return None
+        kind, _, rest = line[len('>CLIENT:'):].partition(',')
+        if kind == 'ENV':
+            if self._pending is None:
+                return None
+            if rest == 'END':
+                event, self._pending = self._pending, None
+                return event
+            name, _, value = rest.partition('=')
+            self._pending.env[name] = value
+            return None
+        parts = rest.split(',')
+        try:
+            cid = int(parts[0])
+        except ValueError:
+            return None
+        kid = int(parts[1]) if kind in ('CONNECT', 'REAUTH') and len(parts) > 1 and parts[1].isdigit() else None
+        event = ClientEvent(kind, cid, kid, {}, tuple(parts[1:]))
+        if kind == 'ADDRESS':
+            return event
+        # Every other CLIENT notification is followed by an ENV block
+        self._pending = event
+        return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_management_client():
+    """Return the process-wide shared ManagementClient."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ManagementClient()
+        return _client
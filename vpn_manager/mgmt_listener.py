@@ -0,0 +1,257 @@
+"""
+Asyncio listener for the OpenVPN management interface.
+
+Instead of polling `status`, the listener holds the management connection,
+enables `bytecount N` and keeps an always-current table of sessions (keyed by
+client ID) from the real-time notifications:
+
+    >CLIENT:ESTABLISHED,{CID} + ENV    session added
+    >CLIENT:ADDRESS,{CID},{ADDR},{PRI} virtual address learned
+    >CLIENT:DISCONNECT,{CID} + ENV     session removed
+    >BYTECOUNT_CLI:{CID},{IN},{OUT}    traffic counters
+
+On every (re)connect the table is rebuilt from `status 2`, so events missed
+while disconnected are replayed. Notifications pass through a bounded queue:
+when the consumer falls behind, reading stops and TCP pushes back on the VPN
+server. Byte counts are coalesced per client instead of queued, so a burst of
+them never blocks the connection and never grows memory.
+
+The management interface serves one client at a time, so commands that must
+reach it while the listener runs (kills, ...) go through command().
+"""
+import asyncio
+from collections import deque
+
+from vpn_manager.mgmt import (
+    MGMT_HOST, MGMT_PORT, MGMT_TIMEOUT, ClientEventParser, ManagementError, ResponseFramer,
+)
+from vpn_manager.sessions import ClientSession, from_time_t, to_int
+from vpn_manager.status_log import parse_v2
+
+
+class ManagementListener:
+    def __init__(self, host=MGMT_HOST, port=MGMT_PORT, bytecount=5, queue_size=10000,
+                 timeout=MGMT_TIMEOUT, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        self.host = host
+        self.port = port
+        self.bytecount = bytecount
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.sessions = {}  # cid -> ClientSession
+        # Called as on_change(kind, session) with kind 'add', 'remove' or 'reset'
+        self.on_change = None
+        self.connected = asyncio.Event()
+        self.stats = {'events': 0, 'bytecounts': 0, 'coalesced': 0, 'resyncs': 0, 'reconnects': 0}
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._bytecounts = {}  # cid -> (in, out), latest wins
+        self._wakeup = asyncio.Event()
+        self._parser = ClientEventParser()
+        self._pending = deque()  # (future, ResponseFramer) in command order
+        self._command_lock = asyncio.Lock()
+        self._writer = None
+        self._stopped = False
+
+    # Public API --------------------------------------------------------------
+
+    async def run(self):
+        """Connect, listen and reconnect with backoff until stop() is called."""
+        delay = self.reconnect_delay
+        while not self._stopped:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Management listener cannot connect to {self.host}:{self.port}: {e}")
+            else:
+                delay = self.reconnect_delay
+                try:
+                    await self._serve(reader, writer)
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, ManagementError) as e:
+                    if not self._stopped:
+                        print(f"Management listener connection lost: {e}")
+                finally:
+                    self._disconnect(writer)
+                self.stats['reconnects'] += 1
+            if self._stopped:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def stop(self):
+        self._stopped = True
+        if self._writer is not None:
+            self._writer.close()
+
+    async def execute(self, commands):
+        """Pipeline commands over the listener's connection; returns their Responses in order."""
+        commands = list(commands)
+        loop = asyncio.get_running_loop()
+        async with self._command_lock:
+            if self._writer is None:
+                raise ConnectionError('Management listener is not connected')
+            futures = []
+            for cmd in commands:
+                futures.append(loop.create_future())
+                self._pending.append((futures[-1], ResponseFramer(cmd)))
+            self._writer.write(''.join(f'{cmd}\n' for cmd in commands).encode('utf-8'))
+            await self._writer.drain()
+        return await asyncio.wait_for(asyncio.gather(*futures), self.timeout + len(commands) / 100)
+
+    async def command(self, cmd):
+        return (await self.execute([cmd]))[0]
+
+    async def kill_sessions(self, sessions):
+        """Kill individual sessions by client ID (or real address); returns a list of booleans."""
+        commands = [
+            f'client-kill {s.client_id}' if s.client_id is not None else f'kill {s.real_address}'
+            for s in sessions
+        ]
+        if not commands:
+            return []
+        try:
+            replies = await self.execute(commands)
+        except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+            print(f"Error killing sessions via management listener: {e}")
+            return [False] * len(commands)
+        return [reply.ok for reply in replies]
+
+    def snapshot(self):
+        """Current sessions as a list of ClientSession."""
+        return list(self.sessions.values())
+
+    # Connection --------------------------------------------------------------
+
+    async def _serve(self, reader, writer):
+        self._writer = writer
+        read_task = asyncio.create_task(self._read_loop(reader))
+        apply_task = asyncio.create_task(self._apply_loop())
+        try:
+            if self.bytecount:
+                await self.command(f'bytecount {self.bytecount}')
+            await self.resync()
+            self.connected.set()
+            await read_task
+        finally:
+            self.connected.clear()
+            read_task.cancel()
+            apply_task.cancel()
+            await asyncio.gather(read_task, apply_task, return_exceptions=True)
+
+    def _disconnect(self, writer):
+        self._writer = None
+        writer.close()
+        for future, _ in self._pending:
+            if not future.done():
+                future.set_exception(ConnectionError('Management interface connection lost'))
+        self._pending.clear()
+        self._bytecounts.clear()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def resync(self):
+        """Replace the table with what `status 2` reports (replays missed events)."""
+        response = await self.command('status 2')
+        if not response.ok:
+            raise ManagementError(response.lines[0])
+        self.sessions = {
+            session.client_id: session
+            for session in parse_v2('\n'.join(response.lines))
+            if session.client_id is not None
+        }
+        self.stats['resyncs'] += 1
+        self._notify('reset', None)
+
+    async def _read_loop(self, reader):
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                raise ConnectionError('Management interface closed the connection')
+            line = raw.decode('utf-8', errors='ignore').rstrip('\r\n')
+            if line.startswith('>BYTECOUNT_CLI:'):
+                self._coalesce_bytecount(line)
+            elif line.startswith('>'):
+                # Blocks when the consumer is behind: backpressure on the socket
+                await self._queue.put(line)
+                self._wakeup.set()
+            elif self._pending:
+                self._collect_reply(line)
+
+    def _collect_reply(self, line):
+        future, framer = self._pending[0]
+        response = framer.feed(line)
+        if response is not None:
+            self._pending.popleft()
+            if not future.done():
+                future.set_result(response)
+
+    def _coalesce_bytecount(self, line):
+        parts = line[len('>BYTECOUNT_CLI:'):].split(',')
+        if len(parts) < 3:
+            return
+        cid = to_int(parts[0], None)
+        if cid is None:
+            return
+        if cid in self._bytecounts:
+            self.stats['coalesced'] += 1
+        self._bytecounts[cid] = (to_int(parts[1]), to_int(parts[2]))
+        self._wakeup.set()
+
+    # Applying events -----------------------------------------------------------
+
+    async def _apply_loop(self):
+        while True:
+            if self._queue.empty() and not self._bytecounts:
+                # Sleep until a notification is queued or a byte count arrives
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            while not self._queue.empty():
+                self._apply_line(self._queue.get_nowait())
+            self._apply_bytecounts()
+
+    def _apply_bytecounts(self):
+        counts, self._bytecounts = self._bytecounts, {}
+        for cid, (bytes_in, bytes_out) in counts.items():
+            session = self.sessions.get(cid)
+            if session is not None:
+                self.sessions[cid] = session._replace(bytes_received=bytes_in, bytes_sent=bytes_out)
+        self.stats['bytecounts'] += len(counts)
+
+    def _apply_line(self, line):
+        event = self._parser.feed(line)
+        if event is None:
+            return
+        self.stats['events'] += 1
+        env = event.env
+        if event.kind == 'ESTABLISHED':
+            ip = env.get('trusted_ip') or env.get('untrusted_ip', '')
+            port = env.get('trusted_port') or env.get('untrusted_port', '')
+            session = ClientSession(
+                username=env.get('common_name') or env.get('username', ''),
+                real_address=f'{ip}:{port}' if port else ip,
+                virtual_address=env.get('ifconfig_pool_remote_ip', ''),
+                virtual_ipv6_address=env.get('ifconfig_pool_remote_ip6', ''),
+                connected_since=from_time_t(env.get('time_unix')),
+                client_id=event.cid,
+            )
+            self.sessions[event.cid] = session
+            self._notify('add', session)
+        elif event.kind == 'DISCONNECT':
+            session = self.sessions.pop(event.cid, None)
+            if session is not None:
+                self._notify('remove', session._replace(
+                    bytes_received=to_int(env.get('bytes_received'), session.bytes_received),
+                    bytes_sent=to_int(env.get('bytes_sent'), session.bytes_sent),
+                ))
+        elif event.kind == 'ADDRESS':
+            session = self.sessions.get(event.cid)
+            # args: (address, primary flag)
+            if session is not None and len(event.args) > 1 and event.args[1] == '1':
+                self.sessions[event.cid] = session._replace(virtual_address=event.args[0])
+
+    def _notify(self, kind, session):
+        if self.on_change is not None:
+            try:
+                self.on_change(kind, session)
+            except Exception as e:
+                print(f"Error in management listener callback: {e}")
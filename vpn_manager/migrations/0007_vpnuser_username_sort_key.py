@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:45
+
+import re
+
+from django.db import migrations, models
+
+
+def natural_sort_key(username):
+    # Frozen copy of vpn_manager.models.natural_sort_key
+    key = re.sub(r'\d+', lambda m: m.group().zfill(20), username.lower())
+    return key[:255]
+
+
+def backfill_sort_keys(apps, schema_editor):
+    VPNUser = apps.get_model('vpn_manager', 'VPNUser')
+    batch = []
+    for user in VPNUser.objects.only('id', 'username').iterator(chunk_size=2000):
+        user.username_sort_key = natural_sort_key(user.username)
+        batch.append(user)
+        if len(batch) >= 2000:
+            VPNUser.objects.bulk_update(batch, ['username_sort_key'])
+            batch = []
+    if batch:
+        VPNUser.objects.bulk_update(batch, ['username_sort_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0006_vpntask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpnuser',
+            name='username_sort_key',
+            field=models.CharField(default='', editable=False, help_text='Natural-sort form of username, maintained on save', max_length=255),
+        ),
+        migrations.RunPython(backfill_sort_keys, migrations.RunPython.noop),
+        # Indexes are created after the backfill so each is built once
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(fields=['username_sort_key', 'username'], name='vpnuser_sort_key'),
+        ),
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(fields=['is_active', 'expiry_date'], name='vpnuser_active_expiry'),
+        ),
+        migrations.AddIndex(
+            model_name='vpnuser',
+            index=models.Index(fields=['has_access_server_user', 'is_active', 'expiry_date'], name='vpnuser_as_active_expiry'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0007_vpnuser_username_sort_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VPNSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(help_text='source:daemon:client id (or real address):username', max_length=320, unique=True)),
+                ('username', models.CharField(db_index=True, max_length=150)),
+                ('source', models.CharField(choices=[('status_log', 'OpenVPN status log'), ('mgmt', 'Management interface'), ('sacli', 'Access Server (sacli)'), ('api', 'Client info API')], max_length=20)),
+                ('daemon', models.CharField(blank=True, help_text='Access Server daemon or node', max_length=64)),
+                ('client_id', models.BigIntegerField(blank=True, null=True)),
+                ('real_address', models.CharField(blank=True, max_length=64)),
+                ('virtual_address', models.CharField(blank=True, max_length=64)),
+                ('virtual_ipv6_address', models.CharField(blank=True, max_length=64)),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+                ('connected_since', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
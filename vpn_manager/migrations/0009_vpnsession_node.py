@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0008_vpnsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpnsession',
+            name='node',
+            field=models.CharField(blank=True, db_index=True, help_text='Remote VPN node (VPN_NODES) that reported the session; empty if local', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='vpnsession',
+            name='daemon',
+            field=models.CharField(blank=True, help_text='Access Server daemon', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='vpnsession',
+            name='session_key',
+            field=models.CharField(help_text='source:node:daemon:client id (or real address):username', max_length=320, unique=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0009_vpnsession_node'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('ts', models.DateTimeField()),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ts'], name='trafficsample_ts')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrafficRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['username', 'period', 'start'], name='trafficrollup_user')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='trafficrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'start', 'username'), name='trafficrollup_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0010_traffic_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpnuser',
+            name='monthly_quota',
+            field=models.PositiveBigIntegerField(default=0, help_text='Monthly transfer limit in bytes (received + sent); 0 means unlimited'),
+        ),
+        migrations.AddField(
+            model_name='vpnuser',
+            name='quota_exceeded',
+            field=models.BooleanField(default=False, help_text='Denied for going over monthly_quota; lifted by reset_quotas'),
+        ),
+        migrations.AddField(
+            model_name='vpnuser',
+            name='quota_period',
+            field=models.DateField(blank=True, editable=False, help_text='First day of the month quota_used belongs to', null=True),
+        ),
+        migrations.AddField(
+            model_name='vpnuser',
+            name='quota_used',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Bytes transferred in quota_period, written behind by the quota enforcer'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0011_vpnuser_quota'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('node', models.CharField(blank=True, max_length=64)),
+                ('real_ip', models.CharField(max_length=45)),
+                ('real_port', models.PositiveIntegerField(default=0, help_text='0 if unknown or merged from several ports')),
+                ('virtual_ip', models.CharField(blank=True, max_length=45)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(help_text='Last time the session was seen')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['real_ip', 'start', 'end'], name='connectioninterval_real'), models.Index(fields=['virtual_ip', 'start', 'end'], name='connectioninterval_virtual'), models.Index(fields=['start'], name='connectioninterval_start')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='connectioninterval',
+            constraint=models.UniqueConstraint(fields=('username', 'start', 'node', 'real_ip', 'real_port'), name='connectioninterval_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn_manager', '0012_connection_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vpnuser',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bumped on every save; part of the outbox idempotency keys'),
+        ),
+    ]
@@ -1,4 +1,22 @@
+import re
+
 from django.db import models
+from django.utils import timezone
+
+_DIGITS = re.compile(r'\d+')
+SORT_KEY_DIGITS = 20  # enough for any 64-bit number
+SORT_KEY_MAX_LENGTH = 255
+
+
+def natural_sort_key(username):
+    """
+    Key that orders usernames naturally with a plain string comparison:
+    every run of digits is zero-padded, so 'user9' < 'user10' for any prefix.
+    """
+    key = _DIGITS.sub(lambda m: m.group().zfill(SORT_KEY_DIGITS), username.lower())
+    return key[:SORT_KEY_MAX_LENGTH]
+
+
 
 class VPNUser(models.Model):
     username = models.CharField(
@@ -22,9 +40,265 @@ class VPNUser(models.Model):
         help_text="Maximum simultaneous connections for this user",
     )
     has_access_server_user = models.BooleanField(default=True)
+    monthly_quota = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Monthly transfer limit in bytes (received + sent); 0 means unlimited",
+    )
+    quota_used = models.PositiveBigIntegerField(
+        default=0,
+        editable=False,
+        help_text="Bytes transferred in quota_period, written behind by the quota enforcer",
+    )
+    quota_period = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="First day of the month quota_used belongs to",
+    )
+    quota_exceeded = models.BooleanField(
+        default=False,
+        help_text="Denied for going over monthly_quota; lifted by reset_quotas",
+    )
+    username_sort_key = models.CharField(
+        max_length=SORT_KEY_MAX_LENGTH,
+        editable=False,
+        default='',
+        help_text="Natural-sort form of username, maintained on save",
+    )
+    revision = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Bumped on every save; part of the outbox idempotency keys",
+    )
+
+    class Meta:
+        indexes = [
+            # Admin natural ordering; username (unique) makes it total, so no extra pk sort
+            models.Index(fields=['username_sort_key', 'username'], name='vpnuser_sort_key'),
+            # sync_psw_file / kill_expired_users filters
+            models.Index(fields=['is_active', 'expiry_date'], name='vpnuser_active_expiry'),
+            models.Index(fields=['has_access_server_user', 'is_active', 'expiry_date'],
+                         name='vpnuser_as_active_expiry'),
+        ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot of the loaded row, used to detect changes without a SELECT
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if value is not models.DEFERRED
+        }
+        return instance
+
+    @property
+    def loaded_values(self):
+        """Field values as last loaded from/saved to the DB, or None for new objects."""
+        return getattr(self, '_loaded_values', None)
+
+    @property
+    def changed_fields(self):
+        """Names of the fields that differ from the loaded snapshot (all fields for new objects)."""
+        loaded = self.loaded_values
+        if loaded is None:
+            return {field.attname for field in self._meta.concrete_fields}
+        return {name for name, value in loaded.items() if getattr(self, name) != value}
+
+    def save(self, *args, **kwargs):
+        self.username_sort_key = natural_sort_key(self.username)
+        self.revision += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            extra = {'revision', 'username_sort_key'} if 'username' in update_fields else {'revision'}
+            kwargs['update_fields'] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
 
     def __str__(self):
         return self.username
 
 
+
+
+class VPNTask(models.Model):
+    """
+    Outbox entry for an external side effect of a VPNUser change (sacli
+    provisioning, deny, disconnect). Rows are written in the same transaction
+    as the change and applied after commit by `manage.py run_vpn_worker`.
+    """
+    OP_PROVISION = 'provision'
+    OP_DENY = 'deny'
+    OP_DISCONNECT = 'disconnect'
+    OP_CHOICES = [
+        (OP_PROVISION, 'Provision Access Server user'),
+        (OP_DENY, 'Deny and disconnect Access Server user'),
+        (OP_DISCONNECT, 'Disconnect'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    op = models.CharField(max_length=20, choices=OP_CHOICES)
+    username = models.CharField(max_length=150)
+    payload = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Enqueueing the same key twice is a no-op",
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='vpntask_status_available'),
+        ]
+
+    def __str__(self):
+        return f"{self.op} {self.username} ({self.status})"
+
+
+class VPNSession(models.Model):
+    """
+    A live VPN session as last seen by `manage.py collect_vpn_sessions`.
+    The admin joins against this table instead of asking the VPN server.
+    """
+    SOURCE_STATUS_LOG = 'status_log'
+    SOURCE_MGMT = 'mgmt'
+    SOURCE_SACLI = 'sacli'
+    SOURCE_API = 'api'
+    SOURCE_CHOICES = [
+        (SOURCE_STATUS_LOG, 'OpenVPN status log'),
+        (SOURCE_MGMT, 'Management interface'),
+        (SOURCE_SACLI, 'Access Server (sacli)'),
+        (SOURCE_API, 'Client info API'),
+    ]
+
+    session_key = models.CharField(
+        max_length=320,
+        unique=True,
+        help_text="source:node:daemon:client id (or real address):username",
+    )
+    username = models.CharField(max_length=150, db_index=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    node = models.CharField(max_length=64, blank=True, db_index=True,
+                            help_text="Remote VPN node (VPN_NODES) that reported the session; empty if local")
+    daemon = models.CharField(max_length=64, blank=True, help_text="Access Server daemon")
+    client_id = models.BigIntegerField(null=True, blank=True)
+    real_address = models.CharField(max_length=64, blank=True)
+    virtual_address = models.CharField(max_length=64, blank=True)
+    virtual_ipv6_address = models.CharField(max_length=64, blank=True)
+    bytes_received = models.BigIntegerField(default=0)
+    bytes_sent = models.BigIntegerField(default=0)
+    connected_since = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.username} ({self.real_address})'
+
+
+class TrafficSample(models.Model):
+    """
+    Append-only traffic accounting: the bytes a user moved since the previous
+    sample, written in batches by the session collector (see
+    vpn_manager.accounting). Rolled up into TrafficRollup and pruned after a
+    few days.
+    """
+    username = models.CharField(max_length=150)
+    ts = models.DateTimeField()
+    bytes_received = models.BigIntegerField(default=0)
+    bytes_sent = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Rollups and pruning scan by time
+            models.Index(fields=['ts'], name='trafficsample_ts'),
+        ]
+
+    def __str__(self):
+        return f'{self.username} @ {self.ts}'
+
+
+class TrafficRollup(models.Model):
+    """Per-user traffic per hour or per day; what reports and admin columns read."""
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_CHOICES = [
+        (PERIOD_HOUR, 'Hour'),
+        (PERIOD_DAY, 'Day'),
+    ]
+
+    username = models.CharField(max_length=150)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    bytes_received = models.BigIntegerField(default=0)
+    bytes_sent = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves the report's (period, start range) scans
+            models.UniqueConstraint(fields=['period', 'start', 'username'], name='trafficrollup_unique'),
+        ]
+        indexes = [
+            # Per-user columns in the VPNUser changelist
+            models.Index(fields=['username', 'period', 'start'], name='trafficrollup_user'),
+        ]
+
+    def __str__(self):
+        return f'{self.username} {self.period} {self.start}'
+
+
+class ConnectionInterval(models.Model):
+    """
+    Who held which address when: one row per VPN session, written by the
+    session collector (see vpn_manager.history) and kept long after the
+    VPNSession row is gone, for abuse reports. Sessions longer than
+    CONNECTION_HISTORY_MAX_SPAN are split into consecutive rows, so a lookup
+    never has to look further back than that.
+    """
+    username = models.CharField(max_length=150)
+    node = models.CharField(max_length=64, blank=True)
+    real_ip = models.CharField(max_length=45)
+    real_port = models.PositiveIntegerField(default=0, help_text="0 if unknown or merged from several ports")
+    virtual_ip = models.CharField(max_length=45, blank=True)
+    start = models.DateTimeField()
+    end = models.DateTimeField(help_text="Last time the session was seen")
+
+    class Meta:
+        constraints = [
+            # Also serves a user's history
+            models.UniqueConstraint(fields=['username', 'start', 'node', 'real_ip', 'real_port'],
+                                    name='connectioninterval_unique'),
+        ]
+        indexes = [
+            # "Who held address A at time T" (vpn_manager.history.who_had)
+            models.Index(fields=['real_ip', 'start', 'end'], name='connectioninterval_real'),
+            models.Index(fields=['virtual_ip', 'start', 'end'], name='connectioninterval_virtual'),
+            # Newest-first admin listing, compaction and retention
+            models.Index(fields=['start'], name='connectioninterval_start'),
+        ]
+
+    @property
+    def real_address(self):
+        ip = f'[{self.real_ip}]' if ':' in self.real_ip else self.real_ip
+        return f'{ip}:{self.real_port}' if self.real_port else self.real_ip
+
+    def __str__(self):
+        return f'{self.username} {self.real_address} {self.virtual_ip} {self.start}..{self.end}'
@@ -0,0 +1,108 @@
+"""
+Registry of remote VPN nodes running client_info_api, and a parallel
+fan-out client for them.
+
+    VPN_NODES=node-a=http://10.0.0.2:8000,node-b=http://10.0.0.3:8000;2.5
+
+Each entry is name=base_url with an optional ;timeout in seconds
+(CLIENT_INFO_API_TIMEOUT otherwise). Without VPN_NODES the single node
+'remote' at CLIENT_API_BASE_URL is used, as before.
+
+Every request goes through one pooled keep-alive requests.Session, and
+fan_out() queries all nodes at once on a persistent thread pool. A node that
+is slow or down only costs its own timeout: its entry in the result is the
+exception, the other nodes' answers are still returned.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+CLIENT_API_BASE_URL = config('CLIENT_API_BASE_URL', default='http://127.0.0.1:8000').rstrip('/')
+CLIENT_INFO_API_TIMEOUT = int(config('CLIENT_INFO_API_TIMEOUT', default=5))
+# Keep-alive connections kept per node
+NODE_POOL_SIZE = config('VPN_NODE_POOL_SIZE', default=8, cast=int)
+DEFAULT_NODE = 'remote'
+
+
+class Node(NamedTuple):
+    name: str
+    base_url: str
+    timeout: float = CLIENT_INFO_API_TIMEOUT
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
+
+
+def parse_nodes(value, default_timeout=CLIENT_INFO_API_TIMEOUT):
+    """Parse the VPN_NODES setting into a list of Node."""
+    nodes = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, rest = entry.partition('=')
+        if not sep or not name.strip() or not rest.strip():
+            raise ValueError(f'Invalid VPN_NODES entry {entry!r}, expected name=url[;timeout]')
+        url, _, timeout = rest.partition(';')
+        nodes.append(Node(name.strip(), url.strip().rstrip('/'), float(timeout) if timeout else default_timeout))
+    return nodes
+
+
+VPN_NODES = parse_nodes(config('VPN_NODES', default='')) or [Node(DEFAULT_NODE, CLIENT_API_BASE_URL)]
+
+
+class NodeClient:
+    def __init__(self, nodes, pool_size=NODE_POOL_SIZE):
+        self.nodes = {node.name: node for node in nodes}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(self.nodes), 1), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Enough workers for every node at once, so one fan-out never queues behind itself
+        self._pool = ThreadPoolExecutor(max_workers=max(2 * len(self.nodes), 4),
+                                        thread_name_prefix='vpn-node')
+
+    def node(self, name):
+        """The Node called `name`, or the only node when name is empty."""
+        if not name and len(self.nodes) == 1:
+            return next(iter(self.nodes.values()))
+        try:
+            return self.nodes[name]
+        except KeyError:
+            raise KeyError(f'Unknown VPN node {name!r}') from None
+
+    def request(self, node, method, path, timeout=None, **kwargs):
+        """JSON body of one request to `node`; raises on HTTP or decoding errors."""
+        response = self.session.request(method, node.url(path), timeout=timeout or node.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def fan_out(self, fn, nodes=None):
+        """
+        Call fn(node) for every node in parallel. Returns {node name: result};
+        a node that raised or did not answer within its timeout maps to the
+        exception instead.
+        """
+        nodes = list(self.nodes.values()) if nodes is None else list(nodes)
+        if not nodes:
+            return {}
+        futures = {node.name: self._pool.submit(fn, node) for node in nodes}
+        # requests enforces the per-node timeout; this only bounds the whole call
+        wait(futures.values(), timeout=max(node.timeout for node in nodes) + 1)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = TimeoutError(f'node {name} did not answer in time')
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
+
+
+node_client = NodeClient(VPN_NODES)
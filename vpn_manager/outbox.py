@@ -0,0 +1,184 @@
+"""
+Durable outbox for VPNUser side effects.
+
+Signal handlers only insert VPNTask rows (inside the caller's transaction, so
+a rollback also drops the task). `manage.py run_vpn_worker` claims pending
+tasks in batches after commit and applies them through the sacli executor
+and the management interface, retrying failures with exponential backoff.
+
+Every task carries an idempotency key derived from the change that queued
+it (change_key), so the same change enqueued twice is only applied once.
+
+A task's payload (a provisioning task holds the user's password) is cleared
+once the task is done, and prune() deletes done tasks after
+VPN_TASK_RETENTION_DAYS. A key only recurs for the same revision of a user,
+so a pruned key is never queued again by a later change.
+"""
+import hashlib
+from datetime import timedelta
+
+from decouple import config
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .mgmt import get_management_client
+from .models import VPNTask
+from .utils import sacli_executor
+from .sacli import deny_commands, disconnect_user, provision_commands
+
+MAX_BACKOFF = 300  # seconds
+# Tasks left 'running' longer than this (worker crashed) are picked up again
+LEASE = timedelta(minutes=5)
+# Done tasks are deleted after this many days
+VPN_TASK_RETENTION_DAYS = config('VPN_TASK_RETENTION_DAYS', default=7, cast=int)
+
+
+def change_key(op, pk, revision, *values):
+    """
+    Idempotency key of task `op` for revision `revision` of VPNUser `pk`
+    with the given new values. Saving the same change twice (a double
+    submit, a retry working from the same revision) gives the same key; any
+    later change gets a new one. pks are never reused, so a user created
+    again under the same name does not collide with the old one's tasks.
+    """
+    digest = hashlib.sha256(repr(values).encode('utf-8')).hexdigest()[:40]
+    return f"{op}:{pk}:{revision}:{digest}"
+
+
+def enqueue(op, username, idempotency_key, payload=None):
+    """Insert one outbox task; a duplicate idempotency_key is silently ignored."""
+    VPNTask.objects.bulk_create(
+        [VPNTask(op=op, username=username, payload=payload or {}, idempotency_key=idempotency_key)],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_many(entries, batch_size=1000):
+    """Insert many (op, username, payload, idempotency_key) tasks with one INSERT per batch."""
+    VPNTask.objects.bulk_create(
+        [VPNTask(op=op, username=username, payload=payload or {}, idempotency_key=key)
+         for op, username, payload, key in entries],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_provision(username, password, idempotency_key):
+    enqueue(VPNTask.OP_PROVISION, username, idempotency_key, {'password': password})
+
+
+def enqueue_deny(username, idempotency_key):
+    enqueue(VPNTask.OP_DENY, username, idempotency_key)
+
+
+def enqueue_disconnect(username, has_access_server_user, idempotency_key):
+    enqueue(VPNTask.OP_DISCONNECT, username, idempotency_key,
+            {'has_access_server_user': has_access_server_user})
+
+
+def claim(batch_size):
+    """Mark up to batch_size due tasks as running and return them (oldest first)."""
+    now = timezone.now()
+    # Recover tasks whose worker died mid-batch
+    VPNTask.objects.filter(status=VPNTask.STATUS_RUNNING, claimed_at__lt=now - LEASE).update(
+        status=VPNTask.STATUS_PENDING)
+    with transaction.atomic():
+        ids = list(
+            VPNTask.objects.select_for_update(skip_locked=True)
+            .filter(status=VPNTask.STATUS_PENDING, available_at__lte=now)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        VPNTask.objects.filter(id__in=ids).update(
+            status=VPNTask.STATUS_RUNNING, claimed_at=now, attempts=F('attempts') + 1)
+    return list(VPNTask.objects.filter(id__in=ids).order_by('id'))
+
+
+def _commands(task):
+    if task.op == VPNTask.OP_PROVISION:
+        return provision_commands(task.username, task.payload.get('password', '')) + \
+            deny_commands(task.username, 'false')
+    if task.op == VPNTask.OP_DENY:
+        return deny_commands(task.username, 'true') + [disconnect_user(task.username)]
+    return [disconnect_user(task.username)]
+
+
+def apply_tasks(tasks):
+    """
+    Apply claimed tasks. sacli chains run in parallel across users (in order
+    for one user), plain OpenVPN disconnects share one management session.
+    Returns {task id: True/False}.
+    """
+    results = {}
+    sacli_futures = {}
+    mgmt_tasks = []
+    for task in tasks:
+        if task.op == VPNTask.OP_DISCONNECT and not task.payload.get('has_access_server_user', True):
+            mgmt_tasks.append(task)
+        elif task.op in (VPNTask.OP_PROVISION, VPNTask.OP_DENY, VPNTask.OP_DISCONNECT):
+            sacli_futures[task.id] = sacli_executor.submit(task.username, _commands(task))
+        else:
+            results[task.id] = False
+
+    if mgmt_tasks:
+        try:
+            get_management_client().kill_many([task.username for task in mgmt_tasks])
+            # A user that is no longer connected is as good as a successful kill
+            reachable = True
+        except Exception as e:
+            print(f"Error disconnecting users via management interface: {e}")
+            reachable = False
+        for task in mgmt_tasks:
+            results[task.id] = reachable
+
+    for task_id, future in sacli_futures.items():
+        try:
+            results[task_id] = future.result()
+        except Exception as e:
+            print(f"Error applying outbox task {task_id}: {e}")
+            results[task_id] = False
+    return results
+
+
+def finish(tasks, results, max_attempts):
+    """Record the outcome of a batch: done (payload cleared), retry later, or give up."""
+    now = timezone.now()
+    done_ids = [task.id for task in tasks if results.get(task.id)]
+    VPNTask.objects.filter(id__in=done_ids).update(
+        status=VPNTask.STATUS_DONE, processed_at=now, last_error='', payload={})
+    for task in tasks:
+        if results.get(task.id):
+            continue
+        if task.attempts >= max_attempts:
+            status, available_at = VPNTask.STATUS_FAILED, task.available_at
+        else:
+            status = VPNTask.STATUS_PENDING
+            available_at = now + timedelta(seconds=min(2 ** task.attempts, MAX_BACKOFF))
+        VPNTask.objects.filter(id=task.id).update(
+            status=status, available_at=available_at, processed_at=now,
+            last_error=f"attempt {task.attempts} failed")
+    return len(done_ids)
+
+
+def prune(now=None, retention_days=VPN_TASK_RETENTION_DAYS):
+    """Delete the tasks done more than `retention_days` ago; returns how many."""
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+    deleted, _ = VPNTask.objects.filter(status=VPNTask.STATUS_DONE, processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def metrics():
+    """Queue depth and lag of the outbox."""
+    now = timezone.now()
+    pending = VPNTask.objects.filter(status=VPNTask.STATUS_PENDING)
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': pending.count(),
+        'due': pending.filter(available_at__lte=now).count(),
+        'running': VPNTask.objects.filter(status=VPNTask.STATUS_RUNNING).count(),
+        'failed': VPNTask.objects.filter(status=VPNTask.STATUS_FAILED).count(),
+        'lag_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+    }
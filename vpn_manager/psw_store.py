@@ -0,0 +1,298 @@
+"""
+Store for the OpenVPN psw file (`username:password:max_connections` lines).
+
+The file is kept as an in-memory index keyed by username and only re-parsed
+when another process has changed it. Writes are atomic (temp file + rename,
+so the auth script never sees a half-written file) and serialized across
+processes with an flock on `<psw file>.lock`. Changes staged during a
+transaction are coalesced into a single write at transaction.on_commit.
+
+When OPENVPN_PSW_DB is set, every write is mirrored into a compiled SQLite
+credential database (one indexed row per user) so the auth-user-pass-verify
+script (vpn_manager/auth_verify.py) can look users up in constant time
+instead of scanning the text file.
+"""
+import fcntl
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+
+def parse_line(line):
+    """Return (username, password, max_connections) or None for junk lines."""
+    line = line.rstrip('\r\n')
+    if ':' not in line:
+        return None
+    parts = line.split(':', 2)
+    if len(parts) < 3:
+        parts.append('1')
+    return parts[0], parts[1], parts[2]
+
+
+DB_SCHEMA = (
+    'CREATE TABLE users ('
+    ' username TEXT PRIMARY KEY,'
+    ' password TEXT NOT NULL,'
+    ' max_connections INTEGER NOT NULL'
+    ') WITHOUT ROWID'
+)
+
+
+def build_db(db_path, users):
+    """Build a fresh credential database and atomically swap it in."""
+    directory = os.path.dirname(db_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.psw-db.')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(DB_SCHEMA)
+            conn.executemany(
+                'INSERT INTO users (username, password, max_connections) VALUES (?, ?, ?)',
+                ((u, p, _to_int(m)) for u, (p, m) in users.items()),
+            )
+            conn.commit()
+            # Keep the default rollback journal: auth_verify opens the file
+            # read-only as the unprivileged OpenVPN user, and a WAL database
+            # can only be read by someone who may create its -shm/-wal files
+        finally:
+            conn.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def update_db(db_path, changes):
+    """Apply {username: (password, max_connections) or None} in one SQLite transaction."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            conn.executemany(
+                'DELETE FROM users WHERE username = ?',
+                ((u,) for u, entry in changes.items() if entry is None),
+            )
+            conn.executemany(
+                'INSERT OR REPLACE INTO users (username, password, max_connections) VALUES (?, ?, ?)',
+                ((u, entry[0], _to_int(entry[1])) for u, entry in changes.items() if entry is not None),
+            )
+    finally:
+        conn.close()
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 1
+
+
+class PswFileStore:
+    def __init__(self, path, db_path=None):
+        self.path = path
+        self.db_path = db_path
+        self.lock_path = f'{path}.lock'
+        self.writes = 0
+        self._users = {}  # username -> (password, max_connections)
+        self._signature = None
+        # The database is rebuilt on the first write of a process and whenever
+        # the text file was changed by someone else
+        self._db_stale = True
+        self._mutex = threading.RLock()
+        self._local = threading.local()
+
+    # Locking / loading -------------------------------------------------------
+
+    @contextmanager
+    def locked(self):
+        """Hold the in-process and the cross-process lock."""
+        with self._mutex:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _refresh(self):
+        # Re-parse only if the file changed behind our back
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        users = {}
+        if signature is not None:
+            with open(self.path) as f:
+                for line in f:
+                    parsed = parse_line(line)
+                    if parsed:
+                        users[parsed[0]] = (parsed[1], parsed[2])
+        self._users = users
+        self._signature = signature
+        self._db_stale = True
+
+    def _write(self):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.psw-file.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.writelines(
+                    f"{user}:{password}:{max_conns}\n"
+                    for user, (password, max_conns) in self._users.items()
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            # The index holds changes the file does not: re-read it next time
+            self._signature = None
+            raise
+        self._signature = self._stat_signature()
+        self.writes += 1
+
+    # Reading -----------------------------------------------------------------
+
+    def users(self):
+        """Return a copy of {username: (password, max_connections)}."""
+        with self.locked():
+            return dict(self._users)
+
+    def contains(self, username):
+        with self.locked():
+            return username in self._users
+
+    # Writing -----------------------------------------------------------------
+
+    def apply(self, changes):
+        """
+        Apply {username: (password, max_connections) or None} in one atomic
+        write; None removes the user. Returns True if the file changed.
+        """
+        with self.locked():
+            changed = False
+            for username, entry in changes.items():
+                if entry is None:
+                    changed |= self._users.pop(username, None) is not None
+                else:
+                    entry = (str(entry[0]), str(entry[1]))
+                    if self._users.get(username) != entry:
+                        self._users[username] = entry
+                        changed = True
+            if changed:
+                self._write()
+                self._sync_db(changes)
+            return changed
+
+    def replace_all(self, users):
+        """Replace the whole file with {username: (password, max_connections)}."""
+        with self.locked():
+            self._users = {u: (str(p), str(m)) for u, (p, m) in users.items()}
+            self._write()
+            self._sync_db()
+
+    def _sync_db(self, changes=None):
+        """Mirror the file into the credential database (full rebuild if changes is None)."""
+        if not self.db_path:
+            return
+        if changes is None or self._db_stale or not os.path.exists(self.db_path):
+            build_db(self.db_path, self._users)
+            self._db_stale = False
+        else:
+            update_db(self.db_path, {u: self._users.get(u) for u in changes})
+
+    # Transaction-coalesced staging ---------------------------------------------
+
+    @property
+    def _pending(self):
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = {}
+        return self._local.pending
+
+    def stage(self, username, password, max_connections):
+        self._stage(username, (password, max_connections))
+
+    def stage_remove(self, username):
+        self._stage(username, None)
+
+    def _stage(self, username, entry):
+        pending = self._pending
+        if not self._flush_registered():
+            # Whatever is left over belongs to a rolled back transaction
+            pending.clear()
+            pending[username] = entry
+            transaction.on_commit(self.flush)
+        else:
+            pending[username] = entry
+
+    def _flush_registered(self):
+        connection = transaction.get_connection()
+        return any(entry[1] == self.flush for entry in getattr(connection, 'run_on_commit', ()))
+
+    def flush(self):
+        pending, self._local.pending = self._pending, {}
+        if pending:
+            self.apply(pending)
+
+
+def diff_users(current, desired):
+    """
+    Compare two {username: (password, max_connections)} maps and return
+    {username: entry or None} with only the lines that have to change.
+    """
+    changes = {
+        username: entry
+        for username, entry in desired.items()
+        if current.get(username) != entry
+    }
+    changes.update((username, None) for username in current.keys() - desired.keys())
+    return changes
+
+
+def sync_from_db(store=None, dry_run=False):
+    """
+    Bring the psw file in line with the active, non-expired plain OpenVPN
+    users within their quota in the DB with a single write (none if already
+    in sync).
+    Returns (changes, number of desired users).
+    """
+    from datetime import date
+    from .models import VPNUser
+
+    store = store or psw_store
+    active_users = VPNUser.objects.filter(
+        is_active=True, quota_exceeded=False, expiry_date__gte=date.today(), has_access_server_user=False
+    ).values_list('username', 'openvpn_password', 'max_connections')
+    desired = {
+        username: (password, str(max_connections))
+        for username, password, max_connections in active_users.iterator(chunk_size=5000)
+    }
+    changes = diff_users(store.users(), desired)
+    if changes and not dry_run:
+        store.apply(changes)
+    return changes, len(desired)
+
+
+psw_store = PswFileStore(settings.OPENVPN_PSW_FILE, settings.OPENVPN_PSW_DB or None)
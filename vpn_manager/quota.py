@@ -0,0 +1,232 @@
+"""
+Monthly data quota enforcement.
+
+The session collector (and the management listener, with live bytecount
+updates) passes every poll's per-user deltas from
+accounting.SessionCounters to the QuotaEnforcer. It keeps the usage of the
+users with a monthly_quota in memory and writes it behind: every
+QUOTA_FLUSH_INTERVAL seconds the pending bytes of all users that moved
+traffic are added to quota_used with one UPDATE per QUOTA_BATCH_SIZE users,
+never one write per poll or per session.
+
+A user whose in-memory usage reaches the quota is checked against the DB
+(after a flush, so an admin raising the quota meanwhile wins) and marked
+quota_exceeded through save(): the usual signals remove a plain OpenVPN user
+from the psw file and queue the Access Server deny in the outbox. The user
+is then denied via sacli right away and disconnected through the same routes
+as the admin's disconnect. A denied user still moving traffic (a failed
+kill) is disconnected again.
+
+quota_used belongs to the month in quota_period; writes that reach a row of
+an earlier month start it over. `manage.py reset_quotas` zeroes the rest and
+lifts the denials that no longer apply on the 1st.
+"""
+from decouple import config
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, F, Value, When
+from django.utils import timezone
+
+from .models import VPNUser
+from .utils import batch_executor, disconnect_users, prop_deny_user_sacli_commands, session_routes
+
+QUOTA_ENFORCEMENT = config('QUOTA_ENFORCEMENT', default=True, cast=bool)
+# Seconds between writes of the pending usage
+QUOTA_FLUSH_INTERVAL = config('QUOTA_FLUSH_INTERVAL', default=60, cast=float)
+# Seconds between reloads of the quotas (new users, edits, resets)
+QUOTA_RESYNC_INTERVAL = config('QUOTA_RESYNC_INTERVAL', default=300, cast=float)
+# Users per UPDATE when writing the usage
+QUOTA_BATCH_SIZE = 500
+
+
+def current_period(now=None):
+    """First day of the (local) month `now` falls in."""
+    return timezone.localdate(now).replace(day=1)
+
+
+def _update_from_supported():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33)
+
+
+def _add_usage(batch, period):
+    """
+    UPDATE ... FROM a VALUES list of (username, bytes): a plain join on
+    username, where the portable CASE WHEN form makes every row scan the
+    whole batch.
+    """
+    table = VPNUser._meta.db_table
+    values = ', '.join(['(%s, %s)'] * len(batch))
+    params = [value for item in batch for value in item]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH usage (username, used) AS (VALUES {values}) '
+            f'UPDATE {table} SET quota_used = CASE WHEN {table}.quota_period = %s '
+            f'THEN {table}.quota_used + usage.used ELSE usage.used END, quota_period = %s '
+            f'FROM usage WHERE {table}.username = usage.username',
+            params + [period, period],
+        )
+
+
+class QuotaEnforcer:
+    def __init__(self, flush_interval=QUOTA_FLUSH_INTERVAL, resync_interval=QUOTA_RESYNC_INTERVAL):
+        self.flush_interval = flush_interval
+        self.resync_interval = resync_interval
+        self._users = None    # username -> [monthly_quota, used, exceeded]
+        self._pending = {}    # username -> bytes not written yet
+        self._period = None
+        self._flushed_at = None
+        self._loaded_at = None
+        self.stats = {'flushes': 0, 'written': 0, 'denied': 0, 'killed': 0, 'resyncs': 0}
+
+    def load(self, now):
+        """(Re)load every user with a quota; pending usage is flushed first."""
+        self.flush(now)
+        self._period = current_period(now)
+        self._users = {
+            username: [quota, used if period == self._period else 0, exceeded]
+            for username, quota, used, period, exceeded in VPNUser.objects.filter(
+                monthly_quota__gt=0,
+            ).values_list(
+                'username', 'monthly_quota', 'quota_used', 'quota_period', 'quota_exceeded',
+            ).iterator(chunk_size=5000)
+        }
+        self._loaded_at = now
+        self.stats['resyncs'] += 1
+        return len(self._users)
+
+    def add(self, deltas, now):
+        """
+        Count one poll's deltas ({username: [received, sent]}). Returns the
+        users that just reached their quota and the denied users that still
+        moved traffic.
+        """
+        if self._users is None or current_period(now) != self._period \
+                or (now - self._loaded_at).total_seconds() >= self.resync_interval:
+            self.load(now)
+        if self._flushed_at is None:
+            self._flushed_at = now
+        crossed, offenders = [], []
+        for username, (received, sent) in deltas.items():
+            state = self._users.get(username)
+            if state is None:
+                continue  # no quota
+            state[1] += received + sent
+            self._pending[username] = self._pending.get(username, 0) + received + sent
+            if state[2]:
+                offenders.append(username)
+            elif state[1] >= state[0]:
+                state[2] = True
+                crossed.append(username)
+        return crossed, offenders
+
+    def due(self, now):
+        return bool(self._pending) and self._flushed_at is not None \
+            and (now - self._flushed_at).total_seconds() >= self.flush_interval
+
+    def flush(self, now):
+        """Add the pending usage to quota_used, one UPDATE per QUOTA_BATCH_SIZE users."""
+        pending, self._pending = self._pending, {}
+        self._flushed_at = now
+        if not pending:
+            return 0
+        period = current_period(now)
+        items = list(pending.items())
+        for start in range(0, len(items), QUOTA_BATCH_SIZE):
+            batch = items[start:start + QUOTA_BATCH_SIZE]
+            if _update_from_supported():
+                _add_usage(batch, period)
+                continue
+            delta = Case(*[When(username=username, then=Value(used)) for username, used in batch],
+                         default=Value(0), output_field=BigIntegerField())
+            VPNUser.objects.filter(username__in=[username for username, _ in batch]).update(
+                # A row still on last month's usage starts over
+                quota_used=Case(When(quota_period=period, then=F('quota_used') + delta), default=delta,
+                                output_field=BigIntegerField()),
+                quota_period=period,
+            )
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(items)
+        return len(items)
+
+    def deny(self, usernames):
+        """
+        Mark the users that really are over their quota in the DB (usage
+        flushed, quota maybe raised meanwhile); returns them. The in-memory
+        state of every user checked is refreshed from the DB.
+        """
+        denied = []
+        with transaction.atomic():
+            for user in VPNUser.objects.select_for_update().filter(username__in=usernames):
+                over = user.monthly_quota > 0 and user.quota_period == self._period \
+                    and user.quota_used >= user.monthly_quota
+                if over and not user.quota_exceeded:
+                    user.quota_exceeded = True
+                    user.save(update_fields=['quota_exceeded'])
+                    denied.append(user)
+                self._users[user.username] = [user.monthly_quota, user.quota_used, user.quota_exceeded]
+        self.stats['denied'] += len(denied)
+        return denied
+
+    def disconnect(self, users, sessions):
+        """
+        Deny the Access Server users via sacli, then disconnect everybody
+        through the admin's routes; `sessions` (VPNSession rows) tell where
+        each user is connected. Returns {username: True/False}, True only if
+        every route succeeded.
+        """
+        # Deny first or the client just reconnects; the outbox task queued
+        # by the signal retries this if sacli fails now
+        access_server = [user.username for user in users if user.has_access_server_user]
+        if access_server:
+            batch_executor.map(lambda username: prop_deny_user_sacli_commands(username, "true"), access_server)
+        # Every route: locally and on each node holding one of the user's sessions
+        routes = disconnect_users(users, *session_routes(
+            (session.username, session.source, session.node) for session in sessions))
+        results = {username: all(oks.values()) for username, oks in routes.items()}
+        self.stats['killed'] += sum(1 for ok in results.values() if ok)
+        return results
+
+    def process(self, deltas, now):
+        """
+        One enforcement step for a poll: count `deltas`, write the usage
+        behind and deny the users over quota. Returns (usernames denied now,
+        VPNUsers to disconnect), the latter also holding denied users that
+        still moved traffic.
+        """
+        crossed, offenders = self.add(deltas, now)
+        if crossed or self.due(now):
+            self.flush(now)
+        users = self.deny(crossed) if crossed else []
+        denied = [user.username for user in users]
+        if offenders:
+            still_denied = list(VPNUser.objects.filter(username__in=offenders, quota_exceeded=True))
+            # Lifted meanwhile (reset_quotas, admin): stop treating them as denied
+            for username in set(offenders) - {user.username for user in still_denied}:
+                self._users[username][2] = False
+            users += still_denied
+        return denied, users
+
+
+quota_enforcer = QuotaEnforcer()
+
+
+def reset_quotas(now=None):
+    """
+    Start a new quota month: zero the usage of rows still on an earlier
+    month and lift every denial that no longer applies (usage reset or quota
+    raised) through save(), so the signals re-enable the user. Safe to run
+    any number of times. Returns (reset, lifted).
+    """
+    period = current_period(now)
+    with transaction.atomic():
+        reset = VPNUser.objects.exclude(quota_period=period).filter(
+            quota_used__gt=0).update(quota_used=0, quota_period=period)
+        lifted = []
+        for user in VPNUser.objects.select_for_update().filter(quota_exceeded=True):
+            if user.monthly_quota and user.quota_used >= user.monthly_quota:
+                continue
+            user.quota_exceeded = False
+            user.save(update_fields=['quota_exceeded'])
+            lifted.append(user.username)
+    return reset, lifted
@@ -0,0 +1,187 @@
+"""
+Execution engine for Access Server's sacli.
+
+Every sacli invocation goes through a SacliExecutor: a bounded worker pool
+with retry/backoff, per-command timing and per-user ordering (jobs for the
+same user run in submission order, jobs for different users in parallel).
+
+sacli has no multi-key UserPropPut, so per-user batching means running one
+user's whole command chain inside a single job and dropping duplicate
+commands from it, rather than merging several puts into one process.
+"""
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+
+class SacliResult(NamedTuple):
+    args: tuple
+    ok: bool
+    returncode: int
+    stdout: str
+    stderr: str
+    duration: float
+    attempts: int
+
+
+# Command builders ------------------------------------------------------------
+
+def user_prop_put(username, key, value):
+    return ('-u', username, '--key', key, '--value', value, 'UserPropPut')
+
+
+def set_local_password(username, password):
+    return ('-u', username, '--new_pass', password, 'SetLocalPassword')
+
+
+def disconnect_user(username):
+    return ('-u', username, 'DisconnectUser')
+
+
+def provision_commands(username, password):
+    """Create/refresh a local Access Server user with autologin enabled."""
+    return [
+        user_prop_put(username, 'user_auth_type', 'local'),
+        set_local_password(username, password),
+        user_prop_put(username, 'prop_autologin', 'true'),
+    ]
+
+
+def deny_commands(username, value):
+    return [user_prop_put(username, 'prop_deny', value)]
+
+
+def _label(args):
+    # The sacli verb is always the last argument
+    return args[-1] if args else '?'
+
+
+class SacliExecutor:
+    def __init__(self, sacli, max_workers=4, retries=2, backoff=0.5, timeout=60):
+        self.sacli = sacli
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._pool = None
+        self._pool_lock = threading.RLock()
+        self._tails = {}  # key -> last Future submitted for that key
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sacli')
+            return self._pool
+
+    # Single commands -----------------------------------------------------------
+
+    def run(self, args):
+        """Run one sacli command (with retries) in the calling thread."""
+        args = tuple(args)
+        attempts = 0
+        started = time.perf_counter()
+        while True:
+            attempts += 1
+            try:
+                completed = subprocess.run(
+                    [self.sacli, *args],
+                    capture_output=True, text=True, timeout=self.timeout,
+                )
+                returncode, stdout, stderr = completed.returncode, completed.stdout, completed.stderr
+            except subprocess.TimeoutExpired:
+                returncode, stdout, stderr = -1, '', f'timed out after {self.timeout}s'
+            except OSError as e:
+                returncode, stdout, stderr = -1, '', str(e)
+            if returncode == 0 or attempts > self.retries:
+                break
+            time.sleep(self.backoff * 2 ** (attempts - 1))
+        result = SacliResult(args, returncode == 0, returncode, stdout, stderr,
+                             time.perf_counter() - started, attempts)
+        self._record(result)
+        if not result.ok:
+            print(f"Error running sacli {_label(args)} for {args[1] if len(args) > 1 else '-'}: "
+                  f"{stderr.strip() or returncode}")
+        return result
+
+    def run_chain(self, commands):
+        """Run commands in order, stopping at the first failure; returns True if all succeeded."""
+        seen = set()
+        for args in commands:
+            args = tuple(args)
+            if args in seen:
+                continue
+            seen.add(args)
+            if not self.run(args).ok:
+                return False
+        return True
+
+    # Pooled execution ------------------------------------------------------------
+
+    def submit(self, key, commands):
+        """
+        Queue a command chain on the worker pool and return a Future of its
+        success. Chains sharing a key (normally the username) run in order.
+        """
+        commands = [tuple(args) for args in commands]
+        return self._submit(key, lambda: self.run_chain(commands))
+
+    def submit_command(self, key, args):
+        """Like submit() for a single command; the Future holds its SacliResult."""
+        args = tuple(args)
+        return self._submit(key, lambda: self.run(args))
+
+    def _submit(self, key, fn):
+        with self._pool_lock:
+            previous = self._tails.get(key)
+
+            def job():
+                if previous is not None:
+                    previous.exception()  # wait for the earlier chain, ignoring its outcome
+                return fn()
+
+            future = self.pool.submit(job)
+            self._tails[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._pool_lock:
+            if self._tails.get(key) is future:
+                del self._tails[key]
+
+    def run_many(self, jobs):
+        """
+        Run {key: [commands]} on the pool and wait for all of them.
+        Returns {key: True/False}.
+        """
+        futures = {key: self.submit(key, commands) for key, commands in jobs.items()}
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                print(f"Error running sacli chain for {key}: {e}")
+                results[key] = False
+        return results
+
+    # Timing --------------------------------------------------------------------
+
+    def _record(self, result):
+        with self._stats_lock:
+            stats = self._stats.setdefault(
+                _label(result.args), {'count': 0, 'failures': 0, 'retries': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['failures'] += 0 if result.ok else 1
+            stats['retries'] += result.attempts - 1
+            stats['total'] += result.duration
+            stats['max'] = max(stats['max'], result.duration)
+
+    def stats(self):
+        """Per sacli verb: count, failures, retries, total and max seconds."""
+        with self._stats_lock:
+            return {label: dict(values) for label, values in self._stats.items()}
@@ -0,0 +1,248 @@
+"""
+Reader for Access Server's `sacli VPNStatus` output.
+
+sacli is executed directly (no shell, no jq) and its JSON is parsed
+incrementally: only the rows of every `openvpn_N.client_list` are decoded,
+everything else (routing tables, stats) is skipped without being
+materialised, so memory stays flat however many clients a node carries.
+"""
+import asyncio
+import codecs
+import json
+import re
+import subprocess
+import threading
+
+from vpn_manager.sessions import ClientSession, from_time_t, to_int
+
+DEFAULT_SACLI = '/usr/sbin/sacli'
+READ_SIZE = 64 * 1024
+
+_SIGNIFICANT = re.compile(r'["\[\]{},:]')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_WHITESPACE = re.compile(r'\s*')
+# Everything up to the next bracket, including whole strings
+_SKIP = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*')
+
+
+class _Frame:
+    __slots__ = ('kind', 'key', 'expect_key', 'rows')
+
+    def __init__(self, kind, rows=False):
+        self.kind = kind            # '{' or '['
+        self.key = None             # last key seen in an object
+        self.expect_key = kind == '{'
+        self.rows = rows            # True for an openvpn_N.client_list array
+
+
+class ClientListParser:
+    """
+    Push parser for VPNStatus JSON. feed() text as it arrives and get back the
+    (daemon, row) pairs of every client_list that are complete so far.
+    """
+
+    def __init__(self):
+        self._buf = ''
+        self._stack = []
+        self._decoder = json.JSONDecoder()
+        self._row_expected = False
+
+    def feed(self, text):
+        self._buf += text
+        return self._parse(final=False)
+
+    def close(self):
+        rows = self._parse(final=True)
+        if self._stack:
+            raise ValueError('Truncated VPNStatus output')
+        return rows
+
+    def _parse(self, final):
+        buf, pos, stack = self._buf, 0, self._stack
+        rows = []
+        while True:
+            top = stack[-1] if stack else None
+            if top is not None and top.rows and self._row_expected:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if pos >= len(buf):
+                    break
+                if buf[pos] != ']':
+                    try:
+                        row, pos = self._decoder.raw_decode(buf, pos)
+                    except json.JSONDecodeError:
+                        if final:
+                            raise
+                        break  # the row continues in the next chunk
+                    rows.append((stack[0].key, row))
+                    self._row_expected = False
+                    continue
+
+            if top is not None and not top.rows and len(stack) > 2:
+                # Inside a value nobody asked for (routing_table, stats, ...):
+                # only bracket depth matters, so skip ahead in one regex match.
+                pos = _SKIP.match(buf, pos).end()
+                if pos >= len(buf):
+                    break
+                char = buf[pos]
+                if char == '"':
+                    if final:
+                        raise ValueError('Unterminated string in VPNStatus output')
+                    break
+                if char in '[{':
+                    stack.append(_Frame(char))
+                else:
+                    stack.pop()
+                pos += 1
+                continue
+
+            match = _SIGNIFICANT.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char = match.group()
+            if char == '"':
+                string = _STRING.match(buf, match.start())
+                if string is None:
+                    if final:
+                        raise ValueError('Unterminated string in VPNStatus output')
+                    pos = match.start()
+                    break
+                if top is not None and top.kind == '{' and top.expect_key:
+                    top.key = json.loads(string.group())
+                pos = string.end()
+            elif char in '[{':
+                # <daemon object>.client_list, two levels below the root object
+                is_rows = (char == '[' and len(stack) == 2 and stack[0].kind == '{'
+                           and stack[1].kind == '{' and stack[1].key == 'client_list')
+                stack.append(_Frame(char, rows=is_rows))
+                self._row_expected = is_rows
+                pos = match.end()
+            elif char in ']}':
+                if stack:
+                    stack.pop()
+                self._row_expected = False
+                pos = match.end()
+            elif char == ',':
+                if top is not None:
+                    if top.kind == '{':
+                        top.expect_key = True
+                    elif top.rows:
+                        self._row_expected = True
+                pos = match.end()
+            else:  # ':'
+                if top is not None:
+                    top.expect_key = False
+                pos = match.end()
+
+        # Drop everything already consumed so the buffer stays small
+        self._buf = buf[pos:]
+        return rows
+
+
+def session_from_row(daemon, row):
+    """
+    Build a ClientSession from one client_list row:
+    [Common Name, Real Address, Virtual Address, Virtual IPv6 Address,
+     Bytes Received, Bytes Sent, Connected Since, Connected Since (time_t),
+     Username, Client ID, Peer ID, Data Channel Cipher]
+    """
+    def col(index, default=''):
+        return row[index] if len(row) > index and row[index] is not None else default
+
+    return ClientSession(
+        username=str(col(0)).replace('_AUTOLOGIN', ''),
+        real_address=col(1),
+        virtual_address=col(2),
+        virtual_ipv6_address=col(3),
+        bytes_received=to_int(col(4, 0)),
+        bytes_sent=to_int(col(5, 0)),
+        connected_since=from_time_t(col(7, None)),
+        client_id=to_int(col(9, None), None),
+        daemon=daemon,
+    )
+
+
+def iter_sessions(stream, read_size=READ_SIZE):
+    """Yield a ClientSession for every client of every daemon in a text stream."""
+    parser = ClientListParser()
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        for daemon, row in parser.feed(chunk):
+            yield session_from_row(daemon, row)
+    for daemon, row in parser.close():
+        yield session_from_row(daemon, row)
+
+
+def read_vpn_status(sacli=DEFAULT_SACLI, timeout=30):
+    """
+    Run `sacli VPNStatus` and return the list of ClientSession for all
+    openvpn_N daemons. Raises subprocess.CalledProcessError on failure, and
+    subprocess.TimeoutExpired (after killing sacli) if it takes longer than
+    `timeout` seconds in all. stderr is drained by a thread while stdout is
+    parsed, so sacli never blocks on a full pipe.
+    """
+    args = [sacli, 'VPNStatus']
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True, encoding='utf-8', errors='ignore') as proc:
+        stderr = []
+        drain = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+        drain.start()
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+        try:
+            sessions = list(iter_sessions(proc.stdout))
+            proc.wait()
+        except Exception:
+            proc.kill()
+            if not expired.is_set():
+                raise
+        finally:
+            timer.cancel()
+            drain.join()
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(args, timeout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, stderr=''.join(stderr))
+    return sessions
+
+
+async def read_vpn_status_async(sacli=DEFAULT_SACLI, timeout=30):
+    """asyncio flavour of read_vpn_status; does not block the event loop."""
+    args = [sacli, 'VPNStatus']
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    parser = ClientListParser()
+    sessions = []
+
+    async def consume():
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        while True:
+            chunk = await proc.stdout.read(READ_SIZE)
+            if not chunk:
+                break
+            for daemon, row in parser.feed(decoder.decode(chunk)):
+                sessions.append(session_from_row(daemon, row))
+        for daemon, row in parser.feed(decoder.decode(b'', final=True)) + parser.close():
+            sessions.append(session_from_row(daemon, row))
+        return await proc.stderr.read()
+
+    try:
+        stderr = await asyncio.wait_for(consume(), timeout)
+        await asyncio.wait_for(proc.wait(), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, stderr=stderr.decode('utf-8', 'ignore'))
+    return sessions
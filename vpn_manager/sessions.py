@@ -0,0 +1,52 @@
+"""Typed records for live VPN client sessions, shared by every status source."""
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+
+class ClientSession(NamedTuple):
+    username: str
+    real_address: str
+    virtual_address: str
+    virtual_ipv6_address: str = ''
+    bytes_received: int = 0
+    bytes_sent: int = 0
+    connected_since: Optional[datetime] = None
+    client_id: Optional[int] = None
+    daemon: Optional[str] = None  # e.g. 'openvpn_0' on Access Server, None for the status log
+    node: Optional[str] = None    # remote VPN node that reported it (see vpn_manager.nodes), None if local
+
+    def as_info(self):
+        """Legacy {real_address, virtual_address} shape used by get_client_info."""
+        return {
+            'real_address': self.real_address,
+            'virtual_address': self.virtual_address,
+        }
+
+    def as_dict(self):
+        """JSON-friendly form, used by client_info_api's /sessions endpoint."""
+        data = self._asdict()
+        if self.connected_since is not None:
+            data['connected_since'] = int(self.connected_since.timestamp())
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Inverse of as_dict(); unknown keys are ignored."""
+        values = {name: data[name] for name in cls._fields if name in data}
+        values['connected_since'] = from_time_t(values.get('connected_since'))
+        return cls(**values)
+
+
+def to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def from_time_t(value):
+    """Convert a 'Connected Since (time_t)' column to an aware UTC datetime."""
+    seconds = to_int(value, None)
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
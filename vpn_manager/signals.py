@@ -2,83 +2,88 @@ import os
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
-from .models import VPNUser
-from .utils import create_user_sacli_commands, kill_user, prop_deny_user_sacli_commands
+from .models import VPNTask, VPNUser
+from .outbox import change_key, enqueue_deny, enqueue_disconnect, enqueue_provision
+from .psw_store import psw_store
 from django.conf import settings
 
 PSW_FILE = settings.OPENVPN_PSW_FILE
 
+# Fields whose changes have to reach the psw file or Access Server
+# (e.g. editing only expiry_date needs no external work)
+RELEVANT_FIELDS = {'username', 'openvpn_password', 'is_active', 'max_connections', 'has_access_server_user',
+                   'quota_exceeded'}
 
-def _load_users():
-    users = {}
-    if os.path.exists(PSW_FILE):
-        with open(PSW_FILE) as f:
-            for line in f:
-                if ':' in line:
-                    user, pwd, max_conns = line.strip().split(':', 2)
-                    users[user] = {'password': pwd, 'max_connections': max_conns}
-    return users
 
+def _enabled(values):
+    # A user over their monthly quota is denied like an inactive one
+    return values.get('is_active') and not values.get('quota_exceeded')
 
-def _write_users(users):
-    os.makedirs(os.path.dirname(PSW_FILE), exist_ok=True)
-    with open(PSW_FILE, 'w') as f:
-        for user, data in users.items():
-            f.write(f"{user}:{data['password']}:{data['max_connections']}\n")
+
+def _key(op, instance):
+    # The same change saved twice (same revision and new values) is queued once
+    return change_key(op, instance.pk, instance.revision,
+                      *(getattr(instance, name) for name in sorted(RELEVANT_FIELDS)))
+
+
+def _old_values(sender, instance):
+    """Previously saved values of the tracked fields, or None for a new user."""
+    loaded = instance.loaded_values
+    if loaded is not None and RELEVANT_FIELDS <= loaded.keys():
+        return loaded
+    if instance.pk is None:
+        return None
+    # Built by hand or loaded with deferred fields: ask the DB
+    return sender.objects.filter(pk=instance.pk).values(*RELEVANT_FIELDS).first()
 
 
 @receiver(pre_save, sender=VPNUser)
 def update_psw_file_on_save(sender, instance, **kwargs):
-    try:
-        old_instance = sender.objects.get(pk=instance.pk)
-        if old_instance.has_access_server_user == False and instance.has_access_server_user:
-            users = _load_users()
-            if users.pop(instance.username, None):
-                _write_users(users)
-                kill_user(instance.username, instance.has_access_server_user)
-            if instance.is_active:
-                create_user_sacli_commands(instance.username, instance.openvpn_password)
-                prop_deny_user_sacli_commands(instance.username, "false")
-        else:
-            if instance.has_access_server_user:
-                if instance.is_active:
-                    create_user_sacli_commands(instance.username, instance.openvpn_password)
-                    prop_deny_user_sacli_commands(instance.username, "false")
-                elif old_instance.is_active:
-                    prop_deny_user_sacli_commands(instance.username, "true")
-                    kill_user(instance.username, instance.has_access_server_user)
-            else:
-                users = _load_users()
-                # If user is active, add/update; otherwise remove
-                if instance.is_active:
-                    users[instance.username] = {
-                        'password': instance.openvpn_password,
-                        'max_connections': instance.max_connections,
-                    }
-                elif old_instance.is_active:
-                    users.pop(instance.username, None)
-                    kill_user(instance.username, instance.has_access_server_user)
-                _write_users(users)
-        
-    except sender.DoesNotExist:
-        if instance.is_active:
-            if instance.has_access_server_user:
-                create_user_sacli_commands(instance.username, instance.openvpn_password)
-                prop_deny_user_sacli_commands(instance.username, "false")
-                return
-            else:
-                users = _load_users()
-                users[instance.username] = {
-                    'password': instance.openvpn_password,
-                    'max_connections': instance.max_connections,
-                }
-                _write_users(users)
-                return
+    old = _old_values(sender, instance)
+    enabled = instance.is_active and not instance.quota_exceeded
+    if old is None:
+        # Access Server users are provisioned in post_save, once the pk is known
+        if enabled and not instance.has_access_server_user:
+            psw_store.stage(instance.username, instance.openvpn_password, instance.max_connections)
+        return
+
+    changed = {name for name in RELEVANT_FIELDS if name in old and getattr(instance, name) != old[name]}
+    if not changed:
+        return
+
+    if old.get('has_access_server_user') == False and instance.has_access_server_user:
+        if psw_store.contains(instance.username):
+            psw_store.stage_remove(instance.username)
+            enqueue_disconnect(instance.username, instance.has_access_server_user,
+                               _key(VPNTask.OP_DISCONNECT, instance))
+        if enabled:
+            enqueue_provision(instance.username, instance.openvpn_password, _key(VPNTask.OP_PROVISION, instance))
+    elif instance.has_access_server_user:
+        if enabled:
+            # max_connections is not an Access Server property
+            if changed - {'max_connections'}:
+                enqueue_provision(instance.username, instance.openvpn_password,
+                                  _key(VPNTask.OP_PROVISION, instance))
+        elif _enabled(old):
+            enqueue_deny(instance.username, _key(VPNTask.OP_DENY, instance))
+    else:
+        # If user is active, add/update; otherwise remove
+        if enabled:
+            psw_store.stage(instance.username, instance.openvpn_password, instance.max_connections)
+        elif _enabled(old):
+            psw_store.stage_remove(instance.username)
+            enqueue_disconnect(instance.username, instance.has_access_server_user,
+                               _key(VPNTask.OP_DISCONNECT, instance))
+
+
+@receiver(post_save, sender=VPNUser)
+def provision_created_user(sender, instance, created, **kwargs):
+    if created and instance.has_access_server_user and instance.is_active and not instance.quota_exceeded:
+        enqueue_provision(instance.username, instance.openvpn_password, _key(VPNTask.OP_PROVISION, instance))
 
 
 @receiver(post_delete, sender=VPNUser)
 def remove_psw_file_on_delete(sender, instance, **kwargs):
-    users = _load_users()
-    users.pop(instance.username, None)
-    _write_users(users)
-    kill_user(instance.username, instance.has_access_server_user)
+    psw_store.stage_remove(instance.username)
+    enqueue_disconnect(instance.username, instance.has_access_server_user,
+                       change_key(VPNTask.OP_DISCONNECT, instance.pk, instance.revision, 'deleted'))
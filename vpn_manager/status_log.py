@@ -0,0 +1,193 @@
+"""
+Incremental reader for the OpenVPN status file (`status` / `status-version`).
+
+The parsed snapshot is cached and only rebuilt when the file's inode, size or
+mtime change. The file is read through mmap and parsing stops at the end of
+the client list instead of walking the routing table (status-version 1 is the
+exception: its client list has no virtual address, so the routing table is
+read as well).
+"""
+import mmap
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from vpn_manager.sessions import ClientSession, from_time_t, to_int
+
+V1_END_MARKERS = (b'\nGLOBAL STATS',)
+V2_END_MARKERS = (b'\nHEADER,ROUTING_TABLE', b'\nROUTING_TABLE,', b'\nGLOBAL_STATS,', b'\nEND')
+V3_END_MARKERS = (b'\nHEADER\tROUTING_TABLE', b'\nROUTING_TABLE\t', b'\nGLOBAL_STATS\t', b'\nEND')
+
+# Column layout of status-version 2/3 when no HEADER line is present
+DEFAULT_COLUMNS = (
+    'Common Name', 'Real Address', 'Virtual Address', 'Virtual IPv6 Address',
+    'Bytes Received', 'Bytes Sent', 'Connected Since', 'Connected Since (time_t)',
+    'Username', 'Client ID', 'Peer ID',
+)
+
+
+class StatusSnapshot:
+    def __init__(self, sessions, version=None, signature=None):
+        self.sessions = sessions
+        self.version = version
+        self.signature = signature
+
+    def usernames(self):
+        return {session.username for session in self.sessions}
+
+    def client_info(self):
+        """Return {username: {real_address, virtual_address}}."""
+        return {session.username: session.as_info() for session in self.sessions}
+
+
+EMPTY_SNAPSHOT = StatusSnapshot([])
+
+
+def _parse_ctime(value):
+    try:
+        return datetime.fromtimestamp(time.mktime(time.strptime(value.strip(), '%a %b %d %H:%M:%S %Y')),
+                                      tz=timezone.utc)
+    except (ValueError, OverflowError):
+        return None
+
+
+def _end_of_section(data, markers):
+    ends = [pos for pos in (data.find(marker) for marker in markers) if pos != -1]
+    return min(ends) if ends else len(data)
+
+
+def parse_v1(text):
+    """status-version 1: 'OpenVPN CLIENT LIST' followed by 'ROUTING TABLE'."""
+    sessions = {}
+    virtual = {}
+    section = None
+    for line in text.splitlines():
+        if line == 'OpenVPN CLIENT LIST':
+            section = 'clients'
+        elif line == 'ROUTING TABLE':
+            section = 'routes'
+        elif line.startswith(('Updated,', 'Common Name,', 'Virtual Address,')):
+            continue
+        elif section == 'clients':
+            parts = line.split(',')
+            if len(parts) >= 5:
+                sessions[(parts[0], parts[1])] = parts
+        elif section == 'routes':
+            parts = line.split(',')
+            # Skip iroute/subnet entries, keep the client's own address
+            if len(parts) >= 3 and '/' not in parts[0] and (parts[1], parts[2]) not in virtual:
+                virtual[(parts[1], parts[2])] = parts[0]
+    return [
+        ClientSession(
+            username=cn,
+            real_address=real,
+            virtual_address=virtual.get((cn, real), ''),
+            bytes_received=to_int(parts[2]),
+            bytes_sent=to_int(parts[3]),
+            connected_since=_parse_ctime(parts[4]),
+        )
+        for (cn, real), parts in sessions.items()
+    ]
+
+
+def parse_v2(text, sep=','):
+    """status-version 2 (comma separated) and 3 (tab separated)."""
+    columns = {name: index + 1 for index, name in enumerate(DEFAULT_COLUMNS)}
+    header_prefix = f'HEADER{sep}CLIENT_LIST{sep}'
+    row_prefix = f'CLIENT_LIST{sep}'
+    sessions = []
+    for line in text.splitlines():
+        if line.startswith(header_prefix):
+            columns = {name: index for index, name in enumerate(line.split(sep)[1:])}
+            continue
+        if not line.startswith(row_prefix):
+            continue
+        parts = line.split(sep)
+
+        def col(name, default=''):
+            index = columns.get(name)
+            return parts[index] if index is not None and index < len(parts) else default
+
+        sessions.append(ClientSession(
+            username=col('Common Name'),
+            real_address=col('Real Address'),
+            virtual_address=col('Virtual Address'),
+            virtual_ipv6_address=col('Virtual IPv6 Address'),
+            bytes_received=to_int(col('Bytes Received', 0)),
+            bytes_sent=to_int(col('Bytes Sent', 0)),
+            connected_since=from_time_t(col('Connected Since (time_t)', None)) or _parse_ctime(col('Connected Since')),
+            client_id=to_int(col('Client ID', None), None),
+        ))
+    return sessions
+
+
+def parse_status(data):
+    """Parse the bytes of a status file; returns (version, [ClientSession])."""
+    head = data[:4096]
+    if head.startswith(b'OpenVPN CLIENT LIST'):
+        end = _end_of_section(data, V1_END_MARKERS)
+        return 1, parse_v1(data[:end].decode('utf-8', errors='ignore'))
+    if head.startswith(b'TITLE\t') or b'\nCLIENT_LIST\t' in head:
+        end = _end_of_section(data, V3_END_MARKERS)
+        return 3, parse_v2(data[:end].decode('utf-8', errors='ignore'), sep='\t')
+    end = _end_of_section(data, V2_END_MARKERS)
+    return 2, parse_v2(data[:end].decode('utf-8', errors='ignore'))
+
+
+def count_sessions(path, username):
+    """
+    Count the sessions of one common name without parsing the whole file
+    (used on the auth-script hot path). Returns 0 if the file is unreadable.
+    """
+    name = username.encode('utf-8')
+    needles = (b'\nCLIENT_LIST,' + name + b',', b'\nCLIENT_LIST\t' + name + b'\t')
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:19] == b'OpenVPN CLIENT LIST':
+                    end = _end_of_section(data, (b'\nROUTING TABLE',))
+                    return data[:end].count(b'\n' + name + b',')
+                end = _end_of_section(data, V2_END_MARKERS + V3_END_MARKERS)
+                section = data[:end]
+                return sum(section.count(needle) for needle in needles)
+    except (OSError, ValueError):
+        return 0
+
+
+class StatusLogReader:
+    def __init__(self, path):
+        self.path = path
+        self.parses = 0
+        self._snapshot = EMPTY_SNAPSHOT
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Return the parsed StatusSnapshot, re-parsing only if the file changed.
+        Missing or unreadable files yield an empty snapshot.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return EMPTY_SNAPSHOT
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if self._snapshot.signature == signature:
+                return self._snapshot
+            try:
+                version, sessions = self._read()
+            except (OSError, ValueError):
+                return EMPTY_SNAPSHOT
+            self.parses += 1
+            self._snapshot = StatusSnapshot(sessions, version, signature)
+            return self._snapshot
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None, []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return parse_status(data)
@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from fastapi.testclient import TestClient
+
+import client_info_api
+from vpn_manager import (accounting, auth_verify, collector, enforce, history, outbox, psw_store, quota, sacli,
+                         sacli_status, status_log, utils)
+from vpn_manager.expiry import ExpiryScheduler
+from vpn_manager.fake_mgmt_server import FakeManagementServer
+from vpn_manager.management.commands.run_mgmt_listener import Command as ListenerCommand
+from vpn_manager.mgmt import ManagementClient
+from vpn_manager.mgmt_listener import ManagementListener
+from vpn_manager.models import (ConnectionInterval, TrafficRollup, TrafficSample, VPNSession, VPNTask, VPNUser,
+                                natural_sort_key)
+from vpn_manager.sessions import ClientSession
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+async def async_wait_for(predicate, timeout=3.0):
+    """wait_for() for the event loop; `predicate` may be a coroutine function."""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if asyncio.iscoroutine(result):
+            result = await result
+        if result:
+            return True
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+
+
+class TempPswFileMixin:
+    """Points the shared psw_store at a psw file in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.psw_path = os.path.join(directory.name, 'psw-file')
+        patcher = mock.patch.multiple(psw_store.psw_store, path=self.psw_path, lock_path=f'{self.psw_path}.lock',
+                                      db_path=None, _users={}, _signature=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class FakeServerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeManagementServer().start()
+        self.addCleanup(self.server.stop)
+
+    def connections(self):
+        with self.server._lock:
+            return len(self.server._handlers)
+
+
+class ManagementClientTests(FakeServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = ManagementClient('127.0.0.1', self.server.port, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def test_status_lists_every_session(self):
+        self.server.add_client('alice', real_address='198.51.100.1:40000', virtual_address='10.8.0.2')
+        self.server.add_client('alice', real_address='198.51.100.2:40001', virtual_address='10.8.0.3')
+        self.server.add_client('bob')
+        lines = self.client.status()
+        self.assertEqual(sum(line.startswith('CLIENT_LIST,') for line in lines), 3)
+        self.assertNotIn('END', lines)
+        self.assertEqual(self.client.connected_usernames(), {'alice', 'bob'})
+        sessions = [s for s in self.client.sessions() if s.username == 'alice']
+        self.assertEqual(sorted(s.real_address for s in sessions), ['198.51.100.1:40000', '198.51.100.2:40001'])
+
+    def test_kill_many_reports_each_common_name(self):
+        self.server.add_client('alice')
+        self.server.add_client('bob')
+        self.server.add_client('bob')
+        results = self.client.kill_many(['alice', 'bob', 'nobody', 'alice'])
+        self.assertEqual(results, {'alice': True, 'bob': True, 'nobody': False})
+        self.assertEqual(self.server.clients, {})
+        # One pipelined write, no duplicate kill
+        self.assertEqual(self.server.commands, ['kill alice', 'kill bob', 'kill nobody'])
+
+    def test_kill_sessions_by_client_id_or_address(self):
+        self.server.add_client('alice', real_address='198.51.100.1:40000')
+        self.server.add_client('alice', real_address='198.51.100.2:40001')
+        first, second = sorted(self.client.sessions(), key=lambda s: s.real_address)
+        self.assertEqual(self.client.kill_sessions([first._replace(client_id=None), second]), [True, True])
+        self.assertEqual(self.client.kill_sessions([second]), [False])
+        self.assertEqual(self.server.commands[-3:], [
+            'kill 198.51.100.1:40000', f'client-kill {second.client_id}', f'client-kill {second.client_id}'])
+
+    def test_command_releases_the_interface(self):
+        self.client.status()
+        self.assertFalse(self.client.connected)
+        self.assertTrue(wait_for(lambda: self.connections() == 0))
+
+    def test_connect_holds_the_interface(self):
+        self.client.connect()
+        self.client.kill_many(['nobody'])
+        self.client.status()
+        self.assertTrue(self.client.connected)
+        self.assertEqual(self.connections(), 1)
+        self.client.close()
+        self.assertTrue(wait_for(lambda: self.connections() == 0))
+
+    def test_held_connection_survives_a_restart(self):
+        self.client.connect()
+        self.server.drop_connections()
+        self.assertTrue(wait_for(lambda: self.connections() == 0))
+        self.server.add_client('alice')
+        self.assertEqual(self.client.connected_usernames(), {'alice'})
+        self.assertTrue(self.client.connected)
+
+
+VPN_STATUS = json.dumps({
+    'openvpn_0': {
+        'client_list': [['alice_AUTOLOGIN', '198.51.100.1:1194', '172.27.224.2', '', '100', '200',
+                         'Sun Oct 18 12:00:00 2026', '1792324800', 'alice', '3', '0', 'AES-256-GCM']],
+        'routing_table': [['172.27.224.2', 'alice', '198.51.100.1:1194', 'Sun Oct 18 12:00:00 2026', '1792324800']],
+    },
+    'openvpn_1': {'client_list': [['bob', '198.51.100.2:1194', '172.27.225.2', '', '5', '6', '', '', 'bob', '4']]},
+})
+
+
+STATUS_V1 = """OpenVPN CLIENT LIST
+Updated,Sun Oct 18 12:00:00 2026
+Common Name,Real Address,Bytes Received,Bytes Sent,Connected Since
+alice,198.51.100.1:1194,100,200,Sun Oct 18 11:00:00 2026
+bob,198.51.100.2:1194,300,400,Sun Oct 18 11:30:00 2026
+ROUTING TABLE
+Virtual Address,Common Name,Real Address,Last Ref
+10.8.0.0/24,alice,198.51.100.1:1194,Sun Oct 18 12:00:00 2026
+10.8.0.2,alice,198.51.100.1:1194,Sun Oct 18 12:00:00 2026
+10.8.0.3,bob,198.51.100.2:1194,Sun Oct 18 12:00:00 2026
+GLOBAL STATS
+Max bcast/mcast queue length,0
+END
+"""
+
+STATUS_V2 = """TITLE,OpenVPN 2.6.8
+TIME,Sun Oct 18 12:00:00 2026,1792324800
+HEADER,CLIENT_LIST,Common Name,Real Address,Virtual Address,Virtual IPv6 Address,Bytes Received,Bytes Sent,\
+Connected Since,Connected Since (time_t),Username,Client ID,Peer ID,Data Channel Cipher
+CLIENT_LIST,alice,198.51.100.1:1194,10.8.0.2,,100,200,Sun Oct 18 11:00:00 2026,1792321200,UNDEF,7,0,AES-256-GCM
+CLIENT_LIST,bob,198.51.100.2:1194,10.8.0.3,,300,400,Sun Oct 18 11:30:00 2026,1792323000,UNDEF,8,1,AES-256-GCM
+HEADER,ROUTING_TABLE,Virtual Address,Common Name,Real Address,Last Ref,Last Ref (time_t)
+ROUTING_TABLE,10.8.0.2,alice,198.51.100.1:1194,Sun Oct 18 12:00:00 2026,1792324800
+GLOBAL_STATS,Max bcast/mcast queue length,0
+END
+CLIENT_LIST,ghost,203.0.113.9:1194,10.8.0.9,,0,0,,0,UNDEF,9,2,
+"""
+
+
+def write_status(path, text):
+    # Written aside and renamed over, like OpenVPN does
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(text)
+    os.replace(f'{path}.tmp', path)
+
+
+class StatusLogReaderTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'openvpn-status.log')
+        self.reader = status_log.StatusLogReader(self.path)
+
+    def summary(self, snapshot):
+        return [(s.username, s.real_address, s.virtual_address, s.bytes_received, s.bytes_sent,
+                 int(s.connected_since.timestamp()), s.client_id) for s in snapshot.sessions]
+
+    def test_version_1_takes_virtual_addresses_from_the_routing_table(self):
+        write_status(self.path, STATUS_V1)
+        snapshot = self.reader.snapshot()
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(self.summary(snapshot), [
+            ('alice', '198.51.100.1:1194', '10.8.0.2', 100, 200, 1792321200, None),
+            ('bob', '198.51.100.2:1194', '10.8.0.3', 300, 400, 1792323000, None),
+        ])
+
+    def test_versions_2_and_3_stop_at_the_end_of_the_client_list(self):
+        expected = [
+            ('alice', '198.51.100.1:1194', '10.8.0.2', 100, 200, 1792321200, 7),
+            ('bob', '198.51.100.2:1194', '10.8.0.3', 300, 400, 1792323000, 8),
+        ]
+        for version, text in [(2, STATUS_V2), (3, STATUS_V2.replace(',', '\t'))]:
+            with self.subTest(version=version):
+                write_status(self.path, text)
+                snapshot = self.reader.snapshot()
+                self.assertEqual(snapshot.version, version)
+                self.assertEqual(self.summary(snapshot), expected)  # no 'ghost' after END
+                self.assertEqual(status_log.count_sessions(self.path, 'alice'), 1)
+
+    def test_unchanged_file_is_not_parsed_again(self):
+        write_status(self.path, STATUS_V2)
+        first = self.reader.snapshot()
+        self.assertIs(self.reader.snapshot(), first)
+        self.assertEqual(self.reader.parses, 1)
+
+        write_status(self.path, STATUS_V2.replace('alice', 'carol'))
+        self.assertEqual(self.reader.snapshot().usernames(), {'carol', 'bob'})
+        self.assertEqual(self.reader.parses, 2)
+
+    def test_missing_file_is_empty(self):
+        self.assertEqual(self.reader.snapshot().sessions, [])
+        self.assertEqual(status_log.count_sessions(self.path, 'alice'), 0)
+
+
+def fake_sacli(test, script):
+    """Path of a shell script standing in for sacli, removed after `test`."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'sacli')
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\n{script}\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+class ClientListParserTests(SimpleTestCase):
+    expected = [
+        ('openvpn_0', ['alice_AUTOLOGIN', '198.51.100.1:1194', '172.27.224.2', '', '100', '200',
+                       'Sun Oct 18 12:00:00 2026', '1792324800', 'alice', '3', '0', 'AES-256-GCM']),
+        ('openvpn_1', ['bob', '198.51.100.2:1194', '172.27.225.2', '', '5', '6', '', '', 'bob', '4']),
+    ]
+
+    def parse(self, *chunks):
+        parser = sacli_status.ClientListParser()
+        rows = []
+        for chunk in chunks:
+            rows += parser.feed(chunk)
+        return rows + parser.close()
+
+    def test_any_split_point_gives_the_same_rows(self):
+        for split in range(len(VPN_STATUS) + 1):
+            with self.subTest(split=split, around=VPN_STATUS[max(0, split - 5):split + 5]):
+                self.assertEqual(self.parse(VPN_STATUS[:split], VPN_STATUS[split:]), self.expected)
+        self.assertEqual(self.parse(*VPN_STATUS), self.expected)  # one character at a time
+
+    def test_row_split_mid_field_waits_for_the_rest(self):
+        parser = sacli_status.ClientListParser()
+        split = VPN_STATUS.index('198.51.100.1') + 6
+        self.assertEqual(parser.feed(VPN_STATUS[:split]), [])
+        self.assertEqual(parser.feed(VPN_STATUS[split:]), self.expected)
+        self.assertEqual(parser.close(), [])
+
+    def test_key_split_mid_name_is_still_recognised(self):
+        parser = sacli_status.ClientListParser()
+        split = VPN_STATUS.index('client_list') + 6
+        self.assertEqual(parser.feed(VPN_STATUS[:split]), [])
+        self.assertEqual(parser.feed(VPN_STATUS[split:]), self.expected)
+
+    def test_only_client_lists_of_daemons_are_rows(self):
+        text = json.dumps({
+            'openvpn_0': {
+                'routing_table': [['"]}{[', 'client_list'], {'client_list': [['not', 'a', 'row']]}],
+                'client_list': [['carol', '198.51.100.3:1194', '172.27.224.3']],
+            },
+            'stats': {'client_list': 3},
+        })
+        for size in (1, 3, len(text)):
+            with self.subTest(size=size):
+                chunks = [text[i:i + size] for i in range(0, len(text), size)]
+                self.assertEqual(self.parse(*chunks), [('openvpn_0', ['carol', '198.51.100.3:1194', '172.27.224.3'])])
+
+    def test_truncated_output_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.parse(VPN_STATUS[:VPN_STATUS.index('bob') + 10])
+
+    def test_iter_sessions_reads_in_small_chunks(self):
+        sessions = list(sacli_status.iter_sessions(io.StringIO(VPN_STATUS), read_size=7))
+        self.assertEqual([(session.username, session.virtual_address, session.client_id) for session in sessions],
+                         [('alice', '172.27.224.2', 3), ('bob', '172.27.225.2', 4)])
+
+
+class SacliStatusTests(SimpleTestCase):
+    def test_hung_sacli_is_killed_at_the_deadline(self):
+        sacli = fake_sacli(self, "printf '{\"openvpn_0\": {'; exec sleep 30")
+        started = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            sacli_status.read_vpn_status(sacli, timeout=0.5)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_stderr_is_drained_while_stdout_is_read(self):
+        # Far more than a pipe buffer on stderr before any stdout
+        sacli = fake_sacli(self, f"head -c 1000000 /dev/zero >&2; printf '%s' '{VPN_STATUS}'")
+        sessions = sacli_status.read_vpn_status(sacli, timeout=10)
+        self.assertEqual([(session.username, session.daemon) for session in sessions],
+                         [('alice', 'openvpn_0'), ('bob', 'openvpn_1')])
+
+    def test_failure_reports_stderr(self):
+        sacli = fake_sacli(self, "echo 'no such daemon' >&2; exit 2")
+        with self.assertRaises(subprocess.CalledProcessError) as raised:
+            sacli_status.read_vpn_status(sacli, timeout=10)
+        self.assertEqual(raised.exception.stderr, 'no such daemon\n')
+
+
+class SacliExecutorTests(SimpleTestCase):
+    def setUp(self):
+        # Record the backoff instead of waiting it out
+        self.sleep = mock.Mock()
+        clock = mock.patch.object(sacli, 'time', mock.Mock(sleep=self.sleep, perf_counter=time.perf_counter))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def flaky_sacli(self, failures):
+        # Fails `failures` times, then succeeds; every call is counted in `<script>.calls`
+        return fake_sacli(self, f'n=$(($(cat "$0.calls" 2>/dev/null || echo 0) + 1)); echo $n > "$0.calls"\n'
+                                f'[ $n -gt {failures} ] || {{ echo busy >&2; exit 1; }}')
+
+    def calls(self, path):
+        with open(f'{path}.calls') as f:
+            return int(f.read())
+
+    def test_transient_failure_is_retried_with_backoff(self):
+        path = self.flaky_sacli(failures=2)
+        result = sacli.SacliExecutor(path, retries=2, backoff=0.5).run(sacli.disconnect_user('alice'))
+        self.assertEqual((result.ok, result.attempts, self.calls(path)), (True, 3, 3))
+        self.assertEqual([call.args[0] for call in self.sleep.call_args_list], [0.5, 1.0])
+
+    def test_gives_up_after_the_last_attempt(self):
+        path = self.flaky_sacli(failures=100)
+        executor = sacli.SacliExecutor(path, retries=2, backoff=0.5)
+        result = executor.run(sacli.disconnect_user('alice'))
+        self.assertEqual((result.ok, result.returncode, result.stderr, result.attempts), (False, 1, 'busy\n', 3))
+        self.assertEqual(self.calls(path), 3)
+        self.assertEqual(executor.stats()['DisconnectUser'], {
+            'count': 1, 'failures': 1, 'retries': 2, 'total': result.duration, 'max': result.duration})
+        # A chain stops at its first failed command
+        self.assertFalse(executor.run_chain(sacli.provision_commands('alice', 'secret')))
+        self.assertEqual(self.calls(path), 6)
+
+    def test_one_users_commands_run_in_order(self):
+        # The first command is slow; without ordering alice's second would finish first
+        path = fake_sacli(self, 'case "$6" in first) sleep 0.3;; esac; echo "$2 $6" >> "$0.log"')
+        executor = sacli.SacliExecutor(path, max_workers=4)
+        futures = [
+            executor.submit('alice', [sacli.user_prop_put('alice', 'prop', 'first')]),
+            executor.submit('alice', [sacli.user_prop_put('alice', 'prop', 'second')]),
+            executor.submit('bob', [sacli.user_prop_put('bob', 'prop', 'other')]),
+        ]
+        self.assertEqual([future.result(timeout=10) for future in futures], [True, True, True])
+        with open(f'{path}.log') as f:
+            log = f.read().splitlines()
+        self.assertEqual([line for line in log if line.startswith('alice')], ['alice first', 'alice second'])
+        self.assertEqual(log[0], 'bob other')  # other users do not wait
+
+
+class CredentialDatabaseTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'psw.sqlite3')
+
+    def test_read_only_lookup_needs_no_side_files(self):
+        psw_store.build_db(self.db_path, {'alice': ('secret', '2')})
+        psw_store.update_db(self.db_path, {'bob': ('pw', '1'), 'alice': None})
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        finally:
+            conn.close()
+        self.assertEqual(auth_verify.lookup('bob', self.db_path), ('pw', 1))
+        self.assertIsNone(auth_verify.lookup('alice', self.db_path))
+        self.assertEqual(os.listdir(os.path.dirname(self.db_path)), ['psw.sqlite3'])
+
+
+class PswFileStoreTests(TempPswFileMixin, TestCase):
+    store = psw_store.psw_store
+
+    def create_user(self, username):
+        return VPNUser.objects.create(username=username, openvpn_password=f'{username}-pw',
+                                      expiry_date=date(2100, 1, 1), max_connections=2, has_access_server_user=False)
+
+    def read(self):
+        with open(self.psw_path) as f:
+            return f.read()
+
+    def test_write_replaces_the_file_atomically(self):
+        self.store.apply({'alice': ('secret', '1')})
+        inode = os.stat(self.psw_path).st_ino
+        with mock.patch.object(psw_store.os, 'fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.store.apply({'bob': ('pw', '2')})
+        # The failed write left neither a partial file nor its temp file behind
+        self.assertEqual(self.read(), 'alice:secret:1\n')
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.psw_path))), ['psw-file', 'psw-file.lock'])
+        self.store.apply({'bob': ('pw', '2')})
+        self.assertEqual(self.read(), 'alice:secret:1\nbob:pw:2\n')
+        self.assertNotEqual(os.stat(self.psw_path).st_ino, inode)  # renamed over, not rewritten in place
+
+    def test_saves_in_one_transaction_are_written_once_on_commit(self):
+        writes = self.store.writes
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for username in ('alice', 'bob', 'carol'):
+                self.create_user(username)
+            user = VPNUser.objects.get(username='bob')
+            user.is_active = False
+            user.save()
+            self.assertFalse(os.path.exists(self.psw_path))  # nothing written before the commit
+        self.assertEqual((len(callbacks), self.store.writes - writes), (1, 1))
+        self.assertEqual(self.read(), 'alice:alice-pw:2\ncarol:carol-pw:2\n')
+
+    def test_nothing_is_written_after_a_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.create_user('mallory')
+                raise RuntimeError
+        self.assertFalse(os.path.exists(self.psw_path))
+        # The rolled back change does not ride along with the next commit either
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_user('alice')
+        self.assertEqual(self.read(), 'alice:alice-pw:2\n')
+
+
+class NaturalSortKeyTests(SimpleTestCase):
+    def test_numbers_sort_by_value(self):
+        usernames = ['user10', 'User2', 'user1', 'user2a', 'admin', 'user']
+        self.assertEqual(sorted(usernames, key=natural_sort_key),
+                         ['admin', 'user', 'user1', 'User2', 'user2a', 'user10'])
+        self.assertLess(natural_sort_key('user2'), natural_sort_key('user10'))
+        self.assertLess(natural_sort_key('a9b10'), natural_sort_key('a10b9'))
+
+    def test_key_is_capped_to_the_column(self):
+        self.assertEqual(len(natural_sort_key('a1' * 75)), 255)  # every digit is padded to 20
+
+
+class SortKeyBackfillMigrationTests(TransactionTestCase):
+    before = [('vpn_manager', '0006_vpntask')]
+    after = [('vpn_manager', '0007_vpnuser_username_sort_key')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_existing_rows_are_backfilled(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_user = executor.loader.project_state(self.before).apps.get_model('vpn_manager', 'VPNUser')
+        old_user.objects.bulk_create(
+            old_user(username=name, openvpn_password='secret', expiry_date=date(2100, 1, 1))
+            for name in ('user10', 'user2', 'User1'))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        new_user = executor.loader.project_state(self.after).apps.get_model('vpn_manager', 'VPNUser')
+        self.assertEqual(list(new_user.objects.order_by('username_sort_key').values_list('username', flat=True)),
+                         ['User1', 'user2', 'user10'])
+        for username, key in new_user.objects.values_list('username', 'username_sort_key'):
+            self.assertEqual(key, natural_sort_key(username))
+
+
+class OutboxIdempotencyTests(TestCase):
+    def create_user(self, **fields):
+        return VPNUser.objects.create(username='alice', openvpn_password='secret', expiry_date=date(2100, 1, 1),
+                                      has_access_server_user=True, **fields)
+
+    def ops(self):
+        return list(VPNTask.objects.order_by('id').values_list('op', flat=True))
+
+    def test_same_change_saved_twice_is_queued_once(self):
+        user = self.create_user()
+        first, second = VPNUser.objects.get(pk=user.pk), VPNUser.objects.get(pk=user.pk)
+        for copy in (first, second):  # e.g. a double-submitted admin form
+            copy.is_active = False
+            copy.save()
+        first.save()  # nothing changed
+        self.assertEqual(self.ops(), [VPNTask.OP_PROVISION, VPNTask.OP_DENY])
+
+    def test_repeated_changes_are_queued_again(self):
+        user = self.create_user()
+        for active in (False, True, False):
+            user.is_active = active
+            user.save(update_fields=['is_active'])
+        self.assertEqual(self.ops(), [VPNTask.OP_PROVISION, VPNTask.OP_DENY, VPNTask.OP_PROVISION, VPNTask.OP_DENY])
+        self.assertEqual(VPNUser.objects.get(pk=user.pk).revision, 4)
+
+    def test_recreated_user_gets_new_keys(self):
+        self.create_user().delete()
+        self.create_user().delete()
+        self.assertEqual(self.ops(), [VPNTask.OP_PROVISION, VPNTask.OP_DISCONNECT] * 2)
+        self.assertEqual(VPNTask.objects.values('idempotency_key').distinct().count(), 4)
+
+    def test_done_tasks_lose_their_payload_and_are_pruned(self):
+        self.create_user()
+        task = VPNTask.objects.get()
+        self.assertIn('password', task.payload)
+        task.attempts = 1
+        outbox.finish([task], {task.id: True}, max_attempts=8)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.payload), (VPNTask.STATUS_DONE, {}))
+
+        later = task.processed_at + timedelta(days=outbox.VPN_TASK_RETENTION_DAYS)
+        self.assertEqual(outbox.prune(later - timedelta(seconds=1)), 0)
+        self.assertEqual(outbox.prune(later + timedelta(seconds=1)), 1)
+        self.assertFalse(VPNTask.objects.exists())
+
+
+class ChangeDetectionTests(TempPswFileMixin, TestCase):
+    def create_user(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = VPNUser.objects.create(username='alice', openvpn_password='secret', expiry_date=date(2100, 1, 1),
+                                          **fields)
+        VPNTask.objects.all().delete()
+        return VPNUser.objects.get(pk=user.pk)
+
+    def test_changed_fields(self):
+        user = self.create_user(has_access_server_user=False)
+        self.assertEqual(user.changed_fields, set())
+        user.expiry_date = date(2101, 1, 1)
+        self.assertEqual(user.changed_fields, {'expiry_date'})
+        self.assertIn('username', VPNUser(username='bob').changed_fields)
+
+    def test_expiry_only_edit_does_no_external_work(self):
+        for has_access_server_user in (False, True):
+            with self.subTest(has_access_server_user=has_access_server_user):
+                VPNUser.objects.all().delete()
+                user = self.create_user(has_access_server_user=has_access_server_user)
+                writes = psw_store.psw_store.writes
+                with mock.patch.object(sacli.SacliExecutor, 'run_chain') as run_chain, \
+                        self.captureOnCommitCallbacks(execute=True) as callbacks:
+                    user.expiry_date = date(2101, 1, 1)
+                    # The UPDATE alone: no SELECT of the old values, no outbox INSERT
+                    with self.assertNumQueries(1):
+                        user.save()
+                self.assertEqual(callbacks, [])
+                self.assertEqual(psw_store.psw_store.writes, writes)
+                self.assertFalse(VPNTask.objects.exists())
+                run_chain.assert_not_called()
+                self.assertEqual(VPNUser.objects.get(pk=user.pk).expiry_date, date(2101, 1, 1))
+
+    def test_relevant_edit_is_still_queued(self):
+        user = self.create_user(has_access_server_user=True)
+        user.openvpn_password = 'changed'
+        user.save()
+        self.assertEqual(list(VPNTask.objects.values_list('op', flat=True)), [VPNTask.OP_PROVISION])
+
+
+class SyncPswFileTests(TempPswFileMixin, TestCase):
+    def test_expired_users_are_deactivated_through_the_outbox(self):
+        for username, has_access_server_user, expiry_date in [('alice', True, date(2000, 1, 1)),
+                                                              ('bob', False, date(2000, 1, 1)),
+                                                              ('carol', True, date(2100, 1, 1))]:
+            VPNUser.objects.create(username=username, openvpn_password='secret', expiry_date=expiry_date,
+                                   has_access_server_user=has_access_server_user)
+        VPNTask.objects.all().delete()
+
+        call_command('sync_psw_file', stdout=io.StringIO())
+        call_command('sync_psw_file', stdout=io.StringIO())  # nothing left to do
+        self.assertEqual(list(VPNTask.objects.order_by('username').values_list('op', 'username', 'payload')), [
+            (VPNTask.OP_DENY, 'alice', {}),
+            (VPNTask.OP_DISCONNECT, 'bob', {'has_access_server_user': False}),
+        ])
+        self.assertEqual(list(VPNUser.objects.order_by('username').values_list('is_active', 'revision')),
+                         [(False, 2), (False, 2), (True, 1)])
+
+
+class ImportOcservUsersTests(TempPswFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(os.path.dirname(self.psw_path), 'ocserv.sqlite3')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE app_ocservgroup (id INTEGER PRIMARY KEY, configs TEXT)')
+            conn.execute('CREATE TABLE app_ocservuser (username TEXT, password TEXT, active INTEGER, '
+                         'expire_date TEXT, group_id INTEGER)')
+            conn.executemany('INSERT INTO app_ocservgroup VALUES (?, ?)',
+                             [(1, '{"max-same-clients": 3}'), (2, 'not json')])
+
+    def legacy(self, *rows):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM app_ocservuser')
+            conn.executemany('INSERT INTO app_ocservuser VALUES (?, ?, ?, ?, ?)', rows)
+
+    def run_import(self, chunk_size=2):
+        out = io.StringIO()
+        call_command('import_ocserv_users', db_path=self.db_path, chunk_size=chunk_size, stdout=out)
+        return out.getvalue()
+
+    def tasks(self):
+        return list(VPNTask.objects.order_by('id').values_list('op', 'username'))
+
+    def test_rows_are_upserted_chunk_by_chunk(self):
+        self.legacy(*[(f'user{i}', f'pw{i}', 1, '2100-01-01', 1) for i in (1, 2, 10, 3)],
+                    ('user1', 'last-wins', 1, 'garbage', 2))
+        output = self.run_import()
+        self.assertEqual(output.count(' rows ('), 3)  # 5 rows, 2 per chunk
+        self.assertIn('(created=4, updated=1, unchanged=0)', output)
+        self.assertEqual(
+            list(VPNUser.objects.order_by('username_sort_key').values_list(
+                'username', 'openvpn_password', 'max_connections', 'revision')),
+            [('user1', 'last-wins', 1, 2), ('user2', 'pw2', 3, 1), ('user3', 'pw3', 3, 1), ('user10', 'pw10', 3, 1)])
+        self.assertEqual(VPNUser.objects.get(username='user1').expiry_date, timezone.localdate())
+
+    def test_unchanged_rows_are_skipped(self):
+        rows = [('alice', 'secret', 1, '2100-01-01', 1), ('bob', 'secret', 1, '2100-01-01', 1)]
+        self.legacy(*rows)
+        self.run_import()
+        VPNTask.objects.all().delete()
+
+        self.assertIn('(created=0, updated=0, unchanged=2)', self.run_import())
+        self.assertEqual(list(VPNUser.objects.values_list('revision', flat=True)), [1, 1])
+        self.assertEqual(self.tasks(), [])
+
+        self.legacy(rows[0], ('bob', 'changed', 1, '2100-01-01', 1))
+        # One chunk: lookup, upsert, pk lookup, outbox insert (plus savepoint), then the psw sync
+        with self.assertNumQueries(7):
+            output = self.run_import()
+        self.assertIn('(created=0, updated=1, unchanged=1)', output)
+        self.assertEqual(list(VPNUser.objects.order_by('username').values_list('username', 'revision')),
+                         [('alice', 1), ('bob', 2)])
+
+    def test_new_and_changed_users_are_queued_in_the_outbox(self):
+        VPNUser.objects.create(username='plain', openvpn_password='old', expiry_date=date(2100, 1, 1),
+                               has_access_server_user=False)
+        self.legacy(('alice', 'secret', 1, '2100-01-01', 1), ('bob', 'secret', 1, '2100-01-01', 1),
+                    ('carol', 'secret', 0, '2100-01-01', 1))
+        self.run_import()
+        self.assertEqual(self.tasks(), [(VPNTask.OP_PROVISION, 'alice'), (VPNTask.OP_PROVISION, 'bob')])
+        VPNTask.objects.all().delete()
+
+        self.legacy(('alice', 'changed', 1, '2100-01-01', 1), ('bob', 'secret', 0, '2100-01-01', 1),
+                    ('carol', 'secret', 1, '2100-01-01', 1), ('plain', 'new', 1, '2100-01-01', 1))
+        self.run_import()
+        self.assertEqual(self.tasks(), [(VPNTask.OP_PROVISION, 'alice'), (VPNTask.OP_DENY, 'bob'),
+                                        (VPNTask.OP_PROVISION, 'carol')])
+        alice = VPNUser.objects.get(username='alice')
+        self.assertEqual(VPNTask.objects.get(username='alice').idempotency_key,
+                         outbox.change_key(VPNTask.OP_PROVISION, alice.pk, 2, 'changed', True, date(2100, 1, 1), 3))
+        # The plain user is not sent to Access Server but lands in the psw file
+        self.assertFalse(VPNUser.objects.get(username='plain').has_access_server_user)
+        with open(self.psw_path) as f:
+            self.assertEqual(f.read(), 'plain:new:3\n')
+
+
+class QuotaTests(TempPswFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.period = quota.current_period(self.now)
+        for username, monthly_quota in [('alice', 1000), ('bob', 0)]:
+            VPNUser.objects.create(username=username, openvpn_password='secret', expiry_date=date(2100, 1, 1),
+                                   has_access_server_user=True, monthly_quota=monthly_quota)
+        VPNTask.objects.all().delete()
+        self.enforcer = quota.QuotaEnforcer(flush_interval=60)
+
+    def usage(self, username):
+        return VPNUser.objects.values_list('quota_used', 'quota_period', 'quota_exceeded').get(username=username)
+
+    def test_usage_is_written_behind_in_one_update(self):
+        self.enforcer.process({'alice': [100, 50], 'bob': [10, 10]}, self.now)
+        self.enforcer.process({'alice': [200, 0]}, self.now + timedelta(seconds=30))
+        self.assertEqual(self.usage('alice'), (0, None, False))  # not due yet
+        with self.assertNumQueries(1):
+            self.enforcer.flush(self.now + timedelta(seconds=60))
+        self.assertEqual(self.usage('alice'), (350, self.period, False))
+        self.assertEqual(self.usage('bob'), (0, None, False))  # no quota, not counted
+
+    def test_usage_of_an_earlier_month_starts_over(self):
+        VPNUser.objects.filter(username='alice').update(quota_used=900, quota_period=date(2000, 1, 1))
+        self.enforcer.process({'alice': [100, 0]}, self.now)
+        self.enforcer.flush(self.now)
+        self.assertEqual(self.usage('alice'), (100, self.period, False))
+
+    def test_crossing_the_quota_denies_and_disconnects_on_every_route(self):
+        self.assertEqual(self.enforcer.process({'alice': [600, 0]}, self.now), ([], []))
+        denied, users = self.enforcer.process({'alice': [300, 100]}, self.now)
+        self.assertEqual((denied, [user.username for user in users]), (['alice'], ['alice']))
+        self.assertEqual(self.usage('alice'), (1000, self.period, True))
+        self.assertEqual(list(VPNTask.objects.values_list('op', flat=True)), [VPNTask.OP_DENY])
+
+        sessions = [VPNSession(username='alice', source=source, node=node) for source, node in [
+            (VPNSession.SOURCE_SACLI, ''), (VPNSession.SOURCE_API, 'node-a'), (VPNSession.SOURCE_API, 'node-b')]]
+        api_calls = []
+        with mock.patch.object(quota, 'prop_deny_user_sacli_commands', return_value=True) as deny, \
+                mock.patch.object(utils, 'kill_user', return_value=True) as kill_local, \
+                mock.patch.object(utils, 'kill_users_via_api',
+                                  side_effect=lambda by_node: api_calls.append(by_node) or {'alice': True}):
+            self.assertEqual(self.enforcer.disconnect(users, sessions), {'alice': True})
+        deny.assert_called_once_with('alice', 'true')
+        kill_local.assert_called_once_with('alice', True)
+        self.assertCountEqual(api_calls, [{'node-a': ['alice']}, {'node-b': ['alice']}])
+
+        # Still moving traffic: disconnected again, not denied twice
+        self.assertEqual(self.enforcer.process({'alice': [10, 0]}, self.now), ([], users))
+
+    def test_raised_quota_wins_over_the_in_memory_usage(self):
+        self.enforcer.process({'alice': [600, 0]}, self.now)
+        VPNUser.objects.filter(username='alice').update(monthly_quota=5000)
+        self.assertEqual(self.enforcer.process({'alice': [600, 0]}, self.now), ([], []))
+        self.assertEqual(self.usage('alice'), (1200, self.period, False))
+
+    def test_reset_quotas_zeroes_old_months_and_lifts_denials(self):
+        VPNUser.objects.create(username='carol', openvpn_password='secret', expiry_date=date(2100, 1, 1),
+                               has_access_server_user=True, monthly_quota=1000)
+        VPNUser.objects.filter(username='alice').update(
+            quota_used=1500, quota_period=date(2000, 1, 1), quota_exceeded=True)
+        VPNUser.objects.filter(username='carol').update(
+            quota_used=1500, quota_period=self.period, quota_exceeded=True)
+        VPNTask.objects.all().delete()
+
+        self.assertEqual(quota.reset_quotas(self.now), (1, ['alice']))
+        self.assertEqual(self.usage('alice'), (0, self.period, False))
+        self.assertEqual(self.usage('carol'), (1500, self.period, True))  # still over this month
+        self.assertEqual(list(VPNTask.objects.values_list('op', 'username')), [(VPNTask.OP_PROVISION, 'alice')])
+        self.assertEqual(quota.reset_quotas(self.now), (0, []))
+
+
+@mock.patch.multiple(collector, TRAFFIC_ACCOUNTING=False, CONNECTION_HISTORY=False, QUOTA_ENFORCEMENT=False)
+class CollectorStoreTests(TestCase):
+    def session(self, username, real_address, node=None, bytes_sent=0):
+        return ClientSession(username, real_address, '10.8.0.2', bytes_sent=bytes_sent, node=node)
+
+    def rows(self):
+        return list(VPNSession.objects.order_by('username').values_list('username', 'source', 'node', 'bytes_sent'))
+
+    def test_failed_node_keeps_its_rows(self):
+        now = timezone.now()
+        collector.store({
+            VPNSession.SOURCE_STATUS_LOG: [self.session('alice', '198.51.100.1:1194')],
+            VPNSession.SOURCE_API: [self.session('bob', '198.51.100.2:1194', 'node1'),
+                                    self.session('carol', '198.51.100.3:1194', 'node2'),
+                                    self.session('dave', '198.51.100.4:1194', 'node2')],
+        }, now)
+
+        # node1 did not answer, node2 did without dave, the status log failed as a whole
+        stored, removed = collector.store({
+            VPNSession.SOURCE_API: [self.session('carol', '198.51.100.3:1194', 'node2', bytes_sent=5)],
+        }, now + timedelta(minutes=1), failed_nodes={'node1'})
+        self.assertEqual((stored, removed), (1, 1))
+        self.assertEqual(self.rows(), [
+            ('alice', VPNSession.SOURCE_STATUS_LOG, '', 0),
+            ('bob', VPNSession.SOURCE_API, 'node1', 0),
+            ('carol', VPNSession.SOURCE_API, 'node2', 5),
+        ])
+
+    def test_stale_rows_of_a_source_that_answered_are_removed(self):
+        now = timezone.now()
+        collector.store({VPNSession.SOURCE_STATUS_LOG: [self.session('alice', '198.51.100.1:1194'),
+                                                        self.session('bob', '198.51.100.2:1194')]}, now)
+        self.assertEqual(collector.store({VPNSession.SOURCE_STATUS_LOG: []}, now + timedelta(minutes=1)), (0, 2))
+        self.assertFalse(VPNSession.objects.exists())
+
+    def test_session_seen_by_two_sources_is_stored_once(self):
+        session = self.session('alice', '198.51.100.1:1194')
+        collector.store({VPNSession.SOURCE_STATUS_LOG: [session], VPNSession.SOURCE_MGMT: [session]})
+        self.assertEqual(self.rows(), [('alice', VPNSession.SOURCE_MGMT, '', 0)])
+
+    def test_collect_reports_failed_nodes(self):
+        def sessions_via_api(failed_nodes):
+            failed_nodes.add('node1')
+            return [self.session('carol', '198.51.100.3:1194', 'node2')]
+
+        VPNSession.objects.create(session_key='api:node1::198.51.100.2:1194:bob', username='bob',
+                                  source=VPNSession.SOURCE_API, node='node1', real_address='198.51.100.2:1194',
+                                  last_seen=timezone.now() - timedelta(minutes=1))
+        with mock.patch.object(collector, 'get_sessions_via_api', sessions_via_api):
+            result = collector.collect([VPNSession.SOURCE_API])
+        self.assertEqual((result['sessions'], result['removed'], result['failed_nodes']), (1, 0, ['node1']))
+        self.assertEqual([row[0] for row in self.rows()], ['bob', 'carol'])
+
+
+class TrafficAccountingTests(TestCase):
+    def test_counters_that_go_down_restart_from_zero(self):
+        counters = accounting.SessionCounters()
+        now = timezone.now()
+        since = now - timedelta(hours=1)
+
+        def poll(received, sent, connected_since=since):
+            session = ClientSession('alice', '198.51.100.1:1', '10.8.0.2', bytes_received=received,
+                                    bytes_sent=sent, connected_since=connected_since)
+            return counters.deltas([session], now)
+
+        self.assertEqual(poll(100, 50), {'alice': [100, 50]})  # new session: its counters as they are
+        self.assertEqual(poll(150, 80), {'alice': [50, 30]})
+        self.assertEqual(poll(150, 80), {})
+        self.assertEqual(poll(20, 10), {'alice': [20, 10]})  # counters restarted, never negative
+        self.assertEqual(poll(500, 500, connected_since=now), {'alice': [500, 500]})  # reconnected
+
+    def test_daily_rollup_totals(self):
+        day = accounting.start_of_day(timezone.now() - timedelta(days=3))
+        samples = [
+            ('alice', day + timedelta(hours=1), 100, 10),
+            ('alice', day + timedelta(hours=1, minutes=30), 200, 20),
+            ('alice', day + timedelta(hours=23), 300, 30),
+            ('bob', day + timedelta(hours=5), 7, 3),
+            ('alice', day + timedelta(days=1, hours=2), 1000, 0),
+        ]
+        TrafficSample.objects.bulk_create([TrafficSample(username=username, ts=ts, bytes_received=received,
+                                                         bytes_sent=sent) for username, ts, received, sent in samples])
+
+        def rollups(period):
+            return sorted(TrafficRollup.objects.filter(period=period).values_list(
+                'username', 'start', 'bytes_received', 'bytes_sent'))
+
+        accounting.rollup()
+        self.assertEqual(rollups(TrafficRollup.PERIOD_DAY), [
+            ('alice', day, 600, 60), ('alice', day + timedelta(days=1), 1000, 0), ('bob', day, 7, 3),
+        ])
+        self.assertEqual(rollups(TrafficRollup.PERIOD_HOUR)[0], ('alice', day + timedelta(hours=1), 300, 30))
+
+        # Running again re-rolls the last buckets without counting anything twice
+        TrafficSample.objects.create(username='alice', ts=day + timedelta(days=1, hours=2, minutes=10),
+                                     bytes_received=1, bytes_sent=1)
+        accounting.rollup()
+        self.assertEqual(rollups(TrafficRollup.PERIOD_DAY), [
+            ('alice', day, 600, 60), ('alice', day + timedelta(days=1), 1001, 1), ('bob', day, 7, 3),
+        ])
+
+
+class ConnectionHistoryTests(TestCase):
+    def session(self, username, real_address, virtual_address, source=VPNSession.SOURCE_STATUS_LOG, node='',
+                connected_since=None):
+        return VPNSession(username=username, source=source, node=node, real_address=real_address,
+                          virtual_address=virtual_address, connected_since=connected_since)
+
+    def intervals(self):
+        return list(ConnectionInterval.objects.order_by('username', 'start').values_list(
+            'username', 'real_ip', 'real_port', 'virtual_ip', 'start', 'end'))
+
+    def test_observe_opens_and_closes_intervals(self):
+        recorder = history.ConnectionHistory()
+        t0 = timezone.now().replace(microsecond=0)
+        alice = self.session('alice', '198.51.100.1:5000', '10.8.0.2', connected_since=t0 - timedelta(minutes=5))
+        bob = self.session('bob', '203.0.113.9:6000', '172.27.224.2', source=VPNSession.SOURCE_API, node='node-b')
+        sources = [VPNSession.SOURCE_STATUS_LOG, VPNSession.SOURCE_API]
+        recorder.observe([alice, bob], sources, [], t0)
+        recorder.observe([alice, bob], sources, [], t0 + timedelta(minutes=1))
+        # alice is gone from a source that answered, bob's node did not answer
+        recorder.observe([], sources, ['node-b'], t0 + timedelta(minutes=2))
+        recorder.flush(t0 + timedelta(minutes=2))
+        self.assertEqual(self.intervals(), [
+            ('alice', '198.51.100.1', 5000, '10.8.0.2', t0 - timedelta(minutes=5), t0 + timedelta(minutes=1)),
+            ('bob', '203.0.113.9', 6000, '172.27.224.2', t0, t0 + timedelta(minutes=1)),
+        ])
+        self.assertEqual(list(recorder._open), [('node-b', 'bob', '203.0.113.9', 6000)])  # still open
+
+        # Reconnecting from the same address starts a new interval
+        again = self.session('alice', '198.51.100.1:5000', '10.8.0.3', connected_since=t0 + timedelta(minutes=3))
+        recorder.observe([again], sources, [], t0 + timedelta(minutes=4))
+        recorder.flush(t0 + timedelta(minutes=4))
+        self.assertEqual(ConnectionInterval.objects.filter(username='alice').count(), 2)
+
+    def test_who_had_an_address_at_a_time(self):
+        t0 = timezone.now().replace(microsecond=0) - timedelta(days=3)
+        ConnectionInterval.objects.bulk_create([
+            # Two users behind one NAT address
+            ConnectionInterval(username='alice', real_ip='198.51.100.1', real_port=5000, virtual_ip='10.8.0.2',
+                               start=t0, end=t0 + timedelta(hours=2)),
+            ConnectionInterval(username='bob', real_ip='198.51.100.1', real_port=6000, virtual_ip='10.8.0.3',
+                               start=t0 + timedelta(hours=1), end=t0 + timedelta(hours=3)),
+            ConnectionInterval(username='carol', real_ip='198.51.100.1', real_port=7000, virtual_ip='10.8.0.2',
+                               start=t0 + timedelta(hours=5), end=t0 + timedelta(hours=6)),
+        ])
+
+        def who_had(address, at):
+            return [interval.username for interval in history.who_had(address, at, slack=timedelta(0))]
+
+        self.assertEqual(who_had('198.51.100.1', t0 + timedelta(minutes=90)), ['alice', 'bob'])
+        self.assertEqual(who_had('198.51.100.1:6000', t0 + timedelta(minutes=90)), ['bob'])
+        self.assertEqual(who_had('10.8.0.2', t0 + timedelta(minutes=330)), ['carol'])
+        self.assertEqual(who_had('198.51.100.1', t0 + timedelta(hours=4)), [])
+        self.assertEqual(who_had('::ffff:198.51.100.1', t0 + timedelta(minutes=10)), ['alice'])
+
+    def test_compact_merges_quick_reconnects(self):
+        now = timezone.now().replace(microsecond=0)
+        day = now - timedelta(days=2)
+        ConnectionInterval.objects.bulk_create([
+            ConnectionInterval(username='alice', real_ip='198.51.100.1', real_port=5000, virtual_ip='10.8.0.2',
+                               start=day, end=day + timedelta(minutes=10)),
+            # Back after two minutes from another port: merged, the port is dropped
+            ConnectionInterval(username='alice', real_ip='198.51.100.1', real_port=5001, virtual_ip='10.8.0.2',
+                               start=day + timedelta(minutes=12), end=day + timedelta(minutes=20)),
+            # An hour later: a separate interval
+            ConnectionInterval(username='alice', real_ip='198.51.100.1', real_port=5002, virtual_ip='10.8.0.2',
+                               start=day + timedelta(minutes=80), end=day + timedelta(minutes=90)),
+        ])
+        self.assertEqual(history.compact(now), (1, 1))
+        self.assertEqual(self.intervals(), [
+            ('alice', '198.51.100.1', 0, '10.8.0.2', day, day + timedelta(minutes=20)),
+            ('alice', '198.51.100.1', 5002, '10.8.0.2', day + timedelta(minutes=80), day + timedelta(minutes=90)),
+        ])
+        self.assertEqual(history.compact(now), (0, 0))
+
+
+class EnforceKillTests(SimpleTestCase):
+    def test_access_server_sessions_are_skipped_on_every_node(self):
+        plain = ClientSession('alice', '198.51.100.1:1', '10.8.0.2', client_id=7, node='node-a')
+        remote_as = ClientSession('alice', '198.51.100.2:1', '172.27.224.2', daemon='openvpn_0', node='node-a')
+        local_as = ClientSession('alice', '198.51.100.3:1', '172.27.224.3', daemon='openvpn_1')
+        with mock.patch.object(enforce, 'kill_sessions_via_api', return_value=[True]) as kill_via_api:
+            killed, failed, skipped = enforce.kill([
+                (VPNSession.SOURCE_API, plain), (VPNSession.SOURCE_API, remote_as), (VPNSession.SOURCE_SACLI, local_as),
+            ])
+        kill_via_api.assert_called_once_with([plain])
+        self.assertEqual((killed, failed, skipped), ([plain], [], [remote_as, local_as]))
+
+
+class AdminKillUserTests(TestCase):
+    def setUp(self):
+        self.users = [
+            VPNUser.objects.create(username=username, openvpn_password='secret', expiry_date=date(2100, 1, 1),
+                                   has_access_server_user=True)
+            for username in ('alice', 'bob')
+        ]
+        for username, source, node in [('alice', VPNSession.SOURCE_SACLI, ''),
+                                       ('alice', VPNSession.SOURCE_API, 'node-a'),
+                                       ('alice', VPNSession.SOURCE_API, 'node-b'),
+                                       ('bob', VPNSession.SOURCE_API, 'node-b')]:
+            VPNSession.objects.create(session_key=f'{source}:{node}:{username}', username=username, source=source,
+                                      node=node, last_seen=timezone.now())
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.failing_nodes = set()
+        self.api_calls = []
+
+    def kill_via_api(self, usernames_by_node):
+        self.api_calls.append(usernames_by_node)
+        return {username: node not in self.failing_nodes
+                for node, usernames in usernames_by_node.items() for username in usernames}
+
+    def request(self, send):
+        with mock.patch.object(utils, 'kill_user', return_value=True) as kill_local, \
+                mock.patch.object(utils, 'kill_users_via_api', side_effect=self.kill_via_api):
+            response = send()
+        kill_local.assert_called_once_with('alice', True)
+        return [str(message) for message in response.context['messages']]
+
+    def kill(self, user):
+        return self.request(lambda: self.client.get(reverse('admin:vpnuser-kill', args=[user.pk]), follow=True))
+
+    def disconnect_selected(self):
+        return self.request(lambda: self.client.post(reverse('admin:vpn_manager_vpnuser_changelist'), {
+            'action': 'disconnect_selected', '_selected_action': [user.pk for user in self.users],
+        }, follow=True))
+
+    def remaining(self):
+        return sorted(VPNSession.objects.values_list('username', 'node'))
+
+    def test_local_and_remote_sessions_are_all_killed(self):
+        self.assertEqual(self.kill(self.users[0]), ['Disconnected alice'])
+        self.assertCountEqual(self.api_calls, [{'node-a': ['alice']}, {'node-b': ['alice']}])
+        self.assertEqual(self.remaining(), [('bob', 'node-b')])
+
+    def test_failed_route_keeps_its_sessions_and_reports_an_error(self):
+        self.failing_nodes.add('node-b')
+        self.assertEqual(self.kill(self.users[0]), ['Error disconnecting alice'])
+        self.assertEqual(self.remaining(), [('alice', 'node-b'), ('bob', 'node-b')])
+
+    def test_disconnect_selected_kills_every_route_of_every_user(self):
+        self.assertEqual(self.disconnect_selected(), ['Disconnected 2 user(s)'])
+        self.assertCountEqual(self.api_calls, [{'node-a': ['alice']}, {'node-b': ['alice', 'bob']}])
+        self.assertEqual(self.remaining(), [])
+
+    def test_disconnect_selected_keeps_the_sessions_of_failed_routes(self):
+        self.failing_nodes.add('node-b')
+        self.assertEqual(self.disconnect_selected(), ['Error disconnecting 2 user(s): alice, bob'])
+        self.assertEqual(self.remaining(), [('alice', 'node-b'), ('bob', 'node-b')])
+
+
+class ClientInfoApiTests(SimpleTestCase):
+    def setUp(self):
+        self.read_sacli = mock.AsyncMock(return_value=[
+            ClientSession('alice', '198.51.100.1:1', '172.27.224.2', daemon='openvpn_0'),
+        ])
+        for name, value in [('status_log', None), ('sacli_sessions', None), ('read_vpn_status_async', self.read_sacli),
+                            ('client_info_history', client_info_api.ClientInfoHistory())]:
+            patcher = mock.patch.object(client_info_api, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        client_info_api.client_info_snapshot.invalidate()
+        self.client = TestClient(client_info_api.app)
+        self.version = self.get().headers['x-client-info-version']
+
+    def get(self, headers=None, **params):
+        client_info_api.client_info_snapshot.invalidate()
+        return self.client.get('/client-info', params=params, headers=headers)
+
+    def test_failed_sacli_read_keeps_the_snapshot_and_version(self):
+        self.read_sacli.side_effect = subprocess.CalledProcessError(1, ['sacli', 'VPNStatus'])
+        response = self.get(since=self.version)
+        self.assertEqual(response.json(), {'version': self.version, 'full': False, 'changed': {}, 'removed': []})
+        self.assertEqual(self.client.get('/sessions').json()[0]['username'], 'alice')
+
+    def test_not_modified_only_for_the_same_answer(self):
+        etag = f'"{self.version}"'
+        self.assertEqual(self.get({'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.get({'If-None-Match': etag}, since=self.version).status_code, 304)
+        since = f'{client_info_api.client_info_history.epoch}-0'
+        self.assertEqual(self.get({'If-None-Match': etag}, since=since).json()['changed'],
+                         {'alice': {'real_address': '198.51.100.1:1', 'virtual_address': '172.27.224.2'}})
+        filtered = self.get({'If-None-Match': etag}, users='bob')
+        self.assertEqual((filtered.status_code, filtered.json()), (200, {}))
+        self.assertEqual(self.get({'If-None-Match': filtered.headers['etag']}, users='bob').status_code, 304)
+
+
+class ExpirySchedulerEventTests(FakeServerTestCase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = ManagementClient('127.0.0.1', self.server.port, timeout=5)
+        self.addCleanup(self.client.close)
+        self.scheduler = ExpiryScheduler(self.client, client_auth=True)
+        VPNUser.objects.create(username='alice', openvpn_password='x', expiry_date=date(2000, 1, 1),
+                               has_access_server_user=False)
+
+    def test_connect_arriving_during_a_reply_is_answered(self):
+        is_allowed = self.scheduler.is_allowed
+
+        def connect_bob_meanwhile(username, now=None):
+            if username == 'carol':
+                # Sent before the reply to carol's client-auth-nt
+                self.bob = self.server.connect_client('bob')
+            return is_allowed(username, now)
+
+        self.scheduler.is_allowed = connect_bob_meanwhile
+        self.client.connect()
+        carol = self.server.connect_client('carol')
+        alice = self.server.connect_client('alice')
+        self.assertTrue(wait_for(lambda: self.client.listen(0.1) >= 0 and len(self.scheduler.events) == 2))
+        self.assertEqual(self.scheduler.handle_events(), 3)
+        self.assertEqual(self.scheduler.events, [])
+        self.assertEqual(self.server.commands, [
+            f'client-auth-nt {carol} 0', f'client-deny {alice} 0 "account expired"', f'client-auth-nt {self.bob} 0'])
+        self.assertEqual(self.scheduler.stats['allowed'], 2)
+        self.assertEqual(self.scheduler.stats['denied'], 1)
+
+
+class ManagementListenerTests(FakeServerTestCase):
+    def run_listener(self, test, **kwargs):
+        """Run `test(listener)` on an event loop while the listener is connected."""
+        async def main():
+            listener = ManagementListener('127.0.0.1', self.server.port, timeout=5, reconnect_delay=0.05, **kwargs)
+            task = asyncio.create_task(listener.run())
+            try:
+                await asyncio.wait_for(listener.connected.wait(), 5)
+                await test(listener)
+            finally:
+                listener.stop()
+                await asyncio.wait_for(task, 5)
+        asyncio.run(main())
+
+    def addresses(self, listener):
+        return sorted((s.username, s.real_address) for s in listener.snapshot())
+
+    def test_table_is_rebuilt_from_status_on_connect_and_reconnect(self):
+        self.server.add_client('alice', real_address='198.51.100.1:40000')
+        self.server.add_client('bob', real_address='198.51.100.2:40000')
+
+        async def test(listener):
+            self.assertEqual(self.addresses(listener), [('alice', '198.51.100.1:40000'), ('bob', '198.51.100.2:40000')])
+            self.assertEqual(self.server.commands[:2], ['bytecount 5', 'status 2'])
+            # Changes while the connection is down arrive with no notification
+            self.server.drop_connections()
+            await async_wait_for(lambda: not listener.connected.is_set())
+            self.server.remove_client('alice')
+            self.server.add_client('carol', real_address='198.51.100.3:40000')
+            self.assertTrue(await async_wait_for(lambda: listener.stats['resyncs'] == 2))
+            self.assertEqual(self.addresses(listener), [('bob', '198.51.100.2:40000'), ('carol', '198.51.100.3:40000')])
+
+        self.run_listener(test)
+
+    def test_established_and_disconnect_update_the_table(self):
+        async def test(listener):
+            cid = self.server.establish_client('alice', real_address='198.51.100.1:40000', virtual_address='10.8.0.9')
+            self.assertTrue(await async_wait_for(lambda: cid in listener.sessions))
+            session = listener.sessions[cid]
+            self.assertEqual((session.username, session.real_address, session.virtual_address, session.client_id),
+                             ('alice', '198.51.100.1:40000', '10.8.0.9', cid))
+            self.server.add_traffic(cid, 100, 200)
+            self.server.disconnect_client(cid)
+            self.assertTrue(await async_wait_for(lambda: cid not in listener.sessions))
+
+        self.run_listener(test)
+
+    def test_bytecounts_are_coalesced_per_client(self):
+        listener = ManagementListener()
+        listener.sessions = {1: ClientSession('alice', '198.51.100.1:1', '10.8.0.2', client_id=1)}
+        for received in (10, 20, 30):
+            listener._coalesce_bytecount(f'>BYTECOUNT_CLI:1,{received},{received * 2}')
+        listener._coalesce_bytecount('>BYTECOUNT_CLI:2,5,5')  # unknown client
+        self.assertEqual(listener.stats['coalesced'], 2)
+        listener._apply_bytecounts()
+        self.assertEqual((listener.sessions[1].bytes_received, listener.sessions[1].bytes_sent), (30, 60))
+        self.assertEqual(listener.stats['bytecounts'], 2)
+
+    def test_bytecounts_reach_the_table(self):
+        cid = self.server.add_client('alice')
+
+        async def test(listener):
+            self.server.add_traffic(cid, 1000, 2000)
+            self.assertTrue(await async_wait_for(lambda: listener.sessions[cid].bytes_sent == 2000))
+            self.assertEqual(listener.sessions[cid].bytes_received, 1000)
+
+        self.run_listener(test, bytecount=0.05)
+
+
+class ListenerCommandTests(FakeServerTestCase, TransactionTestCase):
+    def run_command(self, test, **options):
+        """Run the command's main loop with `test(listener)` alongside it."""
+        options = {'bytecount': 0, 'flush': 0.01, 'interval': 0.1, 'enforce': False, **options}
+        command = ListenerCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        listener = ManagementListener('127.0.0.1', self.server.port, timeout=5, bytecount=0)
+
+        async def main():
+            loop = asyncio.create_task(command.main(listener, options))
+            try:
+                await asyncio.wait_for(listener.connected.wait(), 5)
+                await test(listener)
+            finally:
+                listener.stop()
+                await asyncio.wait_for(loop, 5)
+        async_to_sync(main)()
+
+    async def stored(self):
+        return await sync_to_async(lambda: sorted(VPNSession.objects.values_list('username', 'real_address')))()
+
+    async def stored_is(self, expected):
+        return await self.stored() == expected
+
+    def test_sessions_are_mirrored_into_vpnsession(self):
+        self.server.add_client('alice', real_address='198.51.100.1:40000')
+
+        async def test(listener):
+            self.assertTrue(await async_wait_for(
+                lambda: self.stored_is([('alice', '198.51.100.1:40000')])))
+            cid = self.server.establish_client('bob', real_address='198.51.100.2:40000')
+            self.assertTrue(await async_wait_for(
+                lambda: self.stored_is([('alice', '198.51.100.1:40000'), ('bob', '198.51.100.2:40000')])))
+            self.server.disconnect_client(cid)
+            self.assertTrue(await async_wait_for(lambda: self.stored_is([('alice', '198.51.100.1:40000')])))
+
+        self.run_command(test)
+
+    def test_enforce_kills_the_oldest_sessions_over_the_limit(self):
+        VPNUser.objects.create(username='alice', openvpn_password='x', expiry_date=date(2100, 1, 1),
+                               has_access_server_user=False, max_connections=1)
+        now = time.time()
+        oldest = self.server.add_client('alice', real_address='198.51.100.1:40000', connected_since=now - 60)
+        other = self.server.add_client('bob', real_address='198.51.100.2:40000', connected_since=now - 60)
+
+        async def test(listener):
+            newest = self.server.establish_client('alice', real_address='198.51.100.3:40000', connected_since=now)
+            self.assertTrue(await async_wait_for(lambda: oldest not in self.server.clients))
+            self.assertIn(newest, self.server.clients)
+            self.assertIn(other, self.server.clients)
+            self.assertIn(f'client-kill {oldest}', self.server.commands)
+            self.assertTrue(await async_wait_for(lambda: self.stored_is(
+                [('alice', '198.51.100.3:40000'), ('bob', '198.51.100.2:40000')])))
+
+        self.run_command(test, enforce=True)
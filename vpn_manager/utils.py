@@ -1,7 +1,5 @@
-import json
 import os
-import telnetlib
-import subprocess
+import threading
 from urllib.parse import quote
 
 import requests
@@ -9,50 +7,62 @@ from decouple import config
 from django.conf import settings
 
 
-from vpn_manager.models import VPNUser
+from vpn_manager.batch import BatchExecutor
+from vpn_manager.models import VPNSession, VPNUser
+from vpn_manager.mgmt import get_management_client
+from vpn_manager.nodes import node_client
+from vpn_manager.sacli import SacliExecutor, deny_commands, disconnect_user, provision_commands
+from vpn_manager.sacli_status import read_vpn_status
+from vpn_manager.sessions import ClientSession
+from vpn_manager.status_log import StatusLogReader
+
+try:
+    import msgpack
+except ImportError:  # optional: JSON only
+    msgpack = None
 
-# Management interface connection settings (configure via env vars)
-MGMT_HOST = config('OPENVPN_MGMT_HOST', default='127.0.0.1')
-MGMT_PORT = int(config('OPENVPN_MGMT_PORT', default=7505))
-MGMT_TIMEOUT = int(config('OPENVPN_MGMT_TIMEOUT', default=5))  # seconds
 OPEN_VPN_LOG = config('OPEN_VPN_LOG', default='/var/log/openvpn/status.log')
+# Shared parsed snapshot of OPEN_VPN_LOG, reused by the admin and the commands
+status_log = StatusLogReader(OPEN_VPN_LOG)
 
 SACLI = settings.SACLI_FULL_PATH
-CLIENT_API_BASE_URL = config('CLIENT_API_BASE_URL', default='http://127.0.0.1:8000').rstrip('/')
-CLIENT_INFO_API_URL = f'{CLIENT_API_BASE_URL}/client-info'
-CLIENT_INFO_API_TIMEOUT = int(config('CLIENT_INFO_API_TIMEOUT', default=5))
-CLIENT_DISCONNECT_API_TEMPLATE = f'{CLIENT_API_BASE_URL}/client/{{username}}/disconnect'
+# Paths on every client_info_api node (see vpn_manager.nodes for the registry)
+CLIENT_INFO_API_PATH = '/client-info'
+CLIENT_DISCONNECT_API_TEMPLATE = '/client/{username}/disconnect'
+CLIENT_BATCH_DISCONNECT_API_PATH = '/clients/disconnect'
+CLIENT_SESSIONS_API_PATH = '/sessions'
+CLIENT_SESSIONS_KILL_API_PATH = '/sessions/kill'
+CLIENT_INFO_ACCEPT = 'application/msgpack, application/json;q=0.9' if msgpack else 'application/json'
+BATCH_CONCURRENCY = config('OPENVPN_BATCH_CONCURRENCY', default=8, cast=int)
+
+# Last client-info version per node, kept current with ?since= deltas:
+# {node name: (version, {username: info})}
+_client_info_versions = {}
+_client_info_lock = threading.Lock()
+
+# Shared executor for bulk operations (mass disconnects, ...)
+batch_executor = BatchExecutor(BATCH_CONCURRENCY)
+
+# Every sacli call goes through this pool (see vpn_manager.sacli)
+sacli_executor = SacliExecutor(
+    SACLI,
+    max_workers=config('SACLI_CONCURRENCY', default=4, cast=int),
+    retries=config('SACLI_RETRIES', default=2, cast=int),
+    backoff=config('SACLI_RETRY_BACKOFF', default=0.5, cast=float),
+    timeout=config('SACLI_TIMEOUT', default=60, cast=int),
+)
 
 
 def get_connected_usernames():
     """
-    Connects to the OpenVPN management interface via Telnet, issues 'status',
-    and returns a set of usernames (common names) currently connected.
+    Asks the OpenVPN management interface for 'status' through the shared
+    client and returns a set of usernames (common names) currently connected.
     """
-    users = set()
     try:
-        # Open Telnet connection to the management interface
-        tn = telnetlib.Telnet(MGMT_HOST, MGMT_PORT, timeout=MGMT_TIMEOUT)
-        # Read and discard the initial banner line(s)
-        # The banner typically ends with a newline, so read until newline
-        tn.read_until(b"\n", timeout=MGMT_TIMEOUT)
-        # Send the 'status' command
-        tn.write(b"status\n")
-        # Read response until the 'END' marker followed by newline
-        raw_output = tn.read_until(b"END\n", timeout=MGMT_TIMEOUT)
-        output = raw_output.decode('utf-8', errors='ignore')
-        # Close the Telnet connection
-        tn.close()
-        # Parse each line for CLIENT_LIST entries
-        for line in output.splitlines():
-            if line.startswith('CLIENT_LIST'):
-                parts = line.split(',')
-                if len(parts) > 1:
-                    users.add(parts[1])
+        return get_management_client().connected_usernames()
     except Exception:
         # On error (timeout, connection refused), return an empty set
         return set()
-    return users
 
 
 
@@ -64,45 +74,14 @@ def get_client_info():
     """
     info = {}
 
-    # 1. Read from OpenVPN log
-    try:
-        with open(OPEN_VPN_LOG, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                if line.startswith('CLIENT_LIST'):
-                    parts = line.split(',')
-                    # parts: ['CLIENT_LIST', username, real_addr, virt_addr, ...]
-                    if len(parts) >= 4:
-                        _, username, real_addr, virt_addr = parts[:4]
-                        info[username] = {
-                            'real_address': real_addr,
-                            'virtual_address': virt_addr,
-                        }
-    except Exception:
-        pass  # If reading the log fails, proceed with only the sacli results
+    # 1. Read from OpenVPN log (re-parsed only when the file has changed)
+    info.update(status_log.snapshot().client_info())
 
-    # 2. Retrieve connected users with `has_access_server_user = True` using sacli command
+    # 2. Retrieve connected users with `has_access_server_user = True` from
+    #    every openvpn_N daemon via `sacli VPNStatus` (parsed in-process)
     try:
-        # Execute the sacli command and parse the output
-        result = subprocess.run(
-            f"{SACLI} VPNStatus | /usr/bin/jq '.openvpn_0.client_list'",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            shell=True,  # Run the command in a shell to handle the pipe
-            check=True
-            )
-        client_list = json.loads(result.stdout)
-        
-        for client in client_list:
-            username = client[0].replace("_AUTOLOGIN", "")  # Username is at index 0 in the client info
-            real_addr = client[1]  # Real Address is at index 1
-            virt_addr = client[2]  # Virtual Address is at index 2
-
-            # Add to the info dictionary
-            info[username] = {
-                'real_address': real_addr,
-                'virtual_address': virt_addr,
-            }
+        for session in read_vpn_status(SACLI):
+            info[session.username] = session.as_info()
     except Exception as e:
         print(f"Error fetching client info from sacli: {e}")
 
@@ -110,134 +89,302 @@ def get_client_info():
 
 
 
-def get_client_info_via_api():
-    """Call the FastAPI client-info endpoint and return the parsed payload."""
-    try:
-        response = requests.get(CLIENT_INFO_API_URL, timeout=CLIENT_INFO_API_TIMEOUT)
+def _decode(response):
+    if response.headers.get('Content-Type', '').startswith('application/msgpack'):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+
+def fetch_client_info(node, usernames=None):
+    """
+    {username: info} of one node. Without `usernames` the node's last version
+    is kept and only what changed since is transferred (nothing at all when
+    the node answers 304). With `usernames` only those users are asked for.
+    """
+    headers = {'Accept': CLIENT_INFO_ACCEPT}
+    url = node.url(CLIENT_INFO_API_PATH)
+    if usernames is not None:
+        response = node_client.session.get(
+            url, params={'users': ','.join(usernames)}, headers=headers, timeout=node.timeout)
         response.raise_for_status()
-        payload = response.json()
-        if isinstance(payload, dict):
-            return payload
-        print('Unexpected response shape from client-info API')
-    except (requests.RequestException, ValueError) as exc:
-        print(f'Error calling client-info API: {exc}')
-    return {}
+        return _decode(response)
+
+    with _client_info_lock:
+        version, info = _client_info_versions.get(node.name, (None, None))
+    if version is not None:
+        headers['If-None-Match'] = f'"{version}"'
+    response = node_client.session.get(
+        url, params={'since': version or '0'}, headers=headers, timeout=node.timeout)
+    if response.status_code == 304 and info is not None:
+        return info
+    response.raise_for_status()
+    payload = _decode(response)
+    if 'version' not in payload:
+        return payload  # node without versioning: the plain map
+    if payload['full'] or info is None:
+        info = payload['changed']
+    elif payload['changed'] or payload['removed']:
+        info = {**info, **payload['changed']}
+        for username in payload['removed']:
+            info.pop(username, None)
+    with _client_info_lock:
+        _client_info_versions[node.name] = (payload['version'], info)
+    return info
+
+
+def get_client_info_via_api(usernames=None):
+    """
+    Merged client-info payload of every VPN node, fetched in parallel
+    (optionally only for `usernames`). Each entry is tagged with the node
+    that reported it; nodes that fail or time out are skipped.
+    """
+    if usernames is not None:
+        usernames = list(usernames)
+        if not usernames:
+            return {}
+    info = {}
+    for name, payload in node_client.fan_out(lambda node: fetch_client_info(node, usernames)).items():
+        if isinstance(payload, Exception):
+            print(f'Error calling client-info API on node {name}: {payload}')
+        elif not isinstance(payload, dict):
+            print(f'Unexpected response shape from client-info API on node {name}')
+        else:
+            for username, data in payload.items():
+                info[username] = dict(data, node=name)
+    return info
 
 
-def kill_user_via_api(username):
-    """Request a disconnect via the API; mirror kill_user by returning True/False."""
+def kill_user_via_api(username, node=None):
+    """Request a disconnect via the API of `node`; mirror kill_user by returning True/False."""
     encoded_username = quote(str(username), safe='')
-    url = CLIENT_DISCONNECT_API_TEMPLATE.format(username=encoded_username)
     try:
-        response = requests.get(url, timeout=CLIENT_INFO_API_TIMEOUT)
-        response.raise_for_status()
-        payload = response.json()
+        payload = node_client.request(
+            node_client.node(node), 'GET', CLIENT_DISCONNECT_API_TEMPLATE.format(username=encoded_username))
         if isinstance(payload, dict):
             if payload.get('ok', True):
                 return True
             print(f"Disconnect API reported failure for {username}: {payload}")
             return False
         print('Unexpected response shape from disconnect API')
-    except (requests.RequestException, ValueError) as exc:
+    except (requests.RequestException, ValueError, KeyError) as exc:
         print(f"Error disconnecting {username} via API: {exc}")
     return False
 
 
+def kill_users_via_api(usernames_by_node):
+    """
+    Disconnect users on the nodes holding their sessions, one batch call per
+    node, all nodes in parallel. Takes {node name: [username, ...]} (a plain
+    list of usernames targets the only node). Returns {username: True/False}.
+    """
+    if not isinstance(usernames_by_node, dict):
+        usernames_by_node = {None: list(usernames_by_node)}
+    usernames_by_node = {node: list(names) for node, names in usernames_by_node.items() if names}
+    results = {username: False for names in usernames_by_node.values() for username in names}
+    try:
+        nodes = {}
+        for name, usernames in usernames_by_node.items():
+            nodes.setdefault(node_client.node(name), []).extend(usernames)
+    except KeyError as exc:
+        print(f"Error disconnecting users via API: {exc}")
+        return results
+
+    def disconnect(node):
+        return node_client.request(node, 'POST', CLIENT_BATCH_DISCONNECT_API_PATH,
+                                   json={'usernames': nodes[node]},
+                                   timeout=node.timeout + len(nodes[node]))
+
+    answered = {}
+    for name, payload in node_client.fan_out(disconnect, nodes).items():
+        oks = {}
+        try:
+            if isinstance(payload, Exception):
+                raise payload
+            oks = {username: bool(result.get('ok')) for username, result in payload.get('results', {}).items()}
+        except (requests.RequestException, ValueError, AttributeError, TimeoutError) as exc:
+            print(f"Error disconnecting users via API on node {name}: {exc}")
+        # A user connected to several nodes is disconnected only if every node succeeded
+        for username in nodes[node_client.node(name)]:
+            answered[username] = answered.get(username, True) and oks.get(username, False)
+    results.update(answered)
+    return results
+
+
+def get_sessions_via_api(failed_nodes=None):
+    """
+    Every session the API nodes report (several per user if so), as
+    ClientSession tuples tagged with their node. Names of nodes that could
+    not be read are added to `failed_nodes`; raises if no node answered, so
+    callers can tell "no sessions" from "nodes unreachable".
+    """
+    sessions, errors = [], {}
+    for name, payload in node_client.fan_out(
+            lambda node: node_client.request(node, 'GET', CLIENT_SESSIONS_API_PATH)).items():
+        if isinstance(payload, Exception):
+            errors[name] = payload
+            continue
+        sessions.extend(ClientSession.from_dict(data)._replace(node=name) for data in payload)
+    if errors:
+        if failed_nodes is not None:
+            failed_nodes.update(errors)
+        if len(errors) == len(node_client.nodes):
+            raise ConnectionError('; '.join(f'{name}: {exc}' for name, exc in errors.items()))
+        for name, exc in errors.items():
+            print(f"Error reading sessions from node {name}: {exc}")
+    return sessions
+
+
+def kill_sessions_via_api(sessions):
+    """
+    Disconnect individual sessions on the nodes that hold them (one call per
+    node, in parallel); returns a list of True/False in the input order.
+    """
+    sessions = list(sessions)
+    oks = [False] * len(sessions)
+    nodes = {}
+    try:
+        for index, session in enumerate(sessions):
+            nodes.setdefault(node_client.node(session.node), []).append(index)
+    except KeyError as exc:
+        print(f"Error killing sessions via API: {exc}")
+        return oks
+
+    def kill(node):
+        refs = [
+            {'username': s.username, 'real_address': s.real_address,
+             'client_id': s.client_id, 'daemon': s.daemon}
+            for s in (sessions[index] for index in nodes[node])
+        ]
+        return node_client.request(node, 'POST', CLIENT_SESSIONS_KILL_API_PATH,
+                                   json={'sessions': refs}, timeout=node.timeout + len(refs))
+
+    for name, payload in node_client.fan_out(kill, nodes).items():
+        try:
+            if isinstance(payload, Exception):
+                raise payload
+            for index, result in zip(nodes[node_client.node(name)], payload['results']):
+                oks[index] = bool(result.get('ok'))
+        except (requests.RequestException, ValueError, KeyError, AttributeError, TimeoutError) as exc:
+            print(f"Error killing {len(nodes[node_client.node(name)])} session(s) via API on node {name}: {exc}")
+    return oks
+
+
 def get_connected_usernames_from_file():
     """
     Reads the OpenVPN status log file and returns a set of usernames (common names) currently connected.
     """
-    users = set()
-    try:
-        # Open and read the status log file
-        with open(OPEN_VPN_LOG, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                # Parse lines starting with CLIENT_LIST
-                if line.startswith('CLIENT_LIST'):
-                    parts = line.strip().split(',')
-                    if len(parts) > 1:
-                        users.add(parts[1])
-    except Exception:
-        # On error (file not found, permission issue), return an empty set
-        return set()
-    return users
+    return status_log.snapshot().usernames()
 
 
 def kill_user(username, has_access_server_user):
     """Admin view to send kill command via Telnet or via sacli if has_access_server_user"""
     if has_access_server_user:
-        try:
-            # Run the sacli command
-            subprocess.run(
-                [SACLI, '-u', username, 'DisconnectUser'],
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            return True
-        except subprocess.CalledProcessError as e:
-            # Log e.stderr or handle error as needed
-            return False
+        # Run the sacli command
+        return sacli_executor.run(disconnect_user(username)).ok
     else:
         try:
-            # Connect to management interface
-            tn = telnetlib.Telnet(MGMT_HOST, MGMT_PORT, timeout=MGMT_TIMEOUT)
-            # Read and discard the initial banner line
-            tn.read_until(b"\n", timeout=MGMT_TIMEOUT)
-            # Send kill command for the common name
-            cmd = f"kill {username}\n".encode('utf-8')
-            tn.write(cmd)
-            # Optionally read until the END marker to confirm
-            tn.read_until(b"END\n", timeout=MGMT_TIMEOUT)
-            tn.close()
-            return True
+            # Send kill command for the common name over the shared connection
+            return get_management_client().kill(username)
         except Exception as e:
             return False
 
 
-def create_user_sacli_commands(username: str, password: str):
+def kill_users(usernames):
+    """
+    Disconnect several non Access Server users over one management session.
+    Returns a dict of {username: True/False}.
+    """
     try:
-        # 1. Set user_auth_type to local
-        subprocess.run([
-            SACLI, '-u', username,
-            '--key', 'user_auth_type',
-            '--value', 'local',
-            'UserPropPut'
-        ], check=True)
-
-        # 2. Set local password
-        subprocess.run([
-            SACLI, '-u', username,
-            '--new_pass', password,
-            'SetLocalPassword'
-        ], check=True)
-
-        # 3. Set prop_autologin to true
-        subprocess.run([
-            SACLI, '-u', username,
-            '--key', 'prop_autologin',
-            '--value', 'true',
-            'UserPropPut'
-        ], check=True)
-
-        return True
-
-    except subprocess.CalledProcessError as e:
-        # Optionally log e.stdout or e.stderr here
-        print(f"Error running sacli command: {e}")
-        return False
-    
+        return get_management_client().kill_many(usernames)
+    except Exception as e:
+        print(f"Error disconnecting users via management interface: {e}")
+        return {username: False for username in usernames}
+
+
+def create_user_sacli_commands(username: str, password: str):
+    """
+    Set user_auth_type=local, the local password and prop_autologin=true.
+    Runs in the calling thread; returns True if every command succeeded.
+    """
+    return sacli_executor.run_chain(provision_commands(username, password))
+
 
 def prop_deny_user_sacli_commands(username: str, value: str):
-    try:
-        subprocess.run([
-            SACLI,
-            '-u', username,
-            '-k', 'prop_deny',
-            '-v', value,
-            'UserPropPut'
-        ], check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error setting prop_deny for {username}: {e}")
-        return False
+    return sacli_executor.run_chain(deny_commands(username, value))
+
+
+def submit_provision_user(username: str, password: str):
+    """Queue provisioning + prop_deny=false on the sacli pool; returns a Future."""
+    return sacli_executor.submit(
+        username, provision_commands(username, password) + deny_commands(username, "false"))
+
+
+def submit_deny_user(username: str, disconnect=True):
+    """Queue prop_deny=true (and a disconnect) on the sacli pool; returns a Future."""
+    commands = deny_commands(username, "true")
+    if disconnect:
+        commands.append(disconnect_user(username))
+    return sacli_executor.submit(username, commands)
+
+
+def session_routes(sessions):
+    """
+    Where users are connected, from (username, source, node) triples such as
+    VPNSession values: (usernames with a local session, {node: [usernames]}
+    for the sessions remote nodes reported).
+    """
+    local, remote = set(), {}
+    for username, source, node in sessions:
+        if source == VPNSession.SOURCE_API:
+            usernames = remote.setdefault(node, [])
+            if username not in usernames:
+                usernames.append(username)
+        else:
+            local.add(username)
+    return local, remote
+
+
+def disconnect_users(users, local_usernames, remote_usernames=None):
+    """
+    Disconnect many VPNUser objects at once on every route they are connected
+    through (see session_routes()): locally, Access Server users through sacli
+    (in parallel) and plain OpenVPN users through one management session, and
+    on each remote node through one batch call per node, all at the same
+    time. Users that are not connected anywhere are left out of the result.
+    Returns {username: {route: True/False}}, the route being None for the
+    local kill and the node name for a remote one.
+    """
+    remote_usernames = remote_usernames or {}
+    sacli_usernames, mgmt_usernames = [], []
+    for user in users:
+        if user.username in local_usernames:
+            if user.has_access_server_user:
+                sacli_usernames.append(user.username)
+            else:
+                mgmt_usernames.append(user.username)
+    wanted = {user.username for user in users}
+    remote_usernames = {node: [username for username in usernames if username in wanted]
+                        for node, usernames in remote_usernames.items()}
+
+    tasks = [('sacli', username) for username in sacli_usernames]
+    if mgmt_usernames:
+        tasks.append(('mgmt', None))
+    tasks.extend(('api', node) for node, usernames in remote_usernames.items() if usernames)
+
+    def run(task):
+        kind, key = task
+        if kind == 'sacli':
+            return {key: kill_user(key, True)}
+        if kind == 'mgmt':
+            return kill_users(mgmt_usernames)
+        return kill_users_via_api({key: remote_usernames[key]})
+
+    results = {}
+    for (kind, key), outcome in batch_executor.map(run, tasks).items():
+        route = key if kind == 'api' else None
+        if not isinstance(outcome, dict):
+            usernames = [key] if kind == 'sacli' else mgmt_usernames if kind == 'mgmt' else remote_usernames[key]
+            outcome = dict.fromkeys(usernames, False)
+        for username, ok in outcome.items():
+            results.setdefault(username, {})[route] = ok
+    return results
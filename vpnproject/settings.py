@@ -136,4 +136,8 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 OPENVPN_PSW_FILE = config('OPENVPN_PSW_FILE', '/etc/openvpn/psw-file')
 
-SACLI_FULL_PATH = config('SACLI_FULL_PATH', '/usr/sbin/sacli')
\ No newline at end of file
+# Optional compiled credential database mirrored from the psw file, read by
+# vpn_manager/auth_verify.py (e.g. /etc/openvpn/psw-file.db); empty disables it
+OPENVPN_PSW_DB = config('OPENVPN_PSW_DB', '')
+
+SACLI_FULL_PATH = config('SACLI_FULL_PATH', '/usr/sbin/sacli')